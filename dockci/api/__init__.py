@@ -1,2 +1,12 @@
 """ DockCI API routes """
-from . import config, job, jwt, project, time, user
+from . import (blob,
+               config,
+               job,
+               job_export,
+               jwt,
+               metrics,
+               project,
+               representations,
+               time,
+               user,
+               )
@@ -0,0 +1,33 @@
+""" API relating to blob storage """
+import redis
+
+from flask_restful import abort as rest_abort, Resource
+from flask_security import login_required
+from redis.exceptions import RedisError
+
+from dockci.metrics import metrics_provider
+from dockci.models.blob import BlobStats
+from dockci.server import API, redis_pool
+
+
+@metrics_provider('blobs')
+def blob_stats():
+    """ Hit/miss, bytes, and timing stats for blobs recorded in Redis """
+    with redis_pool() as redis_pool_:
+        return BlobStats.load(redis.Redis(connection_pool=redis_pool_))
+
+
+class BlobStatsDetail(Resource):
+    """ API resource to get blob cache stats per project/utility """
+    @login_required
+    def get(self):  # pylint:disable=no-self-use
+        """ Stats for each blob stats label """
+        try:
+            return blob_stats()
+        except RedisError:
+            rest_abort(503, message="Blob stats are unavailable")
+
+
+API.add_resource(BlobStatsDetail,
+                 '/blobs/stats',
+                 endpoint='blob_stats_detail')
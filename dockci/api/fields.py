@@ -8,10 +8,12 @@ import re
 
 from functools import reduce, wraps
 
+from flask import has_request_context, request
 from flask_restful import fields, inputs
 from werkzeug.routing import BuildError
 
-from dockci.util import gravatar_url
+from dockci.models.db_types import compile_regex
+from dockci.util import gravatar_url, url_template
 
 
 def value_path(obj, path):
@@ -48,7 +50,9 @@ def value_path(obj, path):
 class RewriteUrl(fields.Url):
     """
     Extension of the Flask RESTful Url field that allows you to remap object
-    fields to different names
+    fields to different names. Only the rewritten fields are given to
+    ``url_for``, so the object needn't have a ``__dict__``. Relative URLs are
+    built from a cached ``UrlTemplate`` for the endpoint, where possible
     """
     def __init__(self,
                  endpoint=None,
@@ -62,12 +66,28 @@ class RewriteUrl(fields.Url):
         if obj is None:
             return None
 
-        data = obj.__dict__
-        for field_set, field_from in self.rewrites.items():
-            data[field_set] = value_path(obj, field_from)
+        return self.url_for_values({
+            field_set: value_path(obj, field_from)
+            for field_set, field_from in self.rewrites.items()
+        })
+
+    def url_for_values(self, values):
+        """
+        URL for the endpoint, given the rewritten values. None if the URL
+        can't be built
+        """
+        if (
+            not self.absolute and
+            self.endpoint is not None and
+            has_request_context()
+        ):
+            template = url_template(self.endpoint)
+            if template is not None:
+                path = template.build(values)
+                return None if path is None else request.script_root + path
 
         try:
-            return super(RewriteUrl, self).output(key, data)
+            return super(RewriteUrl, self).output(None, values)
         except BuildError:
             return None
 
@@ -147,7 +167,7 @@ class RegexInput(object):
     """ Validate a RegEx """
     def __call__(self, value, name):  # pylint:disable=no-self-use
         try:
-            return re.compile(value)
+            return compile_regex(value)
         except re.error as ex:
             raise ValueError(str(ex))
 
@@ -6,18 +6,36 @@ import flask_restful
 import redis
 import redis_lock
 
-from flask import abort, request, url_for
-from flask_restful import fields, inputs, marshal_with, Resource
+from flask import abort, request, Response, url_for
+from flask_restful import fields, inputs, marshal, marshal_with, Resource
 from flask_security import current_user, login_required
 
 from . import fields as fields_
 from .base import BaseDetailResource, BaseRequestParser
 from .fields import datetime_or_now, GravatarUrl, NonBlankInput, RewriteUrl
-from .util import DT_FORMATTER
-from dockci.models.job import Job, JobResult, JobStageTmp
+from .marshal_compiler import compile_marshaler, marshal_with_compiled
+from .read_models import Computed, ReadModel
+from .util import (check_if_match,
+                   DT_FORMATTER,
+                   etag_headers,
+                   not_modified,
+                   version_etag,
+                   )
+from dockci.live_log import (FanoutError,
+                             get_fanout,
+                             job_events,
+                             parse_event_id,
+                             )
+from dockci.models.job import (Job,
+                               JobResult,
+                               JobStageTmp,
+                               SUPERSEDED_STATE,
+                               )
 from dockci.models.project import Project
-from dockci.server import API, CONFIG, pika_conn, redis_pool
-from dockci.stage_io import redis_len_key, redis_lock_name
+from dockci.placement import place_new_jobs
+from dockci.scheduler import claim_job
+from dockci.server import API, CONFIG, DB, pika_conn, redis_pool
+from dockci.stage_io import get_log_state, redis_len_key, redis_lock_name
 from dockci.util import str2bool, require_agent
 
 
@@ -40,6 +58,30 @@ LIST_FIELDS = {
 }
 LIST_FIELDS.update(BASIC_FIELDS)
 
+# Job read model values that aren't columns
+COMPUTED = {
+    'slug': Computed(
+        lambda row: Job.slug_from_id(row['id']),
+        id=Job.id,
+    ),
+    'state': Computed(
+        lambda row: Job.state_from(
+            row['result'], row['has_stages'], row['superseded_by_id'],
+        ),
+        result=Job.result,
+        superseded_by_id=Job.superseded_by_id,
+        has_stages=sqlalchemy.exists().where(
+            JobStageTmp.job_id == Job.id,
+        ),
+    ),
+}
+
+LIST_READ_MODEL = ReadModel(
+    'JobRecord', Job, LIST_FIELDS,
+    computed=COMPUTED,
+    constants=('project',),
+)
+
 ITEMS_MARSHALER = fields.List(fields.Nested(LIST_FIELDS))
 ALL_LIST_ROOT_FIELDS = {
     'items': ITEMS_MARSHALER,
@@ -70,6 +112,10 @@ DETAIL_FIELDS = {
         project_slug='project.slug',
         job_slug='ancestor_job.slug',
     )),
+    'superseded_by_detail': RewriteUrl('job_detail', rewrites=dict(
+        project_slug='project.slug',
+        job_slug='superseded_by.slug',
+    )),
     'project_detail': RewriteUrl('project_detail', rewrites=dict(
         project_slug='project.slug',
     )),
@@ -97,6 +143,27 @@ DETAIL_FIELDS = {
 DETAIL_FIELDS.update(BASIC_FIELDS)
 DETAIL_FIELDS.update(CREATE_FIELDS)
 
+# Deferred ``Job`` column groups that ``DETAIL_FIELDS`` read
+DETAIL_GROUPS = ('git', 'docker')
+
+LIST_SERIALIZER = compile_marshaler(ALL_LIST_ROOT_FIELDS, 'job_list')
+DETAIL_SERIALIZER = compile_marshaler(DETAIL_FIELDS, 'job_detail')
+LOOKUP_SERIALIZER = compile_marshaler({
+    'items': fields.List(fields.Nested(DETAIL_FIELDS)),
+}, 'job_lookup')
+
+# Most job, and commit references that can be looked up in one request
+LOOKUP_MAX_REFS = 100
+# Most jobs that a lookup returns, since commits can match many jobs
+LOOKUP_MAX_JOBS = 500
+
+CLAIM_FIELDS = {
+    'project_slug': fields.String(),
+    'command_repo': fields.String(),
+    'priority': fields.Integer(),
+}
+CLAIM_FIELDS.update(CREATE_FIELDS)
+
 JOB_NEW_PARSER = BaseRequestParser()
 JOB_NEW_PARSER.add_argument('commit',
                             required=True,
@@ -120,14 +187,34 @@ JOB_EDIT_PARSER.add_argument('git_committer_name')
 JOB_EDIT_PARSER.add_argument('git_committer_email')
 JOB_EDIT_PARSER.add_argument('ancestor_job_id')
 
+JOB_LOOKUP_PARSER = BaseRequestParser()
+JOB_LOOKUP_PARSER.add_argument('job',
+                               action='append', default=[],
+                               help="Job to look up, as project/job slugs")
+JOB_LOOKUP_PARSER.add_argument('commit',
+                               action='append', default=[],
+                               help="Commit to look up the jobs for")
+JOB_LOOKUP_PARSER.add_argument('project',
+                               help="Project slug to look up commits in")
+
 STAGE_EDIT_PARSER = BaseRequestParser()
 STAGE_EDIT_PARSER.add_argument('success', type=inputs.boolean)
 
 
-def get_validate_job(project_slug, job_slug):
-    """ Get the job object, validate that project slug matches expected """
+def get_validate_job(project_slug, job_slug, groups=(), for_update=False):
+    """
+    Get the job object, validate that project slug matches expected. Deferred
+    column ``groups`` are loaded with the job. With ``for_update``, the job
+    row is locked until commit
+    """
     job_id = Job.id_from_slug(job_slug)
-    job = Job.query.get_or_404(job_id)
+    query = Job.query.options(*(
+        sqlalchemy.orm.undefer_group(group) for group in groups
+    ))
+    if for_update:
+        query = query.with_for_update()
+
+    job = query.filter(Job.id == job_id).first_or_404()
     if job.project.slug != project_slug:
         flask_restful.abort(404)
 
@@ -137,6 +224,86 @@ def get_validate_job(project_slug, job_slug):
     return job
 
 
+def job_etag(job):
+    """
+    ETag for the details of a job. The details change with the job row, its
+    project's row, and how many stages it has
+    """
+    return version_etag(
+        job.version_id, job.project.version_id, len(job.job_stages),
+    )
+
+
+def get_validate_job_etag(project_slug, job_slug):
+    """
+    ETag for the details of a job, like ``job_etag``, from a query of only
+    versions. Validated like ``get_validate_job``, without loading the job
+    """
+    row = DB.session.query(
+        Job.version_id,
+        Project.version_id,
+        Project.public,
+        sqlalchemy.select([
+            sqlalchemy.func.count(JobStageTmp.id),
+        ]).where(JobStageTmp.job_id == Job.id).as_scalar(),
+    ).join(Job.project).filter(
+        Job.id == Job.id_from_slug(job_slug),
+        Project.slug == project_slug,
+    ).first()
+    if row is None:
+        flask_restful.abort(404)
+
+    job_version, project_version, public, stage_count = row
+    if not (public or current_user.is_authenticated()):
+        flask_restful.abort(404)
+
+    return version_etag(job_version, project_version, stage_count)
+
+
+def lookup_jobs(job_refs, commits, project_slug=None):
+    """
+    Query for jobs from ``project/job`` slug references, and jobs for
+    commits, optionally in the project with ``project_slug``. Jobs are loaded
+    with everything that ``DETAIL_FIELDS`` read, and only in projects that
+    the current user can see
+    """
+    conditions = []
+    for job_ref in job_refs:
+        try:
+            ref_project_slug, job_slug = job_ref.split('/')
+            job_id = Job.id_from_slug(job_slug)
+        except ValueError:
+            flask_restful.abort(
+                400, message="Invalid job reference '%s'" % job_ref,
+            )
+
+        conditions.append(sqlalchemy.and_(
+            Project.slug == ref_project_slug, Job.id == job_id,
+        ))
+
+    if commits:
+        commit_condition = Job.commit.in_(commits)
+        if project_slug is not None:
+            commit_condition = sqlalchemy.and_(
+                commit_condition, Project.slug == project_slug,
+            )
+        conditions.append(commit_condition)
+
+    query = Job.query.join(Job.project).filter(
+        sqlalchemy.or_(*conditions),
+    )
+    if not current_user.is_authenticated():
+        query = query.filter(Project.public)
+
+    return query.options(
+        sqlalchemy.orm.contains_eager(Job.project),
+        sqlalchemy.orm.joinedload(Job.ancestor_job),
+        sqlalchemy.orm.joinedload(Job.superseded_by),
+        sqlalchemy.orm.subqueryload(Job.job_stages),
+        *(sqlalchemy.orm.undefer_group(group) for group in DETAIL_GROUPS)
+    ).order_by(sqlalchemy.desc(Job.create_ts))
+
+
 def stage_from_job(job, stage_slug):
     """ Get a stage object from a job """
     try:
@@ -157,8 +324,8 @@ def get_validate_stage(project_slug, job_slug, stage_slug):
     return stage
 
 
-def filter_jobs_by_request(project):
-    """ Get all jobs for a project, filtered by some request parameters """
+def filter_args_from_request():
+    """ Keyword args for ``Job.filtered_query`` from request parameters """
     filter_args = {}
     for filter_name in ('passed', 'versioned', 'completed'):
         try:
@@ -177,9 +344,14 @@ def filter_jobs_by_request(project):
         except KeyError:
             pass
 
+    return filter_args
+
+
+def filter_jobs_by_request(project):
+    """ Get all jobs for a project, filtered by some request parameters """
     return Job.filtered_query(
         query=project.jobs.order_by(sqlalchemy.desc(Job.create_ts)),
-        **filter_args
+        **filter_args_from_request()
     )
 
 
@@ -187,7 +359,7 @@ def filter_jobs_by_request(project):
 
 class JobList(BaseDetailResource):
     """ API resource that handles listing, and creating jobs """
-    @marshal_with(ALL_LIST_ROOT_FIELDS)
+    @marshal_with_compiled(LIST_SERIALIZER)
     def get(self, project_slug):
         """ List all jobs for a project """
         project = Project.query.filter_by(slug=project_slug).first_or_404()
@@ -197,7 +369,7 @@ class JobList(BaseDetailResource):
 
         base_query = filter_jobs_by_request(project)
         return {
-            'items': base_query.paginate().items,
+            'items': LIST_READ_MODEL.page(base_query, project=project),
             'meta': {'total': base_query.count()},
         }
 
@@ -208,6 +380,8 @@ class JobList(BaseDetailResource):
         project = Project.query.filter_by(slug=project_slug).first_or_404()
         job = Job(project=project, repo_fs=project.repo_fs)
         self.handle_write(job, JOB_NEW_PARSER)
+        place_new_jobs([job])
+        DB.session.commit()
         job.queue()
 
         return job
@@ -236,27 +410,87 @@ class JobCommitsList(Resource):
 
 class JobDetail(BaseDetailResource):
     """ API resource to handle getting job details """
-    @marshal_with(DETAIL_FIELDS)
     def get(self, project_slug, job_slug):
-        """ Show job details """
-        return get_validate_job(project_slug, job_slug)
+        """
+        Show job details. ``If-None-Match`` is answered from row versions,
+        before the job is loaded
+        """
+        etag = get_validate_job_etag(project_slug, job_slug)
+        response = not_modified(etag)
+        if response is not None:
+            return response
+
+        job = get_validate_job(project_slug, job_slug, DETAIL_GROUPS)
+        return DETAIL_SERIALIZER(job), 200, etag_headers(job_etag(job))
 
     @require_agent
-    @marshal_with(DETAIL_FIELDS)
     def patch(self, project_slug, job_slug):
-        """ Update a job """
-        job = get_validate_job(project_slug, job_slug)
+        """
+        Update a job. When ``If-Match`` is given, the job is locked while
+        it's checked, and updated, so that agents don't overwrite changes
+        that they haven't seen
+        """
+        job = get_validate_job(
+            project_slug, job_slug, DETAIL_GROUPS,
+            for_update=bool(request.if_match),
+        )
+        check_if_match(job_etag(job))
+
         previous_state = job.state
+        if previous_state == SUPERSEDED_STATE:
+            flask_restful.abort(
+                409, message="Job was superseded by %s" % (
+                    job.superseded_by.slug,
+                ),
+            )
+
         self.handle_write(job, JOB_EDIT_PARSER)
         new_state = job.state
 
         if new_state != previous_state:
+            job.publish_state()
             if job.project.is_external:
                 job.send_external_status()
             if job.is_complete and job.changed_result():
                 job.send_email_notification()
 
-        return job
+        return DETAIL_SERIALIZER(job), 200, etag_headers(job_etag(job))
+
+
+class JobLookup(Resource):
+    """ API resource to get the details of many jobs at once """
+    @marshal_with_compiled(LOOKUP_SERIALIZER)
+    def get(self):  # pylint:disable=no-self-use
+        """
+        Details of jobs given as ``job`` references of project, and job slugs
+        (like ``myproject/00001a``), and of jobs for ``commit`` values. Jobs
+        that don't exist, or aren't visible are left out
+        """
+        args = JOB_LOOKUP_PARSER.parse_args()
+        if len(args['job']) + len(args['commit']) > LOOKUP_MAX_REFS:
+            flask_restful.abort(
+                400, message="At most %d jobs, and commits can be looked up "
+                             "at once" % LOOKUP_MAX_REFS,
+            )
+
+        if not (args['job'] or args['commit']):
+            return {'items': []}
+
+        return {'items': lookup_jobs(
+            args['job'], args['commit'], args['project'],
+        ).limit(LOOKUP_MAX_JOBS).all()}
+
+
+class JobClaim(Resource):
+    """ API resource for agents to claim the next job to run """
+    @require_agent
+    def post(self):  # pylint:disable=no-self-use
+        """ Claim the next job, by priority, and fair share of projects """
+        job = claim_job()
+        if job is None:
+            return '', 204
+
+        return marshal(job, CLAIM_FIELDS)
 
 
 class StageList(Resource):
@@ -280,10 +514,15 @@ class StageList(Resource):
 
 class StageDetail(BaseDetailResource):
     """ API resource to handle getting stage details """
-    @marshal_with(STAGE_DETAIL_FIELDS)
     def get(self, project_slug, job_slug, stage_slug):
         """ Show job stage details """
-        return get_validate_stage(project_slug, job_slug, stage_slug)
+        stage = get_validate_stage(project_slug, job_slug, stage_slug)
+        etag = version_etag(stage.version_id)
+        response = not_modified(etag)
+        if response is not None:
+            return response
+
+        return marshal(stage, STAGE_DETAIL_FIELDS), 200, etag_headers(etag)
 
     @require_agent
     @marshal_with(STAGE_DETAIL_FIELDS)
@@ -305,73 +544,232 @@ class ArtifactList(Resource):
         return get_validate_job(project_slug, job_slug).job_output_details
 
 
+def _legacy_log_state(redis_conn, job):
+    """
+    Log state from the per-stage byte counter, for producers that don't write
+    the log state hash. Must be called while holding the job's log lock
+    """
+    try:
+        stage = job.job_stages[-1]
+
+    except IndexError:
+        return None, 0
+
+    bytes_read = redis_conn.get(redis_len_key(stage))
+
+    # Sometimes Redis gives us bytes :\
+    try:
+        bytes_read = bytes_read.decode()
+    except AttributeError:
+        pass
+
+    return stage.slug, bytes_read
+
+
+def _shared_log_state(redis_conn, job):
+    """
+    Initial log state for a viewer of a shared queue, when the producer
+    doesn't write the log state hash. Chunks without sequence numbers can't be
+    told apart from those in the initial log, and a shared queue may already
+    hold some of them, so only a job without any log yet can be followed
+
+    Raises:
+      FanoutError: The job has log, but no log state hash
+    """
+    stage_slug, _ = _legacy_log_state(redis_conn, job)
+    if stage_slug is not None:
+        raise FanoutError(
+            "Live log fan-out needs the log state for %s/%s" % (
+                job.project.slug, job.slug,
+            )
+        )
+
+    # Every chunk is new
+    return None, 0, 0
+
+
+def _log_init_state(job, bind, shared=False):
+    """
+    Initial log stage slug, bytes, and sequence number for a new live log
+    viewer. ``bind`` is called to start receiving live messages for the job.
+
+    When the log producer records the log state hash (see ``set_log_state``),
+    ``bind`` is called before the state is read in one atomic operation, so
+    that no chunks are missed and no lock is needed. Chunks with a sequence
+    number up to ``init_seq`` are already included in ``init_log``.
+    Otherwise, falls back to taking the job's log lock while binding, and
+    reading the stage byte counter. That only works for a new queue, so a
+    ``shared`` queue, like the live log fan-out's, requires the log state
+    hash (see ``_shared_log_state``)
+    """
+    with redis_pool() as redis_pool_:
+        redis_conn = redis.Redis(connection_pool=redis_pool_)
+        if shared:
+            bind()
+            log_state = get_log_state(redis_conn, job)
+            if log_state is None:
+                return _shared_log_state(redis_conn, job)
+
+            return log_state
+
+        init_seq = None
+        if get_log_state(redis_conn, job) is not None:
+            bind()
+            stage_slug, bytes_read, init_seq = get_log_state(
+                redis_conn, job,
+            )
+
+        else:
+            with redis_lock.Lock(
+                redis_conn,
+                redis_lock_name(job),
+                expire=5,
+            ):
+                bind()
+                stage_slug, bytes_read = _legacy_log_state(
+                    redis_conn, job,
+                )
+
+    return stage_slug, int(bytes_read or 0), init_seq
+
+
+def _fanout_log_state_ok(job):
+    """ Whether the job's live log can be followed from the fan-out """
+    with redis_pool() as redis_pool_:
+        redis_conn = redis.Redis(connection_pool=redis_pool_)
+        if get_log_state(redis_conn, job) is not None:
+            return True
+
+        return _legacy_log_state(redis_conn, job)[0] is None
+
+
+def _log_init_detail(job, bind):
+    """ Initial log details for a new live log viewer, with a log URL """
+    stage_slug, bytes_read, init_seq = _log_init_state(job, bind)
+    return {
+        'init_stage': stage_slug,
+        'init_log': None if stage_slug is None else (
+            "{url}?count={count}".format(
+                url=url_for(
+                    'job_log_init_view',
+                    project_slug=job.project.slug,
+                    job_slug=job.slug,
+                    stage=stage_slug,
+                ),
+                count=bytes_read,
+            )
+        ),
+        'init_seq': init_seq,
+    }
+
+
 class StageStreamDetail(Resource):
     """ API resource to handle creating stage stream queues """
     def post(self, project_slug, job_slug):
-        """ Create a new stream queue for a job """
+        """
+        Create a new stream queue for a job. When live log fan-out is
+        enabled, no queue is created; the ``live_stream`` URL should be used
+        for server-sent events instead (see ``JobEvents``). Jobs with log
+        from producers that don't write the log state hash still get a queue
+        """
         job = get_validate_job(project_slug, job_slug)
+        if CONFIG.live_log_fanout and _fanout_log_state_ok(job):
+            return {'live_stream': url_for(
+                'job_events',
+                project_slug=project_slug,
+                job_slug=job_slug,
+            )}
+
         routing_key = 'dockci.{project_slug}.{job_slug}.*.*'.format(
             project_slug=project_slug,
             job_slug=job_slug,
         )
 
-        with redis_pool() as redis_pool_:
-            with pika_conn() as pika_conn_:
-                channel = pika_conn_.channel()
-                queue_result = channel.queue_declare(
-                    queue='dockci.job.%s' % uuid.uuid4().hex,
-                    arguments={
-                        'x-expires': CONFIG.live_log_session_timeout,
-                        'x-message-ttl': CONFIG.live_log_message_timeout,
-                    },
-                    durable=False,
+        with pika_conn() as pika_conn_:
+            channel = pika_conn_.channel()
+            queue_result = channel.queue_declare(
+                queue='dockci.job.%s' % uuid.uuid4().hex,
+                arguments={
+                    'x-expires': CONFIG.live_log_session_timeout,
+                    'x-message-ttl': CONFIG.live_log_message_timeout,
+                },
+                durable=False,
+            )
+
+            def bind():
+                """ Bind the new queue to the job's log messages """
+                channel.queue_bind(
+                    exchange='dockci.job',
+                    queue=queue_result.method.queue,
+                    routing_key=routing_key,
                 )
 
-                redis_conn = redis.Redis(connection_pool=redis_pool_)
-                with redis_lock.Lock(
-                    redis_conn,
-                    redis_lock_name(job),
-                    expire=5,
-                ):
-                    channel.queue_bind(
-                        exchange='dockci.job',
-                        queue=queue_result.method.queue,
-                        routing_key=routing_key,
-                    )
-
-                    try:
-                        stage = job.job_stages[-1]
-
-                    except IndexError:
-                        stage = None
-                        bytes_read = 0
-
-                    else:
-                        bytes_read = redis_conn.get(
-                            redis_len_key(stage)
-                        )
-
-                        # Sometimes Redis gives us bytes :\
-                        try:
-                            bytes_read = bytes_read.decode()
-                        except AttributeError:
-                            pass
+            detail = _log_init_detail(job, bind)
 
-        return {
-            'init_stage': None if stage is None else stage.slug,
-            'init_log': None if stage is None else (
-                "{url}?count={count}".format(
-                    url=url_for(
-                        'job_log_init_view',
-                        project_slug=project_slug,
-                        job_slug=job_slug,
-                        stage=stage.slug
-                    ),
-                    count=bytes_read,
+        detail['live_queue'] = queue_result.method.queue
+        return detail
+
+
+class JobEvents(Resource):
+    """
+    API resource to stream a job's log, stage, and state changes as
+    server-sent events. Connections are long-lived, so this is best served by
+    an async worker class
+    """
+    def get(self, project_slug, job_slug):  # pylint:disable=no-self-use
+        """
+        Catch up on stage logs, then stream live changes until the job is
+        complete (see ``job_events``). Resumes after the ``Last-Event-ID``
+        header, or ``last_event_id`` parameter when given
+        """
+        job = get_validate_job(project_slug, job_slug)
+        resume = parse_event_id(request.headers.get(
+            'Last-Event-ID', request.values.get('last_event_id'),
+        ))
+
+        subscription = None
+        if job.is_complete:
+            init_stage, init_bytes, init_seq = None, 0, None
+
+        else:
+            try:
+                fanout = get_fanout(
+                    project_slug, job_slug,
+                    CONFIG.live_log_session_timeout / 1000,
+                )
+            except FanoutError:
+                flask_restful.abort(503, message="Live log is unavailable")
+
+            subscriptions = []
+            try:
+                init_stage, init_bytes, init_seq = _log_init_state(
+                    job, lambda: subscriptions.append(fanout.subscribe()),
+                    shared=True,
                 )
+            except FanoutError as ex:
+                for subscription in subscriptions:
+                    subscription.close()
+                flask_restful.abort(503, message=str(ex))
+
+            subscription = subscriptions[0]
+
+        return Response(
+            job_events(
+                job.job_output_path(),
+                job.state_detail(),
+                [(stage.slug, stage.success) for stage in job.job_stages],
+                init_stage,
+                init_bytes,
+                init_seq,
+                subscription=subscription,
+                resume=resume,
             ),
-            'live_queue': queue_result.method.queue,
-        }
+            mimetype='text/event-stream',
+            headers={
+                'Cache-Control': 'no-cache',
+                'X-Accel-Buffering': 'no',
+            },
+        )
 
 
 API.add_resource(
@@ -389,6 +787,16 @@ API.add_resource(
     '/projects/<string:project_slug>/jobs/<string:job_slug>',
     endpoint='job_detail',
 )
+API.add_resource(
+    JobLookup,
+    '/jobs/lookup',
+    endpoint='job_lookup',
+)
+API.add_resource(
+    JobClaim,
+    '/jobs/claim',
+    endpoint='job_claim',
+)
 API.add_resource(
     StageList,
     '/projects/<string:project_slug>/jobs/<string:job_slug>/stages',
@@ -410,3 +818,8 @@ API.add_resource(
     '/projects/<string:project_slug>/jobs/<string:job_slug>/stream',
     endpoint='stage_stream_detail',
 )
+API.add_resource(
+    JobEvents,
+    '/projects/<string:project_slug>/jobs/<string:job_slug>/events',
+    endpoint='job_events',
+)
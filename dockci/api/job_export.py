@@ -0,0 +1,168 @@
+"""
+Bulk export of jobs as newline delimited JSON
+
+Rather than paging through the job list, with an ``OFFSET``, and ``count()``
+for every page, jobs are streamed oldest first from a server side cursor.
+Every line has a ``cursor`` for the job's ``(create_ts, id)``, so that an
+interrupted export can be resumed after the last line that was received
+"""
+
+from datetime import datetime
+
+import flask_restful
+import sqlalchemy
+
+from flask import request, Response, stream_with_context
+from flask_restful import fields, Resource
+from flask_security import current_user
+
+from .job import BASIC_FIELDS, COMPUTED, filter_args_from_request
+from .marshal_compiler import compile_marshaler
+from .read_models import Computed, ReadModel
+from .representations import dumps, NDJSON_MIMETYPE
+from .util import DT_FORMATTER
+from dockci.models.job import Job
+from dockci.models.project import Project
+from dockci.server import API
+
+
+EXPORT_BATCH_SIZE = 1000
+
+CURSOR_FORMATS = ('%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S')
+
+EXPORT_FIELDS = {
+    'cursor': fields.String(),
+    'project_slug': fields.String(),
+    'result': fields.String(),
+    'start_ts': DT_FORMATTER,
+    'complete_ts': DT_FORMATTER,
+    'exit_code': fields.Integer(default=None),
+}
+EXPORT_FIELDS.update(BASIC_FIELDS)
+
+EXPORT_READ_MODEL = ReadModel(
+    'JobExportRecord', Job, EXPORT_FIELDS,
+    computed=dict(
+        COMPUTED,
+        cursor=Computed(
+            lambda row: format_cursor(row['create_ts'], row['id']),
+            create_ts=Job.create_ts,
+            id=Job.id,
+        ),
+        project_slug=Computed(
+            lambda row: row['project_slug'],
+            project_slug=Project.slug,
+        ),
+    ),
+)
+
+EXPORT_SERIALIZER = compile_marshaler(EXPORT_FIELDS, 'job_export')
+
+
+def format_cursor(create_ts, job_id):
+    """
+    Cursor string for a job's position in an export
+
+    Examples:
+
+    >>> format_cursor(datetime(2016, 2, 3, 4, 5, 6, 789), 42)
+    '2016-02-03T04:05:06.000789,42'
+    """
+    return '%s,%d' % (create_ts.isoformat(), job_id)
+
+
+def parse_cursor(value):
+    """
+    Parse a cursor from ``format_cursor`` into its create timestamp, and job
+    ID
+
+    Examples:
+
+    >>> parse_cursor('2016-02-03T04:05:06.000789,42')
+    (datetime.datetime(2016, 2, 3, 4, 5, 6, 789), 42)
+    >>> parse_cursor('2016-02-03T04:05:06,42')
+    (datetime.datetime(2016, 2, 3, 4, 5, 6), 42)
+
+    >>> parse_cursor('2016-02-03T04:05:06')
+    Traceback (most recent call last):
+        ...
+    ValueError: Invalid cursor '2016-02-03T04:05:06'
+    """
+    try:
+        create_ts, job_id = value.rsplit(',', 1)
+        job_id = int(job_id)
+    except ValueError:
+        raise ValueError("Invalid cursor %r" % value)
+
+    for ts_format in CURSOR_FORMATS:
+        try:
+            return datetime.strptime(create_ts, ts_format), job_id
+        except ValueError:
+            pass
+
+    raise ValueError("Invalid cursor %r" % value)
+
+
+def export_query(query, after=None):
+    """
+    Order a ``Job`` query for export, oldest first, starting after the
+    ``(create_ts, id)`` given in ``after``. The keyset filter means that
+    resuming doesn't scan the jobs that were already exported
+    """
+    query = query.join(Job.project).order_by(None).order_by(
+        Job.create_ts, Job.id,
+    )
+    if after is not None:
+        query = query.filter(
+            sqlalchemy.tuple_(Job.create_ts, Job.id) >
+            sqlalchemy.tuple_(*after)
+        )
+
+    return query
+
+
+def export_lines(query, after=None, batch_size=EXPORT_BATCH_SIZE):
+    """ Generate NDJSON lines for jobs in a ``Job`` query """
+    for record in EXPORT_READ_MODEL.iter_records(
+        export_query(query, after), batch_size,
+    ):
+        yield dumps(EXPORT_SERIALIZER(record)) + b'\n'
+
+
+class JobExport(Resource):
+    """ API resource to stream all of a project's jobs as NDJSON """
+    def get(self, project_slug):  # pylint:disable=no-self-use
+        """
+        Stream jobs matching the same filters as ``JobList``. Starts after
+        the ``after`` cursor when given
+        """
+        project = Project.query.filter_by(slug=project_slug).first_or_404()
+
+        if not (project.public or current_user.is_authenticated()):
+            flask_restful.abort(404)
+
+        after = request.values.get('after')
+        if after is not None:
+            try:
+                after = parse_cursor(after)
+            except ValueError as ex:
+                flask_restful.abort(400, message=str(ex))
+
+        return Response(
+            stream_with_context(export_lines(
+                Job.filtered_query(
+                    query=project.jobs,
+                    **filter_args_from_request()
+                ),
+                after,
+            )),
+            mimetype=NDJSON_MIMETYPE,
+            headers={'X-Accel-Buffering': 'no'},
+        )
+
+
+API.add_resource(
+    JobExport,
+    '/projects/<string:project_slug>/jobs/export',
+    endpoint='job_export',
+)
@@ -0,0 +1,19 @@
+""" API relating to application metrics """
+from flask_restful import Resource
+from flask_security import login_required
+
+from dockci.metrics import collect_metrics
+from dockci.server import API
+
+
+class MetricsDetail(Resource):
+    """ API resource to get metrics from all registered providers """
+    @login_required
+    def get(self):  # pylint:disable=no-self-use
+        """ Current value of all metrics """
+        return collect_metrics()
+
+
+API.add_resource(MetricsDetail,
+                 '/metrics',
+                 endpoint='metrics_detail')
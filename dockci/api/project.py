@@ -7,7 +7,6 @@ import sqlalchemy
 from flask import request
 from flask_restful import (fields,
                            inputs,
-                           marshal,
                            marshal_with,
                            reqparse,
                            Resource,
@@ -23,14 +22,19 @@ from .fields import (GravatarUrl,
                      RegexInput,
                      RewriteUrl,
                      )
+from .marshal_compiler import compile_marshaler, marshal_with_compiled
+from .read_models import Computed, ReadModel
 from .util import (clean_attrs,
                    DT_FORMATTER,
+                   etag_headers,
                    new_edit_parsers,
+                   not_modified,
+                   version_etag,
                    )
-from dockci.models.auth import AuthenticatedRegistry
+from dockci.models.auth import AuthenticatedRegistry, OAuthToken
 from dockci.models.job import Job
 from dockci.models.project import Project
-from dockci.server import API
+from dockci.server import API, DB
 
 
 DOCKER_REPO_RE = re.compile(r'^[a-z0-9]+(?:[._-][a-z0-9]+)*$')
@@ -59,6 +63,41 @@ LIST_FIELDS = {
 }
 LIST_FIELDS.update(BASIC_FIELDS)
 
+_STATUS_JOB = sqlalchemy.orm.aliased(Job)
+# ``Project.status`` as a column expression
+STATUS_SCALAR = sqlalchemy.select([_STATUS_JOB.result]).where(
+    sqlalchemy.and_(
+        _STATUS_JOB.project_id == Project.id,
+        _STATUS_JOB.result.in_(('success', 'fail', 'broken')),
+    ),
+).order_by(
+    _STATUS_JOB.create_ts.desc(),
+).limit(1).as_scalar()
+
+LIST_READ_MODEL = ReadModel(
+    'ProjectRecord', Project, LIST_FIELDS,
+    computed={
+        'status': Computed(
+            lambda row: row['status'],
+            status=STATUS_SCALAR,
+        ),
+        'display_repo': Computed(
+            lambda row: Project.repo_fs_from(
+                row['repo'],
+                row['github_repo_id'],
+                row['gitlab_repo_id'],
+                row['token_service'],
+            ).format(token_key='****'),
+            repo=Project.repo,
+            github_repo_id=Project.github_repo_id,
+            gitlab_repo_id=Project.gitlab_repo_id,
+            token_service=sqlalchemy.select([OAuthToken.service]).where(
+                OAuthToken.id == Project.external_auth_token_id,
+            ).as_scalar(),
+        ),
+    },
+)
+
 LATEST_JOB_FIELDS = {
     'slug': fields.String(),
     'detail': RewriteUrl('job_detail', rewrites=dict(
@@ -79,7 +118,6 @@ LIST_FIELDS_LATEST_JOB = {
 LIST_FIELDS_LATEST_JOB.update(LIST_FIELDS)
 
 ITEMS_MARSHALER = fields.List(fields.Nested(LIST_FIELDS))
-ITEMS_MARSHALER_LATEST_JOB = fields.List(fields.Nested(LIST_FIELDS_LATEST_JOB))
 
 ALL_LIST_ROOT_FIELDS = {
     'items': ITEMS_MARSHALER,
@@ -99,6 +137,8 @@ DETAIL_FIELDS = {
     'github_hook_id': fields.String(),
     'gitlab_repo_id': fields.String(),
     'public': fields.Boolean(),
+    'coalesce_window': fields.Integer(default=None),
+    'max_concurrent_jobs': fields.Integer(default=None),
     'shield_text': fields.String(),
     'shield_color': fields.String(),
     'target_registry': RewriteUrl(
@@ -108,6 +148,13 @@ DETAIL_FIELDS = {
 }
 DETAIL_FIELDS.update(BASIC_FIELDS)
 
+ITEMS_SERIALIZER = compile_marshaler(LIST_FIELDS, 'project_list')
+ITEMS_SERIALIZER_LATEST_JOB = compile_marshaler(LIST_FIELDS_LATEST_JOB,
+                                                'project_list_latest_job')
+META_SERIALIZER = compile_marshaler(ALL_LIST_ROOT_FIELDS['meta'].nested,
+                                    'project_list_meta')
+DETAIL_SERIALIZER = compile_marshaler(DETAIL_FIELDS, 'project_detail')
+
 BASIC_BRANCH_FIELDS = {
     'name': fields.String(),
 }
@@ -141,6 +188,14 @@ SHARED_PARSER_ARGS = {
         help="Whether or not to allow read-only guest access",
         type=inputs.boolean,
     ),
+    'coalesce_window': dict(
+        help="Seconds in which a push supersedes queued jobs for its branch",
+        type=inputs.natural,
+    ),
+    'max_concurrent_jobs': dict(
+        help="Maximum jobs that agents may run for the project at once",
+        type=inputs.positive,
+    ),
 }
 
 UTILITY_ARG = dict(
@@ -223,6 +278,43 @@ def ensure_target_registry(required):
 
 # pylint:disable=no-self-use
 
+def project_etag(project):
+    """
+    ETag for the details of a project. The details change with the project
+    row, its status, and its target registry's name
+    """
+    return version_etag(
+        project.version_id,
+        project.status,
+        None if project.target_registry is None
+        else project.target_registry.base_name,
+    )
+
+
+def get_validate_project_etag(project_slug):
+    """
+    ETag for the details of a project, like ``project_etag``, from a query of
+    only versions, and the status. Aborts with 404 when the project isn't
+    visible
+    """
+    row = DB.session.query(
+        Project.version_id,
+        Project.public,
+        STATUS_SCALAR,
+        sqlalchemy.select([AuthenticatedRegistry.base_name]).where(
+            AuthenticatedRegistry.id == Project.target_registry_id,
+        ).as_scalar(),
+    ).filter(Project.slug == project_slug).first()
+    if row is None:
+        flask_restful.abort(404)
+
+    version, public, status, registry_name = row
+    if not (public or current_user.is_authenticated()):
+        flask_restful.abort(404)
+
+    return version_etag(version, status, registry_name)
+
+
 class ProjectList(Resource):
     """ API resource that handles listing projects """
     def get(self):
@@ -250,20 +342,21 @@ class ProjectList(Resource):
                 for field, value in filters.items()
             ])
 
-        marshaler = dict(items=ALL_LIST_ROOT_FIELDS['items'])
-        values = dict(items=query.all())
-
         args = PROJECT_LIST_PARSER.parse_args()
 
-        if args['meta']:
-            marshaler['meta'] = ALL_LIST_ROOT_FIELDS['meta']
-            values['meta'] = {'total': query.count()}
-            values['meta'].update(Project.get_status_summary(filters))
-
         if args['latest_job']:
-            marshaler['items'] = ITEMS_MARSHALER_LATEST_JOB
+            values = dict(items=ITEMS_SERIALIZER_LATEST_JOB(query.all()))
+        else:
+            values = dict(items=ITEMS_SERIALIZER(
+                LIST_READ_MODEL.records(query),
+            ))
+
+        if args['meta']:
+            meta = {'total': query.count()}
+            meta.update(Project.get_status_summary(filters))
+            values['meta'] = META_SERIALIZER(meta)
 
-        return marshal(values, marshaler)
+        return values
 
 
 class ProjectDetail(BaseDetailResource):
@@ -271,16 +364,23 @@ class ProjectDetail(BaseDetailResource):
     API resource to handle getting project details, creating new projects,
     updating existing projects, and deleting projects
     """
-    @marshal_with(DETAIL_FIELDS)
     def get(self, project_slug):
-        """ Get project details """
+        """
+        Get project details. ``If-None-Match`` is answered from the row
+        version, before the project is loaded
+        """
+        etag = get_validate_project_etag(project_slug)
+        response = not_modified(etag)
+        if response is not None:
+            return response
+
         project = Project.query.filter_by(slug=project_slug).first_or_404()
-        if not (project.public or current_user.is_authenticated()):
-            flask_restful.abort(404)
-        return project
+        return DETAIL_SERIALIZER(project), 200, etag_headers(
+            project_etag(project),
+        )
 
     @login_required
-    @marshal_with(DETAIL_FIELDS)
+    @marshal_with_compiled(DETAIL_SERIALIZER)
     def put(self, project_slug):
         """ Create a new project """
         try:
@@ -309,7 +409,7 @@ class ProjectDetail(BaseDetailResource):
         return self.handle_write(Project(), data=args)
 
     @login_required
-    @marshal_with(DETAIL_FIELDS)
+    @marshal_with_compiled(DETAIL_SERIALIZER)
     def post(self, project_slug):
         """ Update an existing project """
         project = Project.query.filter_by(slug=project_slug).first_or_404()
@@ -0,0 +1,192 @@
+"""
+Lightweight read path for list endpoints
+
+Rather than hydrating full ORM objects, only the columns that a marshaler
+reads are selected with a Core select, into plain records. The columns
+are worked out from the marshaler's fields, so that adding a field to
+``LIST_FIELDS`` adds its column to the select
+"""
+
+from flask import abort, request
+
+from .fields import GravatarUrl, RewriteUrl
+from dockci.server import DB
+
+
+class Record(object):  # pylint:disable=too-few-public-methods
+    """
+    Values of a read model row, as attributes. Records aren't tuples, since
+    ``marshal`` would treat them as a list of objects
+    """
+    __slots__ = ()
+
+    def __init__(self, **values):
+        for name, value in values.items():
+            setattr(self, name, value)
+
+
+class Computed(object):  # pylint:disable=too-few-public-methods
+    """
+    A record value that's not a column, computed from the given labeled
+    column expressions
+    """
+    def __init__(self, func, **inputs):
+        self.func = func
+        self.inputs = inputs
+
+
+def field_attrs(key, field):
+    """
+    Top level attribute names that a marshal field reads from an object
+
+    Examples:
+
+    >>> sorted(field_attrs('detail', RewriteUrl('job_detail', rewrites=dict(
+    ...     project_slug='project.slug', job_slug='slug',
+    ... ))))
+    ['project', 'slug']
+    >>> field_attrs('avatar', GravatarUrl(attr_name='email_obj.email'))
+    {'email_obj'}
+    >>> from flask_restful import fields
+    >>> field_attrs('name', fields.String())
+    {'name'}
+    >>> field_attrs('name', fields.String(attribute='display_name'))
+    {'display_name'}
+    """
+    if isinstance(field, RewriteUrl):
+        return {path.split('.')[0] for path in field.rewrites.values()}
+
+    if isinstance(field, GravatarUrl):
+        path = key if field.attr_name is None else field.attr_name
+        return {path.split('.')[0]}
+
+    attribute = getattr(field, 'attribute', None)
+    if attribute is None:
+        return {key}
+
+    if callable(attribute):
+        raise ValueError("Field '%s' has a callable attribute" % key)
+
+    return {attribute.split('.')[0]}
+
+
+class ReadModel(object):
+    """
+    Select only the columns that ``fields`` read from ``model`` rows into
+    ``Record`` objects. Attributes that aren't columns must be given in
+    ``computed``, or be ``constants`` that are passed to ``records``
+    """
+    def __init__(self, name, model, fields_, computed=None, constants=()):
+        computed = computed or {}
+        columns = model.__table__.columns
+
+        attrs = set()
+        for key, field in fields_.items():
+            attrs.update(field_attrs(key, field))
+
+        expressions = {}
+        getters = []
+        for attr in sorted(attrs):
+            if attr in constants:
+                getters.append((attr, None))
+
+            elif attr in computed:
+                expressions.update(computed[attr].inputs)
+                getters.append((attr, computed[attr].func))
+
+            elif attr in columns:
+                expressions[attr] = columns[attr]
+                getters.append((attr, None))
+
+            else:
+                raise ValueError(
+                    "No column, or computed value for '%s' of %s" % (
+                        attr, model.__name__,
+                    )
+                )
+
+        self.record_type = type(name, (Record,), {
+            '__slots__': tuple(attr for attr, _ in getters),
+        })
+        self.getters = getters
+        self.constants = frozenset(constants)
+        self.expressions = [
+            expression.label(label)
+            for label, expression in sorted(expressions.items())
+        ]
+
+    def statement(self, query):
+        """
+        Core select of only the needed columns, keeping the filters, order,
+        and limits of the ORM ``query``
+        """
+        return query.with_entities(*self.expressions).statement
+
+    def _check_constants(self, constants):
+        """ Ensure that all constants that records need are given """
+        missing = self.constants.difference(constants)
+        if missing:
+            raise ValueError("Missing constants: %s" % ", ".join(missing))
+
+    def _records(self, rows, constants):
+        """ Generate records for result rows """
+        record_type = self.record_type
+        getters = self.getters
+        for row in rows:
+            yield record_type(**{
+                attr: (
+                    constants[attr] if attr in constants
+                    else row[attr] if func is None
+                    else func(row)
+                )
+                for attr, func in getters
+            })
+
+    def records(self, query, **constants):
+        """ Records for each row of the ORM ``query`` """
+        self._check_constants(constants)
+        return list(self._records(
+            DB.session.execute(self.statement(query)), constants,
+        ))
+
+    def iter_records(self, query, batch_size=1000, **constants):
+        """
+        Generate records for each row of the ORM ``query``, like
+        ``Query.yield_per``. Rows are read from a server side cursor
+        ``batch_size`` at a time, so memory use doesn't grow with the number
+        of rows
+        """
+        self._check_constants(constants)
+        result = DB.session.execute(
+            self.statement(query).execution_options(stream_results=True),
+        )
+        try:
+            while True:
+                rows = result.fetchmany(batch_size)
+                if not rows:
+                    break
+
+                for record in self._records(rows, constants):
+                    yield record
+
+        finally:
+            result.close()
+
+    def page(self, query, **constants):
+        """
+        Records for the page of the ORM ``query`` given in request args, like
+        Flask-SQLAlchemy's ``paginate``
+        """
+        page = request.args.get('page', 1, type=int)
+        per_page = request.args.get('per_page', 20, type=int)
+        if page < 1 or per_page < 0:
+            abort(404)
+
+        items = self.records(
+            query.limit(per_page).offset((page - 1) * per_page),
+            **constants
+        )
+        if not items and page != 1:
+            abort(404)
+
+        return items
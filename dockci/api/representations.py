@@ -0,0 +1,128 @@
+"""
+Response representations for the API
+
+JSON is encoded with ``orjson`` when it's installed, falling back to the
+Flask RESTful encoder. Lists are also available as newline delimited JSON,
+with one item per line, for clients that send ``Accept: application/x-ndjson``
+"""
+
+import datetime
+import json
+
+from flask import current_app, make_response, Response
+from flask_restful.representations.json import output_json as restful_json
+
+from .util import DT_FORMATTER
+from dockci.server import API
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+
+def json_default(value):
+    """
+    Encode values that JSON can't. Date/times are formatted like
+    ``DT_FORMATTER``
+
+    Examples:
+
+    >>> json_default(datetime.datetime(2016, 2, 3, 4, 5, 6))
+    '2016-02-03T04:05:06'
+
+    >>> json_default(object())
+    Traceback (most recent call last):
+        ...
+    TypeError: Can't encode object as JSON
+    """
+    if isinstance(value, datetime.datetime):
+        return DT_FORMATTER.format(value)
+
+    raise TypeError("Can't encode %s as JSON" % type(value).__name__)
+
+
+def dumps(data):
+    """
+    JSON bytes for ``data``, with the fast encoder if it's installed
+
+    Examples:
+
+    >>> dumps({'create_ts': datetime.datetime(2016, 2, 3, 4, 5, 6)})
+    b'{"create_ts":"2016-02-03T04:05:06"}'
+    """
+    if orjson is not None:
+        return orjson.dumps(
+            data,
+            default=json_default,
+            option=orjson.OPT_PASSTHROUGH_DATETIME,
+        )
+
+    return json.dumps(
+        data, default=json_default, separators=(',', ':'),
+    ).encode()
+
+
+def ndjson_lines(data):
+    """
+    Generate NDJSON lines for the items of a list response, or for a single
+    object
+
+    Examples:
+
+    >>> list(ndjson_lines({'items': [{'slug': 'a'}, {'slug': 'b'}]}))
+    [b'{"slug":"a"}\\n', b'{"slug":"b"}\\n']
+
+    >>> list(ndjson_lines({'slug': 'a'}))
+    [b'{"slug":"a"}\\n']
+    """
+    if isinstance(data, dict) and isinstance(data.get('items'), list):
+        data = data['items']
+
+    if not isinstance(data, list):
+        data = [data]
+
+    for item in data:
+        yield dumps(item) + b'\n'
+
+
+@API.representation('application/json')
+def output_json(data, code, headers=None):
+    """
+    JSON response, using the fast encoder unless it's not installed, the app
+    is in debug, or there are ``RESTFUL_JSON`` settings for the stdlib
+    encoder
+    """
+    if (
+        orjson is None or
+        current_app.debug or
+        current_app.config.get('RESTFUL_JSON')
+    ):
+        return restful_json(data, code, headers)
+
+    resp = make_response(dumps(data) + b'\n', code)
+    resp.headers.extend(headers or {})
+    return resp
+
+
+@API.representation(NDJSON_MIMETYPE)
+def output_ndjson(data, code, headers=None):
+    """
+    Stream the items of a list response as NDJSON. The list total, if any,
+    is in the ``X-Total-Count`` header
+    """
+    resp = Response(ndjson_lines(data), code, mimetype=NDJSON_MIMETYPE)
+    resp.headers.extend(headers or {})
+
+    try:
+        total = data['meta']['total']
+    except (KeyError, TypeError):
+        pass
+    else:
+        if total is not None:
+            resp.headers['X-Total-Count'] = str(total)
+
+    return resp
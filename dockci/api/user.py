@@ -7,6 +7,8 @@ from flask_security.changeable import change_user_password
 
 from .base import BaseDetailResource, BaseRequestParser
 from .fields import GravatarUrl, NonBlankInput, RewriteUrl
+from .marshal_compiler import compile_marshaler, marshal_with_compiled
+from .read_models import ReadModel
 from .util import (clean_attrs,
                    DT_FORMATTER,
                    ensure_roles_found,
@@ -28,6 +30,8 @@ LIST_FIELDS = {
 }
 LIST_FIELDS.update(BASIC_FIELDS)
 
+LIST_READ_MODEL = ReadModel('UserRecord', User, LIST_FIELDS)
+
 ROLE_FIELDS = {
     'name': fields.String(),
     'description': fields.String(),
@@ -41,6 +45,9 @@ DETAIL_FIELDS = {
 }
 DETAIL_FIELDS.update(BASIC_FIELDS)
 
+LIST_SERIALIZER = compile_marshaler(LIST_FIELDS, 'user_list')
+DETAIL_SERIALIZER = compile_marshaler(DETAIL_FIELDS, 'user_detail')
+
 
 SHARED_PARSER_ARGS = {
     'email': dict(
@@ -100,12 +107,12 @@ def rest_set_roles_perms(user, role_names):
 class UserList(BaseDetailResource):
     """ API resource that handles listing users, and creating new users """
     @login_required
-    @marshal_with(LIST_FIELDS)
+    @marshal_with_compiled(LIST_SERIALIZER)
     def get(self):
         """ List all users """
-        return User.query.all()
+        return LIST_READ_MODEL.records(User.query)
 
-    @marshal_with(DETAIL_FIELDS)
+    @marshal_with_compiled(DETAIL_SERIALIZER)
     def post(self):
         """ Create a new user """
         if not CONFIG.security_registerable_form:
@@ -148,7 +155,7 @@ def user_or_404(user_id=None):
 class UserDetail(BaseDetailResource):
     """ API resource that handles getting user details, and updating users """
     @login_required
-    @marshal_with(DETAIL_FIELDS)
+    @marshal_with_compiled(DETAIL_SERIALIZER)
     def get(self, user_id=None, user=None):
         """ Get a user's details """
         if user is not None:
@@ -157,7 +164,7 @@ class UserDetail(BaseDetailResource):
 
     @login_required
     @require_me_or_admin
-    @marshal_with(DETAIL_FIELDS)
+    @marshal_with_compiled(DETAIL_SERIALIZER)
     def post(self, user_id=None, user=None):
         """ Update a user """
         if user is None:
@@ -1,8 +1,11 @@
 """ Utilities used when building APIs """
 from copy import copy
 
-from flask import request
+from flask import request, Response
 from flask_restful import abort as rest_abort, fields
+from werkzeug.http import quote_etag
+
+from dockci.compression import etag_variants
 
 
 DT_FORMATTER = fields.DateTime('iso8601')
@@ -84,3 +87,48 @@ def ensure_roles_found(wanted_names, found_roles, roles_field="roles"):
                 wanted_names.difference(found_names)
             )
         })
+
+
+def version_etag(*versions):
+    """
+    Strong ETag value for a representation, from the row versions, and other
+    values that it's built from
+
+    Examples:
+
+    >>> version_etag(3, 1, None)
+    '3-1-'
+    """
+    return '-'.join('' if part is None else str(part) for part in versions)
+
+
+def etag_headers(etag):
+    """ Response headers for an ETag value """
+    return {'ETag': quote_etag(etag)}
+
+
+def not_modified(etag):
+    """
+    A ``304`` response when ``If-None-Match`` has the ETag, or its value for
+    a compressed response, otherwise None. The ``304`` has the tag that
+    matched. Weak tags match, per RFC 7232
+    """
+    for variant in etag_variants(etag):
+        if request.if_none_match.contains_weak(variant):
+            return Response(status=304, headers=etag_headers(variant))
+
+    return None
+
+
+def check_if_match(etag):
+    """
+    Abort with ``412`` when ``If-Match`` is given, and doesn't have the ETag,
+    or its value for a compressed response. Unlike ``not_modified``, weak
+    tags never match, since RFC 7232 requires the strong comparison for
+    ``If-Match``
+    """
+    if request.if_match and not any(
+        request.if_match.contains(variant)
+        for variant in etag_variants(etag)
+    ):
+        rest_abort(412, message="Resource has been modified")
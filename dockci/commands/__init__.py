@@ -1,2 +1,2 @@
 """ Commands for DockCI Flask-Script """
-from . import db, debug, gunicorn, tests
+from . import bench, blob, db, debug, export, gunicorn, tests, webhooks
@@ -0,0 +1,114 @@
+""" Flask-Script commands for benchmarking API list serialization """
+import time
+
+import sqlalchemy
+
+from flask_restful import fields, marshal
+from flask_script import Command, Option
+
+from dockci.server import APP, DB, MANAGER
+
+
+def best_time(func, repeat):
+    """
+    Run ``func`` ``repeat`` times with an empty identity map, returning its
+    last result, and the fastest run time in seconds
+    """
+    result = None
+    best = None
+    for _ in range(repeat):
+        DB.session.expunge_all()
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    return result, best
+
+
+class BenchListsCommand(Command):
+    """
+    Compare rows/sec marshaling list endpoints from ORM objects, from Core
+    read model records, and serializing records with a compiled marshaler
+    """
+    option_list = (
+        Option('--rows',
+               default=1000, type=int,
+               help="Maximum rows to load for each list"),
+        Option('--repeat',
+               default=5, type=int,
+               help="Runs of each path; the fastest is reported"),
+    )
+
+    # pylint:disable=arguments-differ,no-self-use
+    def run(self, rows, repeat):
+        """ Run each list through both paths, and print rows/sec """
+        from dockci.api import job, project, user
+        from dockci.api.marshal_compiler import compile_marshaler
+        from dockci.models.auth import User
+        from dockci.models.job import Job
+        from dockci.models.project import Project
+
+        busiest = Project.query.join(Project.jobs).group_by(Project).order_by(
+            sqlalchemy.func.count(Job.id).desc(),
+        ).first()
+
+        lists = [
+            ('projects', Project.query, project.LIST_FIELDS,
+             project.LIST_READ_MODEL, {}),
+            ('users', User.query, user.LIST_FIELDS,
+             user.LIST_READ_MODEL, {}),
+        ]
+        if busiest is not None:
+            lists.insert(0, (
+                'jobs', busiest.jobs.order_by(Job.create_ts.desc()),
+                job.LIST_FIELDS, job.LIST_READ_MODEL, {'project': busiest},
+            ))
+
+        with APP.test_request_context():
+            for name, query, fields_, read_model, constants in lists:
+                marshaler = fields.List(fields.Nested(fields_))
+                serializer = compile_marshaler(fields_)
+                query = query.limit(rows)
+
+                def orm_path():
+                    """ Marshal hydrated ORM objects """
+                    return marshal({'items': query.all()},
+                                   {'items': marshaler})
+
+                def read_model_path():
+                    """ Marshal read model records """
+                    return marshal(
+                        {'items': read_model.records(query, **constants)},
+                        {'items': marshaler},
+                    )
+
+                def compiled_path():
+                    """ Serialize read model records """
+                    return {'items': serializer(
+                        read_model.records(query, **constants),
+                    )}
+
+                orm_data, orm_time = best_time(orm_path, repeat)
+                read_data, read_time = best_time(read_model_path, repeat)
+                compiled_data, compiled_time = best_time(compiled_path, repeat)
+
+                count = len(orm_data['items'])
+                if not count:
+                    print("%s: no rows" % name)
+                    continue
+
+                print("%s: %d rows, ORM %d rows/sec, read model %d rows/sec "
+                      "(%.1fx), compiled %d rows/sec (%.1fx)%s" % (
+                          name, count,
+                          count / orm_time,
+                          count / read_time,
+                          orm_time / read_time,
+                          count / compiled_time,
+                          orm_time / compiled_time,
+                          "" if orm_data == read_data == compiled_data
+                          else ", OUTPUT DIFFERS",
+                      ))
+
+
+MANAGER.add_command('bench-lists', BenchListsCommand())
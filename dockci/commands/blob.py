@@ -0,0 +1,56 @@
+""" Flask-Script commands for managing blob storage """
+from flask_script import Command, Option
+
+from dockci.models.blob import gc_blobs
+from dockci.server import MANAGER
+from dockci.util import bytes_human_readable, parse_bytes
+
+
+class BlobGcCommand(Command):
+    """
+    Remove least recently used blobs until the store is under a size quota
+    """
+    option_list = (
+        Option('--store-dir',
+               required=True,
+               help="Blob store directory to clean up"),
+        Option('--max-size',
+               required=True, type=parse_bytes,
+               help="Size quota for the store (eg 20G)"),
+        Option('--split-levels',
+               default=3, type=int,
+               help="Directory levels that blob etags are split into"),
+        Option('--split-size',
+               default=2, type=int,
+               help="Characters of the etag in each split directory"),
+        Option('--dry-run',
+               default=False, action='store_true',
+               help="List blobs that would be removed, without removing"),
+    )
+
+    # pylint:disable=arguments-differ
+    def run(self, store_dir, max_size, split_levels, split_size, dry_run):
+        """ Run the garbage collection, and print what was removed """
+        removed, total_before, total_after = gc_blobs(
+            store_dir,
+            max_size,
+            dry_run=dry_run,
+            split_levels=split_levels,
+            split_size=split_size,
+        )
+
+        for blob, size in removed:
+            print("%s %s %s" % (
+                "Would remove" if dry_run else "Removed",
+                blob.etag,
+                bytes_human_readable(size),
+            ))
+
+        print("Store size %s -> %s (quota %s)" % (
+            bytes_human_readable(total_before),
+            bytes_human_readable(total_after),
+            bytes_human_readable(max_size),
+        ))
+
+
+MANAGER.add_command('blob-gc', BlobGcCommand())
@@ -0,0 +1,71 @@
+""" Flask-Script commands for bulk exports """
+import sys
+
+from flask_script import Command, Option
+
+from dockci.models.job import Job
+from dockci.models.project import Project
+from dockci.server import MANAGER
+from dockci.util import str2bool
+
+
+class ExportJobsCommand(Command):
+    """
+    Stream jobs as NDJSON to stdout, oldest first. Every line has a
+    ``cursor`` that ``--after`` takes to resume an export
+    """
+    option_list = (
+        Option('--project', dest='project_slug',
+               help="Only export jobs for the project with this slug"),
+        Option('--passed', type=str2bool,
+               help="Only export jobs that passed (or not)"),
+        Option('--versioned', type=str2bool,
+               help="Only export jobs that are tagged (or not)"),
+        Option('--completed', type=str2bool,
+               help="Only export jobs that are complete"),
+        Option('--branch',
+               help="Only export jobs for this git branch"),
+        Option('--tag',
+               help="Only export jobs with this tag"),
+        Option('--commit',
+               help="Only export jobs for this commit"),
+        Option('--after',
+               help="Cursor of the last job that was exported"),
+        Option('--batch-size',
+               default=1000, type=int,
+               help="Rows to read from the database at once"),
+    )
+
+    # pylint:disable=arguments-differ,too-many-arguments
+    def run(self, project_slug, after, batch_size, **filter_args):
+        """ Write each job to stdout """
+        from dockci.api.job_export import export_lines, parse_cursor
+
+        if after is not None:
+            try:
+                after = parse_cursor(after)
+            except ValueError as ex:
+                print(str(ex), file=sys.stderr)
+                return 1
+
+        query = Job.query
+        if project_slug is not None:
+            project = Project.query.filter_by(slug=project_slug).first()
+            if project is None:
+                print("No project '%s'" % project_slug, file=sys.stderr)
+                return 1
+
+            query = project.jobs
+
+        out = sys.stdout.buffer
+        for line in export_lines(
+            Job.filtered_query(query=query, **filter_args),
+            after,
+            batch_size,
+        ):
+            out.write(line)
+
+        out.flush()
+
+
+MANAGER.add_command('export-jobs', ExportJobsCommand())
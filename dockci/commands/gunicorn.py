@@ -11,8 +11,18 @@ from py.path import local  # pylint:disable=import-error
 from sqlalchemy import create_engine
 from sqlalchemy.exc import OperationalError
 
-from dockci.server import APP, app_init, get_db_uri, get_pika_conn, MANAGER
+from dockci.compression import CompressMiddleware
+from dockci.placement import declare_host_queues
+from dockci.server import (APP,
+                           app_init,
+                           CONFIG,
+                           get_db_uri,
+                           get_pika_conn,
+                           MANAGER,
+                           )
 from dockci.util import project_root
+from dockci.webhooks import declare_webhook_queue
+from dockci.workers import PoolFilter, POOLS, WORKER_CLASSES
 
 
 class GunicornWrapper(BaseApplication):  # pylint:disable=abstract-method
@@ -28,12 +38,28 @@ class GunicornWrapper(BaseApplication):  # pylint:disable=abstract-method
         for key, value in config.items():
             self.cfg.set(key.lower(), value)
 
-        # TODO required for streaming logs, but a bad idea in other cases
-        self.cfg.set('timeout', 0)
+        # Long-lived streams would be killed by sync workers' timeout, but
+        # other worker classes heartbeat while handling requests
+        if self.options.get('worker_timeout') is not None:
+            self.cfg.set('timeout', self.options['worker_timeout'])
+        elif (
+            self.options.get('worker_class', 'sync') == 'sync' and
+            self.options.get('pool', 'all') != 'api'
+        ):
+            self.cfg.set('timeout', 0)
+        else:
+            self.cfg.set('timeout', self.cfg.settings['timeout'].default)
 
     def load(self):
-        """ Get the Flask app """
-        return APP
+        """
+        Get the Flask app, filtered to the worker pool's requests, and
+        compressed when it's enabled in config
+        """
+        pool = self.options.get('pool', 'all')
+        app = APP if pool == 'all' else PoolFilter(APP, pool)
+        return CompressMiddleware(
+            app, enabled=lambda: CONFIG.response_compression,
+        )
 
 
 @MANAGER.option("-w", "--workers",
@@ -52,6 +78,28 @@ class GunicornWrapper(BaseApplication):  # pylint:disable=abstract-method
 @MANAGER.option("--timeout",
                 default=0, type=int,
                 help="Time to wait for the resources to be available")
+@MANAGER.option("-k", "--worker-class",
+                default='sync', choices=WORKER_CLASSES,
+                help="Gunicorn worker class. Green worker classes (gevent, "
+                     "eventlet) keep idle log streams cheap, and need "
+                     "psycogreen for cooperative DB queries")
+@MANAGER.option("--threads",
+                default=None, type=int,
+                help="Number of threads per worker for the gthread worker "
+                     "class")
+@MANAGER.option("--worker-connections",
+                default=None, type=int,
+                help="Maximum concurrent connections per green worker")
+@MANAGER.option("--worker-timeout",
+                default=None, type=int,
+                help="Seconds before a silent worker is restarted. Defaults "
+                     "to 0 (never) for sync workers serving streams")
+@MANAGER.option("--pool",
+                default='all', choices=POOLS,
+                help="Requests served by these workers; streaming endpoints, "
+                     "other API, and UI requests, or all. Streaming, and "
+                     "other requests must be routed to separate pools by a "
+                     "proxy")
 @MANAGER.option("--collect-static",
                 default=False, action='store_true',
                 help="Collect static dependencies before start")
@@ -106,6 +154,9 @@ def run(**kwargs):
     channel.queue_bind(exchange='dockci.queue',
                        queue='dockci.agent',
                        routing_key='*')
+    declare_webhook_queue(channel)
+    if CONFIG.job_placement:
+        declare_host_queues(channel, CONFIG.docker_hosts)
     mq_conn.close()
 
     if kwargs['db_migrate']:
@@ -0,0 +1,132 @@
+""" Flask-Script commands for deferred webhook ingestion """
+import logging
+import time
+
+from flask_script import Command, Option
+from sqlalchemy.exc import OperationalError, SQLAlchemyError
+
+from dockci.server import DB, MANAGER, pika_conn
+from dockci.webhooks import (create_jobs,
+                             declare_webhook_queue,
+                             parse_webhook_message,
+                             send_superseded_status,
+                             WEBHOOK_QUEUE,
+                             )
+
+
+# Seconds to wait before taking more webhooks, when the database is down
+DB_RETRY_WAIT = 5
+
+
+class WebhookConsumerCommand(Command):
+    """
+    Create, and queue jobs for deferred webhooks in batches, so that bursts
+    of pushes are absorbed with a commit, and a connection per batch
+    """
+    option_list = (
+        Option('--batch-size',
+               default=100, type=int,
+               help="Maximum webhooks to create jobs for at once"),
+        Option('--batch-wait',
+               default=1.0, type=float,
+               help="Seconds to wait for more webhooks to fill a batch"),
+    )
+
+    # pylint:disable=arguments-differ
+    def run(self, batch_size, batch_wait):
+        """ Consume webhooks until interrupted """
+        with pika_conn() as conn:
+            channel = conn.channel()
+            declare_webhook_queue(channel)
+            channel.basic_qos(prefetch_count=batch_size)
+
+            batch = []
+            deadline = None
+            for method, _, body in channel.consume(
+                WEBHOOK_QUEUE, inactivity_timeout=batch_wait,
+            ):
+                if method is not None:
+                    batch.append((method.delivery_tag, body))
+                    if deadline is None:
+                        deadline = time.time() + batch_wait
+
+                if batch and (
+                    method is None or
+                    len(batch) >= batch_size or
+                    time.time() >= deadline
+                ):
+                    self.handle_batch(channel, batch)
+                    batch = []
+                    deadline = None
+
+    def handle_batch(self, channel, batch):
+        """
+        Create jobs for a batch of webhook messages. Messages that jobs can
+        never be created from are logged, and rejected without requeue
+        """
+        webhooks = []
+        for delivery_tag, body in batch:
+            try:
+                webhooks.append((delivery_tag, parse_webhook_message(body)))
+            except ValueError:
+                logging.exception("Rejecting invalid webhook message %r",
+                                  body)
+                channel.basic_reject(delivery_tag, requeue=False)
+
+        if webhooks:
+            self.handle_webhooks(channel, webhooks)
+
+    def handle_webhooks(self, channel, webhooks):
+        """
+        Create jobs for ``(delivery_tag, webhook)`` pairs, and queue those
+        that weren't superseded in the same batch.
+
+        Messages are only acked once their jobs are queued, so that a crash
+        in between means that jobs are created again on redelivery, rather
+        than never being queued. When the database is unavailable, messages
+        are requeued. Other database errors are retried one message at a
+        time, so that a message that can't be saved is rejected without
+        holding up the rest
+        """
+        try:
+            jobs, superseded = create_jobs([
+                webhook for _, webhook in webhooks
+            ])
+
+        except OperationalError:
+            logging.exception("Couldn't reach the database for webhooks")
+            DB.session.rollback()
+            for delivery_tag, _ in webhooks:
+                channel.basic_nack(delivery_tag, requeue=True)
+            time.sleep(DB_RETRY_WAIT)
+            return
+
+        except SQLAlchemyError:
+            DB.session.rollback()
+            if len(webhooks) > 1:
+                logging.exception("Couldn't create jobs for webhooks, "
+                                  "retrying them one at a time")
+                for pair in webhooks:
+                    self.handle_webhooks(channel, [pair])
+                return
+
+            delivery_tag, webhook = webhooks[0]
+            logging.exception("Rejecting webhook for project '%s'",
+                              webhook['project_slug'])
+            channel.basic_reject(delivery_tag, requeue=False)
+            return
+
+        for job in jobs:
+            if job not in superseded:
+                job.queue(channel)
+
+        for delivery_tag, _ in webhooks:
+            channel.basic_ack(delivery_tag)
+
+        send_superseded_status(superseded)
+
+        logging.info("Created %d jobs from %d webhooks, superseding %d",
+                     len(jobs), len(webhooks), len(superseded))
+
+
+MANAGER.add_command('webhook-consumer', WebhookConsumerCommand())
@@ -0,0 +1,329 @@
+"""
+Negotiated gzip, and brotli compression of responses
+
+Compressible responses are compressed as they're sent, rather than being
+buffered. Responses without a length, like log streams, are flushed after
+every chunk so that viewers aren't kept waiting for a full compression
+block. Content types that are already compressed, like artifact tarballs,
+are sent as they are
+"""
+
+import re
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# Responses with a known length smaller than this are sent uncompressed
+COMPRESS_THRESHOLD = 1024
+
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+# Encodings that responses may be compressed with
+ENCODINGS = ('gzip', 'br')
+
+COMPRESSIBLE_TYPES = frozenset((
+    'application/javascript',
+    'application/json',
+    'application/x-ndjson',
+    'application/x-yaml',
+    'application/xml',
+    'image/svg+xml',
+))
+
+ACCEPT_ENCODING_RE = re.compile(
+    r'^\s*([^\s;]+)\s*(?:;\s*q\s*=\s*([0-9.]+))?\s*$',
+)
+
+
+def accepted_encodings(header):
+    """
+    Set of encodings in an ``Accept-Encoding`` header, that aren't refused
+    with ``q=0``
+
+    Examples:
+
+    >>> sorted(accepted_encodings('gzip, deflate, br'))
+    ['br', 'deflate', 'gzip']
+    >>> sorted(accepted_encodings('gzip;q=1.0, br;q=0, identity'))
+    ['gzip', 'identity']
+    >>> sorted(accepted_encodings(''))
+    []
+    """
+    encodings = set()
+    for part in header.split(','):
+        match = ACCEPT_ENCODING_RE.match(part)
+        if match is None:
+            continue
+
+        encoding, quality = match.groups()
+        try:
+            if quality is not None and float(quality) <= 0:
+                continue
+        except ValueError:
+            continue
+
+        encodings.add(encoding.lower())
+
+    return encodings
+
+
+def choose_encoding(header, brotli_available=None):
+    """
+    Encoding to compress with, given an ``Accept-Encoding`` header. Brotli is
+    preferred when it's installed
+
+    Examples:
+
+    >>> choose_encoding('gzip, deflate, br', brotli_available=True)
+    'br'
+    >>> choose_encoding('gzip, deflate, br', brotli_available=False)
+    'gzip'
+    >>> choose_encoding('*', brotli_available=False)
+    'gzip'
+    >>> choose_encoding('identity') is None
+    True
+    """
+    if brotli_available is None:
+        brotli_available = brotli is not None
+
+    encodings = accepted_encodings(header)
+    if brotli_available and 'br' in encodings:
+        return 'br'
+    if 'gzip' in encodings or '*' in encodings:
+        return 'gzip'
+
+    return None
+
+
+def is_compressible(content_type):
+    """
+    Whether a content type is worth compressing. Archives, images, and other
+    binary types are usually compressed already
+
+    Examples:
+
+    >>> is_compressible('text/html; charset=utf-8')
+    True
+    >>> is_compressible('application/json')
+    True
+    >>> is_compressible('application/x-tar')
+    False
+    >>> is_compressible(None)
+    False
+    """
+    if not content_type:
+        return False
+
+    mimetype = content_type.split(';')[0].strip().lower()
+    return mimetype.startswith('text/') or mimetype in COMPRESSIBLE_TYPES
+
+
+class Compressor(object):
+    """ Incremental compressor for an encoding """
+    def __init__(self, encoding):
+        self.encoding = encoding
+        if encoding == 'br':
+            self._compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        else:
+            self._compressor = zlib.compressobj(
+                GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS,
+            )
+
+    def compress(self, data, flush=False):
+        """
+        Compress a chunk of data. When ``flush`` is set, everything given so
+        far is in the output, so that it can be decompressed by the client
+        """
+        if self.encoding == 'br':
+            output = self._compressor.process(data)
+            if flush:
+                output += self._compressor.flush()
+            return output
+
+        output = self._compressor.compress(data)
+        if flush:
+            output += self._compressor.flush(zlib.Z_SYNC_FLUSH)
+        return output
+
+    def finish(self):
+        """ The end of the compressed data """
+        if self.encoding == 'br':
+            return self._compressor.finish()
+
+        return self._compressor.flush()
+
+
+class CompressMiddleware(object):  # pylint:disable=too-few-public-methods
+    """
+    WSGI middleware to compress responses with the best encoding that the
+    client accepts. ``enabled`` is called for each request, so that
+    compression can be switched in config without a restart
+
+    Examples:
+
+    >>> import gzip
+    >>> def app(environ, start_response):
+    ...     start_response('200 OK', [('Content-Type', 'text/plain'),
+    ...                               ('Content-Length', '2000')])
+    ...     return [b'a' * 1000, b'b' * 1000]
+
+    >>> def start_response(status, headers, exc_info=None):
+    ...     print(status, sorted(headers))
+
+    >>> compress_app = CompressMiddleware(app)
+    >>> body = compress_app({'HTTP_ACCEPT_ENCODING': 'gzip'}, start_response)
+    200 OK [('Content-Encoding', 'gzip'), ('Content-Type', 'text/plain'), \
+('Vary', 'Accept-Encoding')]
+    >>> gzip.decompress(b''.join(body)) == b'a' * 1000 + b'b' * 1000
+    True
+
+    >>> body = compress_app({}, start_response)
+    200 OK [('Content-Length', '2000'), ('Content-Type', 'text/plain')]
+    """
+    def __init__(self,
+                 app,
+                 enabled=lambda: True,
+                 threshold=COMPRESS_THRESHOLD):
+        self.app = app
+        self.enabled = enabled
+        self.threshold = threshold
+
+    def _should_compress(self, environ, status, headers):
+        """ Whether to compress a response, given its status, and headers """
+        if environ.get('REQUEST_METHOD') == 'HEAD':
+            return False
+        if status[:3] in ('204', '206', '304'):
+            return False
+
+        names = {name.lower(): value for name, value in headers}
+        if 'content-encoding' in names:
+            return False
+        if not is_compressible(names.get('content-type')):
+            return False
+
+        try:
+            length = int(names['content-length'])
+        except (KeyError, ValueError):
+            return True
+
+        return length >= self.threshold
+
+    def __call__(self, environ, start_response):
+        encoding = choose_encoding(environ.get('HTTP_ACCEPT_ENCODING', ''))
+        if encoding is None or not self.enabled():
+            return self.app(environ, start_response)
+
+        response = {}
+
+        def start_uncompressed():
+            """ Start the response as the app gave it, once """
+            if 'write' not in response:
+                response['write'] = start_response(
+                    response['status'],
+                    response['headers'],
+                    response['exc_info'],
+                )
+
+            return response['write']
+
+        def capture_start_response(status, headers, exc_info=None):
+            """ Keep the response start, until we know how it's encoded """
+            response.update(status=status, headers=headers, exc_info=exc_info)
+            if 'write' in response and exc_info is not None:
+                # Already started, so the server re-raises
+                start_response(status, headers, exc_info)
+
+            def write(data):
+                """
+                Data written before the body is returned can't be compressed
+                with it, so the response is sent uncompressed
+                """
+                start_uncompressed()(data)
+
+            return write
+
+        body = self.app(environ, capture_start_response)
+        status = response['status']
+        headers = response['headers']
+
+        if 'write' in response or not self._should_compress(
+            environ, status, headers,
+        ):
+            start_uncompressed()
+            return body
+
+        # Streams have no length, and are flushed for every chunk
+        streaming = not any(
+            name.lower() == 'content-length' for name, _ in headers
+        )
+        vary = [value for name, value in headers if name.lower() == 'vary']
+        if 'accept-encoding' not in ', '.join(vary).lower():
+            vary.append('Accept-Encoding')
+
+        headers = [
+            (
+                name,
+                encoded_etag(value, encoding) if name.lower() == 'etag' else (
+                    value
+                ),
+            )
+            for name, value in headers
+            if name.lower() not in ('content-length', 'vary')
+        ] + [
+            ('Content-Encoding', encoding),
+            ('Vary', ', '.join(vary)),
+        ]
+        start_response(status, headers, response['exc_info'])
+        return compressed_body(body, Compressor(encoding), streaming)
+
+
+def encoded_etag(etag, encoding):
+    """
+    ETag header value for a response compressed with ``encoding``. It's not
+    byte for byte the same as the uncompressed response, so it gets its own
+    tag, that's still strong, so that it can be used with ``If-Match`` (see
+    ``etag_variants``)
+
+    Examples:
+
+    >>> encoded_etag('"abc"', 'gzip')
+    '"abc-gzip"'
+    >>> encoded_etag('W/"abc"', 'br')
+    'W/"abc-br"'
+    """
+    return '%s-%s"' % (etag[:-1], encoding)
+
+
+def etag_variants(etag):
+    """
+    An unquoted ETag value, followed by its values for each encoding
+
+    Examples:
+
+    >>> etag_variants('3-1')
+    ('3-1', '3-1-gzip', '3-1-br')
+    """
+    return (etag,) + tuple(
+        '%s-%s' % (etag, encoding) for encoding in ENCODINGS
+    )
+
+
+def compressed_body(body, compressor, streaming):
+    """ Generate compressed chunks of a WSGI response body """
+    try:
+        for chunk in body:
+            output = compressor.compress(chunk, flush=streaming)
+            if output:
+                yield output
+
+        yield compressor.finish()
+
+    finally:
+        close = getattr(body, 'close', None)
+        if close is not None:
+            close()
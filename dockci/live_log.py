@@ -0,0 +1,603 @@
+"""
+Shared fan-out of live job log messages to many viewers
+
+Rather than every viewer declaring its own broker queue (so that the broker
+copies each log message once per viewer), each web process consumes a single
+queue per job, and re-broadcasts messages to its in-process subscribers
+"""
+
+import codecs
+import json
+import logging
+import threading
+import time
+
+from collections import deque, namedtuple
+
+from dockci.metrics import metrics_provider
+from dockci.server import get_pika_conn
+
+
+SUBSCRIBER_BUFFER_BYTES = 4 * 1024 * 1024
+COALESCE_WINDOW = 0.1  # seconds
+COALESCE_MAX_BYTES = 64 * 1024
+READY_TIMEOUT = 10  # seconds
+POLL_INTERVAL = 1  # seconds
+KEEPALIVE_INTERVAL = 15  # seconds
+LOG_CHUNK_SIZE = 64 * 1024
+
+_FANOUTS = {}
+_FANOUTS_LOCK = threading.Lock()
+
+
+class FanoutError(Exception):
+    """
+    The fan-out consumer for a job couldn't be started, or the job's live log
+    can't be followed from it
+    """
+    pass
+
+
+class LiveMessage(namedtuple('LiveMessage',
+                             ('routing_key', 'headers', 'body'))):
+    """ A log message consumed from the ``dockci.job`` exchange """
+    __slots__ = ()
+
+    @property
+    def stage_slug(self):
+        """
+        Stage that the message is for, or ``None`` for job messages
+
+        Examples:
+
+        >>> LiveMessage('dockci.p.j.s.content', {}, b'').stage_slug
+        's'
+        >>> LiveMessage('dockci.p.j.state', {}, b'').stage_slug
+        """
+        parts = self.routing_key.split('.')
+        return parts[3] if len(parts) == 5 else None
+
+    @property
+    def kind(self):
+        """
+        Last part of the routing key; ``content``, or ``status`` for stages,
+        and ``state`` for jobs
+
+        Examples:
+
+        >>> LiveMessage('dockci.p.j.s.content', {}, b'').kind
+        'content'
+        >>> LiveMessage('dockci.p.j.state', {}, b'').kind
+        'state'
+        """
+        return self.routing_key.rsplit('.', 1)[-1]
+
+    @property
+    def seq(self):
+        """ Log state sequence number of the message, if given """
+        try:
+            return int(self.headers['seq'])
+        except (KeyError, TypeError, ValueError):
+            return None
+
+
+def format_event(event, data, event_id=None):
+    """
+    Format a server-sent event. New lines in ``data`` are split over multiple
+    ``data`` fields
+
+    Examples:
+
+    >>> format_event('job', '{"a": 1}')
+    'event: job\\ndata: {"a": 1}\\n\\n'
+
+    >>> format_event('log', 'a\\nb', event_id=3)
+    'id: 3\\nevent: log\\ndata: a\\ndata: b\\n\\n'
+    """
+    lines = []
+    if event_id is not None:
+        lines.append('id: %s' % event_id)
+    lines.append('event: %s' % event)
+    lines.extend('data: %s' % line for line in data.split('\n'))
+    return '\n'.join(lines) + '\n\n'
+
+
+class Subscription(object):
+    """
+    A viewer's buffer of messages from a ``JobFanout``. Log content beyond
+    ``max_bytes`` is dropped, and summarized in ``skipped`` messages with the
+    number of ``bytes`` dropped, so that a slow viewer neither holds up
+    others, nor uses unbounded memory
+    """
+    def __init__(self, fanout, max_bytes=SUBSCRIBER_BUFFER_BYTES):
+        self.fanout = fanout
+        self.max_bytes = max_bytes
+        self.buffered_bytes = 0
+        self.messages = deque()
+        self.closed = False
+        self._cond = threading.Condition()
+
+    def put(self, message):
+        """ Add a message to the buffer """
+        with self._cond:
+            if message.kind == 'content':
+                size = len(message.body)
+                if self.buffered_bytes + size > self.max_bytes:
+                    message = self._skip(message)
+                else:
+                    self.buffered_bytes += size
+
+            if message is not None:
+                self.messages.append(message)
+                self._cond.notify()
+
+    def _skip(self, message):
+        """
+        Summarize dropped content, adding to the last message if it's already
+        a summary for the stage. Must hold the buffer lock
+        """
+        last = self.messages[-1] if self.messages else None
+        if (
+            last is not None and
+            last.kind == 'skipped' and
+            last.stage_slug == message.stage_slug
+        ):
+            last.headers['bytes'] += len(message.body)
+            last.headers['seq'] = message.seq
+            return None
+
+        return LiveMessage(
+            message.routing_key.rsplit('.', 1)[0] + '.skipped',
+            {'bytes': len(message.body), 'seq': message.seq},
+            b'',
+        )
+
+    def _pop(self):
+        """ Take the next message. Must hold the buffer lock """
+        message = self.messages.popleft()
+        if message.kind == 'content':
+            self.buffered_bytes -= len(message.body)
+
+        return message
+
+    def get(self, timeout=None):
+        """ Next message, or ``None`` if nothing arrived before timeout """
+        with self._cond:
+            if not self.messages and not self.closed:
+                self._cond.wait(timeout)
+
+            if not self.messages:
+                return None
+
+            return self._pop()
+
+    def coalesce(self, message,
+                 window=COALESCE_WINDOW,
+                 max_bytes=COALESCE_MAX_BYTES):
+        """
+        Merge log content for the same stage that follows ``message`` within
+        ``window`` seconds, up to ``max_bytes``. The merged message has the
+        headers of the last message merged
+        """
+        if message.kind != 'content':
+            return message
+
+        bodies = [message.body]
+        size = len(message.body)
+        last = message
+        deadline = time.time() + window
+        with self._cond:
+            while size < max_bytes:
+                if not self.messages:
+                    remaining = deadline - time.time()
+                    if remaining <= 0 or self.closed:
+                        break
+
+                    self._cond.wait(remaining)
+                    continue
+
+                following = self.messages[0]
+                if (
+                    following.routing_key != message.routing_key or
+                    size + len(following.body) > max_bytes
+                ):
+                    break
+
+                last = self._pop()
+                bodies.append(last.body)
+                size += len(last.body)
+
+        if last is message:
+            return message
+
+        return LiveMessage(message.routing_key, last.headers, b''.join(bodies))
+
+    def mark_closed(self):
+        """ No more messages will be added """
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+    def close(self):
+        """ Stop receiving messages """
+        self.mark_closed()
+        self.fanout.unsubscribe(self)
+
+
+class JobFanout(object):
+    """
+    Consumer of a single broker queue for all live log, and state messages of
+    a job, in a background thread. The consumer stops once there have been no
+    subscribers for ``idle_timeout`` seconds
+    """
+    def __init__(self, project_slug, job_slug, idle_timeout):
+        self.key = (project_slug, job_slug)
+        self.routing_keys = tuple(
+            'dockci.{project_slug}.{job_slug}.{suffix}'.format(
+                project_slug=project_slug,
+                job_slug=job_slug,
+                suffix=suffix,
+            )
+            for suffix in ('*.*', 'state')
+        )
+        self.idle_timeout = idle_timeout
+        self.subscribers = set()
+        self.running = True
+        self.ready = threading.Event()
+        self._idle_since = None
+        self._thread = threading.Thread(
+            target=self._run,
+            name='live-log-%s-%s' % self.key,
+        )
+        self._thread.daemon = True
+
+    def start(self):
+        """ Start consuming in the background """
+        self._thread.start()
+
+    def subscribe(self, max_bytes=SUBSCRIBER_BUFFER_BYTES):
+        """
+        Attach a new subscriber, that receives every message consumed from
+        now on. If the consumer has stopped, the subscription is closed
+        """
+        subscription = Subscription(self, max_bytes)
+        with _FANOUTS_LOCK:
+            if self.running:
+                self.subscribers.add(subscription)
+            else:
+                subscription.mark_closed()
+
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """ Detach a subscriber """
+        with _FANOUTS_LOCK:
+            self.subscribers.discard(subscription)
+
+    def broadcast(self, message):
+        """ Give a message to all subscribers """
+        with _FANOUTS_LOCK:
+            subscribers = tuple(self.subscribers)
+
+        for subscription in subscribers:
+            subscription.put(message)
+
+    def _stop(self):
+        """
+        Unregister, and close all subscribers. Must hold ``_FANOUTS_LOCK``
+        """
+        self.running = False
+        if _FANOUTS.get(self.key) is self:
+            del _FANOUTS[self.key]
+
+        for subscription in self.subscribers:
+            subscription.mark_closed()
+        self.subscribers = set()
+
+    def _idle_expired(self, now=None):
+        """ Check idle time, and stop when expired """
+        now = time.time() if now is None else now
+        with _FANOUTS_LOCK:
+            if self.subscribers:
+                self._idle_since = None
+                return False
+
+            if self._idle_since is None:
+                self._idle_since = now
+
+            if now - self._idle_since < self.idle_timeout:
+                return False
+
+            self._stop()
+            return True
+
+    def _run(self):
+        """ Bind a queue for the job, and broadcast its messages """
+        conn = None
+        try:
+            conn = get_pika_conn()
+            channel = conn.channel()
+            queue_result = channel.queue_declare(
+                queue='', exclusive=True, auto_delete=True,
+            )
+            for routing_key in self.routing_keys:
+                channel.queue_bind(
+                    exchange='dockci.job',
+                    queue=queue_result.method.queue,
+                    routing_key=routing_key,
+                )
+            self.ready.set()
+
+            for method, properties, body in channel.consume(
+                queue_result.method.queue,
+                no_ack=True,
+                inactivity_timeout=POLL_INTERVAL,
+            ):
+                if method is not None:
+                    self.broadcast(LiveMessage(
+                        method.routing_key,
+                        properties.headers or {},
+                        body,
+                    ))
+
+                if self._idle_expired():
+                    break
+
+        except Exception:  # pylint:disable=broad-except
+            logging.exception("Live log fan-out for %s/%s failed", *self.key)
+
+        finally:
+            with _FANOUTS_LOCK:
+                self._stop()
+            self.ready.set()
+
+            if conn is not None:
+                try:
+                    conn.close()
+                except Exception:  # pylint:disable=broad-except
+                    pass
+
+
+def get_fanout(project_slug, job_slug, idle_timeout):
+    """
+    Get the running fan-out for a job, starting it if needed, and wait until
+    its queue is bound
+    """
+    key = (project_slug, job_slug)
+    with _FANOUTS_LOCK:
+        fanout = _FANOUTS.get(key)
+        if fanout is None:
+            fanout = _FANOUTS[key] = JobFanout(
+                project_slug, job_slug, idle_timeout,
+            )
+            fanout.start()
+
+    if not fanout.ready.wait(READY_TIMEOUT) or not fanout.running:
+        raise FanoutError("Live log fan-out for %s/%s is unavailable" % key)
+
+    return fanout
+
+
+def _in_init_log(message, init_seq):
+    """
+    Whether log content (or a summary of skipped content) is already in the
+    initial log
+
+    Examples:
+
+    >>> _in_init_log(LiveMessage('dockci.p.j.s.content', {'seq': 2}, b''), 2)
+    True
+    >>> _in_init_log(LiveMessage('dockci.p.j.s.content', {'seq': 3}, b''), 2)
+    False
+    >>> _in_init_log(LiveMessage('dockci.p.j.s.content', {}, b''), 2)
+    False
+    >>> _in_init_log(LiveMessage('dockci.p.j.s.status', {'seq': 1}, b''), 2)
+    False
+    """
+    return (
+        message.kind in ('content', 'skipped') and
+        None not in (init_seq, message.seq) and
+        message.seq <= init_seq
+    )
+
+
+def parse_event_id(event_id):
+    """
+    Stage slug, and byte offset from a job event ID
+
+    Examples:
+
+    >>> parse_event_id('docker_build:1024')
+    ('docker_build', 1024)
+
+    >>> parse_event_id('docker_build')
+    >>> parse_event_id('docker_build:abc')
+    >>> parse_event_id(None)
+    """
+    try:
+        stage_slug, offset = event_id.rsplit(':', 1)
+        return stage_slug, int(offset)
+    except (AttributeError, ValueError):
+        return None
+
+
+def _log_event(stage_slug, data, offset):
+    """ Job log event, with an ID to resume from after ``offset`` bytes """
+    return format_event(
+        'log',
+        json.dumps({'stage': stage_slug, 'data': data}),
+        event_id='%s:%d' % (stage_slug, offset),
+    )
+
+
+def log_events(path, stage_slug, start=0, end=None,
+               chunk_size=LOG_CHUNK_SIZE):
+    """
+    Generate job log events for bytes ``start`` to ``end`` of a stage log
+    file. Missing files generate no events
+
+    Examples:
+
+    >>> log_path = getfixture('tmpdir').join('s.log')
+    >>> log_path.write('abcdef')
+
+    >>> list(log_events(log_path, 's', 2, 5))
+    ['id: s:5\\nevent: log\\ndata: {"stage": "s", "data": "cde"}\\n\\n']
+
+    >>> list(log_events(log_path.dirpath('x.log'), 'x'))
+    []
+    """
+    if not path.check(file=True):
+        return
+
+    decoder = codecs.getincrementaldecoder('utf-8')('replace')
+    offset = start
+    with path.open('rb') as handle:
+        handle.seek(start)
+        while end is None or offset < end:
+            size = chunk_size if end is None else min(chunk_size, end - offset)
+            data = handle.read(size)
+            if not data:
+                return
+
+            offset += len(data)
+            yield _log_event(stage_slug, decoder.decode(data), offset)
+
+
+def job_events(output_path,
+               job_state,
+               stages,
+               init_stage,
+               init_bytes,
+               init_seq=None,
+               subscription=None,
+               resume=None,
+               keepalive=KEEPALIVE_INTERVAL,
+               window=COALESCE_WINDOW):
+    """
+    Generate server-sent events for a job. Stage logs are caught up from
+    files in ``output_path``, to ``init_bytes`` of ``init_stage``, then live
+    messages are streamed from ``subscription``. Content messages with a
+    sequence number up to ``init_seq`` are skipped, since they're in the log
+    files already.
+
+    Events are:
+
+    - ``job``: The job state (``job_state`` initially)
+    - ``log``: Log ``data`` for a ``stage``. The event ID is the stage slug,
+      and its log length after the event, so that a viewer can resume with
+      ``Last-Event-ID`` (given as ``resume``)
+    - ``skipped``: Log for a ``stage`` from ``start`` to ``end`` bytes was
+      dropped because the viewer fell behind. It can be fetched from the
+      stage's ``log_init`` view
+    - ``stage``: Stage ``success`` update
+    - ``end``: No more events will be sent; the job is complete, or the
+      fan-out stopped
+
+    Live log content is coalesced (see ``Subscription.coalesce``)
+
+    ``stages`` is a list of stage slug, and success tuples
+    """
+    try:
+        yield format_event('job', json.dumps(job_state))
+
+        slugs = [slug for slug, _ in stages]
+        if init_stage is not None:
+            if init_stage in slugs:
+                slugs = slugs[:slugs.index(init_stage) + 1]
+            else:
+                slugs.append(init_stage)
+
+        resume_stage, resume_offset = resume or (None, 0)
+        if resume_stage in slugs:
+            slugs = slugs[slugs.index(resume_stage):]
+        else:
+            resume_stage = None
+
+        success = dict(stages)
+        offsets = {}
+        for slug in slugs:
+            offsets[slug] = resume_offset if slug == resume_stage else 0
+            end = init_bytes if slug == init_stage else None
+            for event in log_events(output_path.join('%s.log' % slug),
+                                    slug,
+                                    offsets[slug],
+                                    end):
+                yield event
+
+            if slug == init_stage:
+                offsets[slug] = max(offsets[slug], init_bytes)
+
+            if success.get(slug) is not None:
+                yield format_event('stage', json.dumps({
+                    'stage': slug, 'success': success[slug],
+                }))
+
+        if subscription is None:
+            yield format_event('end', '{}')
+            return
+
+        decoders = {}
+        while True:
+            message = subscription.get(timeout=keepalive)
+            if message is None:
+                if subscription.closed:
+                    yield format_event('end', '{}')
+                    return
+
+                yield ': keepalive\n\n'
+                continue
+
+            slug = message.stage_slug
+            if message.kind == 'state':
+                state = json.loads(message.body.decode())
+                yield format_event('job', json.dumps(state))
+                if state.get('result') is not None:
+                    yield format_event('end', '{}')
+                    return
+
+            elif message.kind == 'status':
+                yield format_event('stage', json.dumps(dict(
+                    json.loads(message.body.decode()), stage=slug,
+                )))
+
+            elif _in_init_log(message, init_seq):
+                continue
+
+            elif message.kind == 'skipped':
+                start = offsets.get(slug, 0)
+                offsets[slug] = start + message.headers['bytes']
+                decoders.pop(slug, None)
+                yield format_event(
+                    'skipped',
+                    json.dumps({
+                        'stage': slug, 'start': start, 'end': offsets[slug],
+                    }),
+                    event_id='%s:%d' % (slug, offsets[slug]),
+                )
+
+            elif message.kind == 'content':
+                message = subscription.coalesce(message, window)
+                decoder = decoders.setdefault(
+                    slug, codecs.getincrementaldecoder('utf-8')('replace'),
+                )
+                offsets[slug] = offsets.get(slug, 0) + len(message.body)
+                yield _log_event(
+                    slug, decoder.decode(message.body), offsets[slug],
+                )
+
+    finally:
+        if subscription is not None:
+            subscription.close()
+
+
+@metrics_provider('live_log')
+def fanout_stats():
+    """ Number of jobs with a running fan-out, and their subscribers """
+    with _FANOUTS_LOCK:
+        return {
+            'jobs': len(_FANOUTS),
+            'subscribers': sum(
+                len(fanout.subscribers) for fanout in _FANOUTS.values()
+            ),
+        }
@@ -0,0 +1,56 @@
+"""
+Registry of application metrics providers, collected by the metrics API
+"""
+
+import logging
+
+from collections import OrderedDict
+
+
+METRICS_PROVIDERS = OrderedDict()
+
+
+def metrics_provider(name):
+    """
+    Decorator to register a function returning a JSON serializable value as
+    the metrics for ``name``
+
+    Examples:
+
+    >>> @metrics_provider('doctest')
+    ... def doctest_metrics():
+    ...     return {'value': 1}
+
+    >>> dict(collect_metrics(['doctest']))
+    {'doctest': {'value': 1}}
+
+    >>> del METRICS_PROVIDERS['doctest']
+    """
+    def inner(func):
+        """ Register the provider """
+        METRICS_PROVIDERS[name] = func
+        return func
+
+    return inner
+
+
+def collect_metrics(names=None):
+    """
+    Collect metrics from all providers (or only those in ``names``). A
+    provider that raises is logged, and given a ``None`` value so that one
+    broken provider doesn't hide the rest
+    """
+    metrics = OrderedDict()
+    for name, func in METRICS_PROVIDERS.items():
+        if names is not None and name not in names:
+            continue
+
+        try:
+            metrics[name] = func()
+        except Exception:  # pylint:disable=broad-except
+            logging.getLogger('dockci.metrics').exception(
+                "Error collecting metrics for '%s'", name,
+            )
+            metrics[name] = None
+
+    return metrics
@@ -1,4 +1,20 @@
 """ Base model classes, mixins """
+import sqlalchemy
+
+from dockci.server import DB
+
+
+def version_column():
+    """
+    Counter column that's incremented by every update of its row, for ETags.
+    It's not a ``version_id_col``, so concurrent updates aren't refused; use
+    ``with_for_update`` where a write depends on the version
+    """
+    return DB.Column(DB.Integer(),
+                     default=1,
+                     server_default='1',
+                     onupdate=sqlalchemy.text('version_id + 1'),
+                     nullable=False)
 
 
 class RepoFsMixin(object):
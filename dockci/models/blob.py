@@ -1,22 +1,96 @@
 """ Persistent blob storage based on content hash """
 
+import fcntl
+import glob
 import hashlib
+import io
 import json
+import logging
+import os
+import struct
+import time
 
-from collections import OrderedDict
+from collections import Counter, defaultdict, OrderedDict
+from contextlib import contextmanager
+from uuid import uuid4
 
+import py.error  # pylint:disable=import-error
 import py.path  # pylint:disable=import-error
 
+from redis.exceptions import RedisError
+
 from dockci.util import path_contained
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    # The compiled chunker only; the package's pure Python fallback is no
+    # faster than ours
+    from fastcdc.fastcdc_cy import fastcdc_cy as fastcdc
+except ImportError:
+    fastcdc = None
+
 
 CHUNK_SIZE = 4000
 
+BLOB_FORMATS = ('tree', 'pack', 'chunked')
+PACK_COMPRESSIONS = (None, 'zstd')
+
+PACK_MAGIC = b'DCIPACK1'
+# Index offset, index length, magic
+PACK_FOOTER = struct.Struct('>QQ8s')
+PACK_IO_SIZE = 1024 * 1024
+
+CHUNKED_MAGIC = b'DCICHNK1'
+CHUNKS_DIR_NAME = '_chunks'
+
+# Content defined chunking sizes. Boundaries are where the top
+# ``CDC_AVG_BITS`` bits of the rolling hash are 0, giving an average chunk
+# size of about 2 ** CDC_AVG_BITS past the minimum
+CDC_MIN_SIZE = 1024 * 8
+CDC_AVG_BITS = 14
+CDC_MAX_SIZE = 1024 * 64
+CDC_MASK = ((1 << CDC_AVG_BITS) - 1) << (32 - CDC_AVG_BITS)
+CDC_AVG_SIZE = CDC_MIN_SIZE + (1 << CDC_AVG_BITS)
+
+# Random, but stable, values for each byte for the gear rolling hash
+_GEAR = tuple(
+    struct.unpack('>I', hashlib.sha1(bytes((byte,))).digest()[:4])[0]
+    for byte in range(256)
+)
+
+STATS_REDIS_KEY = 'dockci/blobs/stats'
+STATS_COUNTERS = (
+    'hits',
+    'misses',
+    'extracts',
+    'writes',
+    'bytes_hashed',
+    'bytes_extracted',
+    'bytes_written',
+    'bytes_deduped',
+    'hash_seconds',
+    'extract_seconds',
+    'write_seconds',
+)
+# Counters that aren't whole numbers
+STATS_FLOAT_COUNTERS = frozenset((
+    'hash_seconds',
+    'extract_seconds',
+    'write_seconds',
+))
+
+LOCK_SUFFIX = '.lock'
+TMP_MAX_AGE = 60 * 60  # 1hr
+
 
 def _copy_data(from_path, to_path, sources):
     """
     Copy data in ``sources`` from a path, to a path preserving directory
-    structure
+    structure, returning the number of bytes copied
 
     Examples:
 
@@ -34,15 +108,698 @@ def _copy_data(from_path, to_path, sources):
 
     >>> from_file.chmod(0o755)
     >>> _copy_data(from_path, to_path, [from_file])
+    0
     >>> oct(to_file.stat().mode)[-3:]
     '755'
     """
+    copied = 0
     for from_path_i in sources:
         rel_path_str = from_path_i.relto(from_path)
         to_path_i = to_path.join(rel_path_str)
 
         to_path_i.dirpath().ensure_dir()
         from_path_i.copy(to_path_i, mode=True)
+        copied += _path_size(to_path_i)
+
+    return copied
+
+
+def _expand_files(sources):
+    """
+    Expand any directories in ``sources`` into the files they contain
+
+    Examples:
+
+    >>> test_path = getfixture('tmpdir')
+    >>> test_path.join('dir_a').ensure_dir().join('file_b').write('')
+    >>> test_path.join('file_a').write('')
+
+    >>> [
+    ...     path.relto(test_path) for path in _expand_files([
+    ...         test_path.join('file_a'), test_path.join('dir_a'),
+    ...     ])
+    ... ]
+    ['file_a', 'dir_a/file_b']
+    """
+    for source in sources:
+        if source.check(dir=True):
+            for path in sorted(source.visit(fil=lambda p: p.check(file=True))):
+                yield path
+        else:
+            yield source
+
+
+def _tmp_path_for(path):
+    """ Hidden, unique path next to ``path`` for atomic writes """
+    return path.dirpath().join('.%s.tmp-%s' % (path.basename, uuid4().hex))
+
+
+def _write_pack(pack_path, from_path, sources, compression=None):
+    """
+    Write files in ``sources`` into a single pack file at ``pack_path``, with
+    paths relative to ``from_path``. The pack is written to a temporary file,
+    and moved in to place once complete so that readers never see a partial
+    pack
+
+    The pack is the ``PACK_MAGIC`` header, followed by the data of each file,
+    followed by a JSON index of file offsets, and a ``PACK_FOOTER`` giving the
+    location of the index. Returns the number of bytes of file data packed
+    """
+    if compression == 'zstd':
+        compressor = zstandard.ZstdCompressor()
+
+    pack_path.dirpath().ensure_dir()
+    tmp_path = _tmp_path_for(pack_path)
+
+    entries = []
+    try:
+        with open(tmp_path.strpath, 'wb', PACK_IO_SIZE) as pack_handle:
+            pack_handle.write(PACK_MAGIC)
+            offset = len(PACK_MAGIC)
+
+            for source in _expand_files(sources):
+                rel_path_str = source.relto(from_path)
+                length = 0
+                size = 0
+
+                if compression == 'zstd':
+                    compress_obj = compressor.compressobj()
+
+                with open(source.strpath, 'rb') as source_handle:
+                    while True:
+                        data = source_handle.read(PACK_IO_SIZE)
+                        if not data:
+                            break
+
+                        length += len(data)
+                        if compression == 'zstd':
+                            data = compress_obj.compress(data)
+
+                        pack_handle.write(data)
+                        size += len(data)
+
+                if compression == 'zstd':
+                    data = compress_obj.flush()
+                    pack_handle.write(data)
+                    size += len(data)
+
+                entries.append({
+                    'path': rel_path_str,
+                    'offset': offset,
+                    'size': size,
+                    'length': length,
+                    'mode': source.stat().mode & 0o7777,
+                })
+                offset += size
+
+            index_data = json.dumps({
+                'compression': compression,
+                'entries': entries,
+            }).encode()
+            pack_handle.write(index_data)
+            pack_handle.write(PACK_FOOTER.pack(
+                offset, len(index_data), PACK_MAGIC,
+            ))
+
+        tmp_path.rename(pack_path)
+
+    finally:
+        if tmp_path.check():
+            tmp_path.remove()
+
+    return sum(entry['length'] for entry in entries)
+
+
+@contextmanager
+def _flock(lock_path, exclusive=False, blocking=True):
+    """
+    Context manager to hold a ``flock`` on ``lock_path``, yielding whether the
+    lock was acquired (always ``True`` when ``blocking``). Lock files may be
+    removed by whoever holds the exclusive lock, so after locking we make sure
+    that the file we hold is still the one on disk, and retry if it isn't
+
+    Examples:
+
+    >>> lock_path = getfixture('tmpdir').join('test.lock')
+    >>> with _flock(lock_path) as acquired_1:
+    ...     with _flock(lock_path, True, False) as acquired_2:
+    ...         acquired_1, acquired_2
+    (True, False)
+
+    >>> with _flock(lock_path, True, False) as acquired:
+    ...     acquired
+    True
+    """
+    flags = fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH
+    if not blocking:
+        flags |= fcntl.LOCK_NB
+
+    lock_path.dirpath().ensure_dir()
+    while True:
+        handle = open(lock_path.strpath, 'a')
+        try:
+            try:
+                fcntl.flock(handle, flags)
+            except BlockingIOError:
+                yield False
+                return
+
+            try:
+                same_file = (
+                    os.fstat(handle.fileno()).st_ino ==
+                    os.stat(lock_path.strpath).st_ino
+                )
+            except FileNotFoundError:
+                same_file = False
+
+            if same_file:
+                yield True
+                return
+
+        finally:
+            handle.close()
+
+
+def _path_size(path):
+    """
+    Total size of the file, or all files in the directory at ``path``
+
+    Examples:
+
+    >>> test_path = getfixture('tmpdir')
+    >>> test_path.join('file_a').write('abc')
+    >>> test_path.join('dir_a').ensure_dir().join('file_b').write('defg')
+
+    >>> _path_size(test_path.join('file_a'))
+    3
+    >>> _path_size(test_path)
+    7
+    """
+    if path.check(dir=True):
+        return sum(
+            sub_path.size()
+            for sub_path in path.visit(fil=lambda p: p.check(file=True))
+        )
+
+    return path.size()
+
+
+def _read_pack_index(handle):
+    """ Read the JSON index from an open pack file handle """
+    handle.seek(-PACK_FOOTER.size, os.SEEK_END)
+    index_offset, index_size, magic = PACK_FOOTER.unpack(
+        handle.read(PACK_FOOTER.size)
+    )
+    if magic != PACK_MAGIC:
+        raise ValueError("Not a blob pack file")
+
+    handle.seek(index_offset)
+    return json.loads(handle.read(index_size).decode())
+
+
+def _path_selected(rel_path_str, rel_paths):
+    """
+    Check if ``rel_path_str`` is one of ``rel_paths``, or inside a directory
+    in ``rel_paths``
+
+    Examples:
+
+    >>> _path_selected('dir_a/file_b', None)
+    True
+    >>> _path_selected('dir_a/file_b', ['dir_a'])
+    True
+    >>> _path_selected('dir_a/file_b', ['dir_a/file_b'])
+    True
+    >>> _path_selected('dir_ab/file_b', ['dir_a'])
+    False
+    >>> _path_selected('file_a', ['dir_a'])
+    False
+    """
+    if rel_paths is None:
+        return True
+
+    for selected in rel_paths:
+        selected = selected.rstrip('/')
+        if rel_path_str == selected or rel_path_str.startswith(selected + '/'):
+            return True
+
+    return False
+
+
+def _extract_pack(pack_path, to_path, rel_paths=None):
+    """
+    Extract files from the pack at ``pack_path`` to ``to_path``. Entries are
+    read in pack order so that IO is large, and sequential. If ``rel_paths`` is
+    given, only those files (or files in those directories) are extracted.
+    Returns the number of bytes extracted
+    """
+    with open(pack_path.strpath, 'rb', PACK_IO_SIZE) as pack_handle:
+        index = _read_pack_index(pack_handle)
+        compression = index['compression']
+
+        if compression == 'zstd':
+            if zstandard is None:
+                raise ValueError(
+                    "Blob pack is zstd compressed, but the zstandard package "
+                    "is not installed"
+                )
+            decompressor = zstandard.ZstdDecompressor()
+
+        entries = sorted(
+            (
+                entry for entry in index['entries']
+                if _path_selected(entry['path'], rel_paths)
+            ),
+            key=lambda entry: entry['offset'],
+        )
+
+        pack_handle.seek(len(PACK_MAGIC))
+        extracted = 0
+        for entry in entries:
+            to_path_i = to_path.join(entry['path'])
+            if not path_contained(to_path, to_path_i):
+                raise ValueError(
+                    "Pack entry '%s' not inside container" % entry['path']
+                )
+
+            # Only seek when skipping entries to keep read ahead effective
+            if pack_handle.tell() != entry['offset']:
+                pack_handle.seek(entry['offset'])
+
+            if compression == 'zstd':
+                decompress_obj = decompressor.decompressobj()
+
+            to_path_i.dirpath().ensure_dir()
+            with open(to_path_i.strpath, 'wb', PACK_IO_SIZE) as out_handle:
+                remain = entry['size']
+                while remain > 0:
+                    data = pack_handle.read(min(PACK_IO_SIZE, remain))
+                    if not data:
+                        raise ValueError("Blob pack is truncated")
+
+                    remain -= len(data)
+                    if compression == 'zstd':
+                        data = decompress_obj.decompress(data)
+
+                    out_handle.write(data)
+
+            to_path_i.chmod(entry['mode'])
+            extracted += entry['length']
+
+    return extracted
+
+
+def _split_path(base_dir, digest, split_levels, split_size):
+    """
+    Path to ``digest`` in ``base_dir``, with the digest split into directory
+    levels to keep directories small
+
+    Examples:
+
+    >>> _split_path(py.path.local('/test'), 'abcdefghijkl', 3, 2).strpath
+    '/test/ab/cd/ef/abcdefghijkl'
+    """
+    return base_dir.join(*[
+        digest[idx:idx + split_size]
+        for idx in range(0, split_levels * split_size, split_size)
+    ] + [digest])
+
+
+def _cdc_cut(data, min_size=CDC_MIN_SIZE, max_size=CDC_MAX_SIZE):
+    """
+    Find the length of the first content defined chunk in ``data`` using a
+    gear rolling hash. Bytes before ``min_size`` are skipped, since no
+    boundary may be there anyway
+
+    Examples:
+
+    >>> _cdc_cut(b'a' * 100)
+    100
+    >>> _cdc_cut(b'a' * (CDC_MAX_SIZE * 2))
+    65536
+    """
+    length = len(data)
+    if length <= min_size:
+        return length
+
+    end = min(length, max_size)
+    gear = _GEAR
+    hash_ = 0
+    for idx in range(min_size, end):
+        hash_ = ((hash_ << 1) + gear[data[idx]]) & 0xffffffff
+        if not hash_ & CDC_MASK:
+            return idx + 1
+
+    return end
+
+
+def _native_cdc_chunks(handle):
+    """
+    Split the file open in ``handle`` into content defined chunks with the
+    native ``fastcdc`` chunker, which memory maps the file
+    """
+    if not os.fstat(handle.fileno()).st_size:
+        return  # Empty files can't be mapped
+
+    for chunk in fastcdc(handle,
+                         min_size=CDC_MIN_SIZE,
+                         avg_size=CDC_AVG_SIZE,
+                         max_size=CDC_MAX_SIZE,
+                         fat=True):
+        yield chunk.data
+
+
+def _cdc_chunks(handle):
+    """
+    Split all data read from ``handle`` into content defined chunks, so that
+    an insert, or delete only changes the chunks around it.
+
+    Files are chunked by ``fastcdc`` when it's installed, at around 1GiB/s.
+    Otherwise, the pure Python gear hash manages around 6MiB/s. Boundaries
+    from the two differ, so chunks written by one aren't deduplicated
+    against chunks written by the other
+
+    Examples:
+
+    >>> import io, random
+    >>> rand = random.Random(1)
+    >>> data = bytes(rand.getrandbits(8) for _ in range(200000))
+
+    >>> chunks = list(_cdc_chunks(io.BytesIO(data)))
+    >>> b''.join(chunks) == data
+    True
+    >>> len(chunks) > 1
+    True
+
+    >>> changed = list(_cdc_chunks(io.BytesIO(b'extra' + data)))
+    >>> chunks[-1] == changed[-1]
+    True
+    """
+    if fastcdc is not None:
+        try:
+            handle.fileno()
+        except (AttributeError, io.UnsupportedOperation):
+            pass
+        else:
+            yield from _native_cdc_chunks(handle)
+            return
+
+    buf = bytearray()
+    eof = False
+    while True:
+        while not eof and len(buf) < CDC_MAX_SIZE:
+            data = handle.read(PACK_IO_SIZE)
+            if not data:
+                eof = True
+            buf.extend(data)
+
+        if not buf:
+            return
+
+        cut = _cdc_cut(buf)
+        yield bytes(buf[:cut])
+        del buf[:cut]
+
+
+class ChunkStore(object):
+    """
+    Content addressed store of data chunks, shared by all chunked blobs in a
+    blob store so that data common to many blobs is only stored once
+    """
+
+    def __init__(self, store_dir, split_levels=2, split_size=2):
+        if not isinstance(store_dir, py.path.local):
+            store_dir = py.path.local(store_dir)
+
+        self.chunks_dir = store_dir.join(CHUNKS_DIR_NAME)
+        self.split_levels = split_levels
+        self.split_size = split_size
+
+    def path(self, digest):
+        """ ``py.path.local`` path to the chunk """
+        return _split_path(self.chunks_dir,
+                           digest,
+                           self.split_levels,
+                           self.split_size)
+
+    def put(self, data):
+        """
+        Store a chunk, if it's not already stored
+
+        Returns:
+          tuple(str, bool): The chunk digest, and whether it was newly written
+        """
+        digest = hashlib.sha1(data).hexdigest()
+        chunk_path = self.path(digest)
+
+        try:
+            # Keep reused chunks fresh, so that sweep doesn't remove them
+            # before the manifest referencing them is written
+            chunk_path.setmtime()
+            return digest, False
+
+        except py.error.ENOENT:  # pylint:disable=no-member
+            pass
+
+        chunk_path.dirpath().ensure_dir()
+        tmp_path = _tmp_path_for(chunk_path)
+        try:
+            with open(tmp_path.strpath, 'wb') as handle:
+                handle.write(data)
+            tmp_path.rename(chunk_path)
+
+        finally:
+            if tmp_path.check():
+                tmp_path.remove()
+
+        return digest, True
+
+    def get(self, digest):
+        """ Read the data for a chunk """
+        with open(self.path(digest).strpath, 'rb') as handle:
+            return handle.read()
+
+    def iter_chunks(self):
+        """ Iterate all stored chunk paths """
+        pattern = os.path.join(
+            self.chunks_dir.strpath,
+            *(['?' * self.split_size] * self.split_levels + ['*'])
+        )
+        for path_str in glob.iglob(pattern):
+            if not os.path.basename(path_str).startswith('.'):
+                yield py.path.local(path_str)
+
+    def sweep(self, live_digests, grace=TMP_MAX_AGE):
+        """
+        Remove chunks not in ``live_digests``, that haven't been written, or
+        reused within ``grace`` seconds
+
+        Returns:
+          int: Number of bytes removed
+        """
+        removed = 0
+        now = time.time()
+        for chunk_path in self.iter_chunks():
+            if chunk_path.basename in live_digests:
+                continue
+
+            try:
+                if now - chunk_path.mtime() < grace:
+                    continue
+
+                size = chunk_path.size()
+                chunk_path.remove()
+
+            except py.error.ENOENT:  # pylint:disable=no-member
+                continue
+
+            removed += size
+            _remove_empty_dirs(self.chunks_dir, chunk_path.dirpath())
+
+        return removed
+
+
+def _write_chunked(manifest_path, from_path, sources, chunk_store):
+    """
+    Split the files in ``sources`` into chunks in the ``chunk_store``, and
+    write a manifest of the chunks making up each file to ``manifest_path``
+
+    Returns:
+      tuple(int, int): Bytes written to new chunks, and bytes that were
+      already stored
+    """
+    written = 0
+    deduped = 0
+    entries = []
+    for source in _expand_files(sources):
+        digests = []
+        length = 0
+        with open(source.strpath, 'rb', PACK_IO_SIZE) as handle:
+            for chunk in _cdc_chunks(handle):
+                digest, new = chunk_store.put(chunk)
+                digests.append(digest)
+                length += len(chunk)
+                if new:
+                    written += len(chunk)
+                else:
+                    deduped += len(chunk)
+
+        entries.append({
+            'path': source.relto(from_path),
+            'length': length,
+            'mode': source.stat().mode & 0o7777,
+            'chunks': digests,
+        })
+
+    manifest_path.dirpath().ensure_dir()
+    tmp_path = _tmp_path_for(manifest_path)
+    try:
+        with open(tmp_path.strpath, 'wb') as handle:
+            handle.write(CHUNKED_MAGIC)
+            handle.write(json.dumps({'entries': entries}).encode())
+        tmp_path.rename(manifest_path)
+
+    finally:
+        if tmp_path.check():
+            tmp_path.remove()
+
+    return written, deduped
+
+
+def _read_chunked_manifest(manifest_path):
+    """ Read the entries from a chunked blob manifest """
+    with open(manifest_path.strpath, 'rb') as handle:
+        if handle.read(len(CHUNKED_MAGIC)) != CHUNKED_MAGIC:
+            raise ValueError("Not a chunked blob manifest")
+
+        return json.loads(handle.read().decode())['entries']
+
+
+def _extract_chunked(manifest_path, to_path, chunk_store, rel_paths=None):
+    """
+    Reassemble files from the chunked blob manifest at ``manifest_path`` in
+    to ``to_path``. If ``rel_paths`` is given, only those files (or files in
+    those directories) are extracted. Returns the number of bytes extracted
+    """
+    extracted = 0
+    for entry in _read_chunked_manifest(manifest_path):
+        if not _path_selected(entry['path'], rel_paths):
+            continue
+
+        to_path_i = to_path.join(entry['path'])
+        if not path_contained(to_path, to_path_i):
+            raise ValueError(
+                "Chunked entry '%s' not inside container" % entry['path']
+            )
+
+        to_path_i.dirpath().ensure_dir()
+        with open(to_path_i.strpath, 'wb', PACK_IO_SIZE) as out_handle:
+            for digest in entry['chunks']:
+                out_handle.write(chunk_store.get(digest))
+
+        to_path_i.chmod(entry['mode'])
+        extracted += entry['length']
+
+    return extracted
+
+
+class BlobStats(object):
+    """
+    Counters for how effective blob caching is, grouped by a label (eg the
+    project, and utility using the blob). Counters are kept in memory, and
+    also added to a Redis hash per label when ``redis_conn`` is given, so that
+    stats from all processes using blobs can be read in one place. Stats are
+    only observational, so Redis errors are logged rather than raised
+    """
+
+    def __init__(self, redis_conn=None):
+        self.redis_conn = redis_conn
+        self.counters = defaultdict(Counter)
+
+    def incr(self, label, **values):
+        """
+        Add to the counters for ``label``
+
+        Examples:
+
+        >>> stats = BlobStats()
+        >>> stats.incr('test', hits=1, bytes_written=10)
+        >>> stats.incr('test', hits=1)
+        >>> stats.summary()['test']['hits']
+        2
+        """
+        self.counters[label].update(values)
+
+        if self.redis_conn is None:
+            return
+
+        key = '%s/%s' % (STATS_REDIS_KEY, label)
+        try:
+            with self.redis_conn.pipeline() as pipe:
+                pipe.sadd(STATS_REDIS_KEY, label)
+                for name, value in values.items():
+                    if name in STATS_FLOAT_COUNTERS:
+                        pipe.hincrbyfloat(key, name, value)
+                    else:
+                        pipe.hincrby(key, name, value)
+                pipe.execute()
+
+        except RedisError:
+            logging.getLogger('dockci.blob').exception(
+                "Error recording blob stats for '%s'", label,
+            )
+
+    @classmethod
+    def summarize(cls, counters):
+        """
+        Add derived stats (like hit rate) to a dict of counters
+
+        Examples:
+
+        >>> summary = BlobStats.summarize({'hits': 3, 'misses': 1})
+        >>> summary['hit_rate'], summary['writes']
+        (0.75, 0)
+        """
+        summary = {name: counters.get(name, 0) for name in STATS_COUNTERS}
+        lookups = summary['hits'] + summary['misses']
+        summary['hit_rate'] = (
+            summary['hits'] / lookups if lookups else None
+        )
+        return summary
+
+    def summary(self):
+        """ Summary of the in-memory counters for each label """
+        return {
+            label: self.summarize(counters)
+            for label, counters in self.counters.items()
+        }
+
+    @classmethod
+    def load(cls, redis_conn):
+        """ Summary of the counters for each label stored in Redis """
+        labels = sorted(
+            label.decode() if isinstance(label, bytes) else label
+            for label in redis_conn.smembers(STATS_REDIS_KEY)
+        )
+        with redis_conn.pipeline() as pipe:
+            for label in labels:
+                pipe.hgetall('%s/%s' % (STATS_REDIS_KEY, label))
+
+            all_counters = pipe.execute()
+
+        summaries = {}
+        for label, counters in zip(labels, all_counters):
+            values = {}
+            for name, value in counters.items():
+                name = name.decode() if isinstance(name, bytes) else name
+                values[name] = (
+                    float(value) if name in STATS_FLOAT_COUNTERS
+                    else int(value)
+                )
+
+            summaries[label] = cls.summarize(values)
+
+        return summaries
 
 
 class FilesystemBlob(object):
@@ -54,10 +811,23 @@ class FilesystemBlob(object):
                  etag,
                  split_levels=3,
                  split_size=2,
+                 blob_format='tree',
+                 compression=None,
+                 stats=None,
+                 stats_label='default',
                  ):
         if not isinstance(store_dir, py.path.local):
             store_dir = py.path.local(store_dir)
 
+        if blob_format not in BLOB_FORMATS:
+            raise ValueError("Unknown blob format '%s'" % blob_format)
+        if compression not in PACK_COMPRESSIONS:
+            raise ValueError("Unknown compression '%s'" % compression)
+        if compression == 'zstd' and zstandard is None:
+            raise ValueError(
+                "zstd compression requires the zstandard package"
+            )
+
         self.data_paths = []
 
         self.store_dir = store_dir
@@ -65,6 +835,10 @@ class FilesystemBlob(object):
         self.etag = etag
         self.split_levels = split_levels
         self.split_size = split_size
+        self.blob_format = blob_format
+        self.compression = compression
+        self.stats = stats
+        self.stats_label = stats_label
 
     @classmethod
     def from_files(cls,
@@ -75,7 +849,8 @@ class FilesystemBlob(object):
                    **kwargs):
         """
         Create a ``FilesystemBlob`` object from file paths, using their hash as
-        an etag
+        an etag. If a ``stats`` kwarg is given, time taken, and bytes hashed
+        are recorded
 
         Examples:
 
@@ -166,7 +941,11 @@ class FilesystemBlob(object):
                 (key, meta[key]) for key in sorted(meta.keys())
             ])
 
+        stats = kwargs.get('stats', None)
+        start_time = time.time()
+
         digests = []
+        bytes_hashed = 0
         for file_path in file_paths:
             with file_path.open('rb') as handle:
                 file_hash = hashlib.sha1(json.dumps(meta).encode())
@@ -175,9 +954,15 @@ class FilesystemBlob(object):
                 while chunk is None or len(chunk) == CHUNK_SIZE:
                     chunk = handle.read(CHUNK_SIZE)
                     file_hash.update(chunk)
+                    bytes_hashed += len(chunk)
 
                 digests.append(file_hash.digest())
 
+        if stats is not None:
+            stats.incr(kwargs.get('stats_label', 'default'),
+                       bytes_hashed=bytes_hashed,
+                       hash_seconds=time.time() - start_time)
+
         all_hash = hashlib.sha1()
         for digest in sorted(digests):
             all_hash.update(digest)
@@ -239,16 +1024,121 @@ class FilesystemBlob(object):
         ... ).path.strpath
         '/other/ab/cd/ef/abcdefghijkl'
         """
-        return self.store_dir.join(*[
-            self.etag[idx:idx + self.split_size]
-            for idx in self._etag_split_iter
-        ] + [self.etag])
+        return _split_path(self.store_dir,
+                           self.etag,
+                           self.split_levels,
+                           self.split_size)
+
+    @property
+    def chunk_store(self):
+        """ ``ChunkStore`` shared by chunked blobs in the ``store_dir`` """
+        return ChunkStore(self.store_dir)
 
     @property
     def exists(self):
         """ Check if the blob exists already """
         return self.path.exists()
 
+    def lookup(self):
+        """
+        Check if the blob exists already, to use it as a cache. This is
+        counted as a cache hit, or miss in ``stats``
+        """
+        exists = self.exists
+        if self.stats is not None:
+            if exists:
+                self.stats.incr(self.stats_label, hits=1)
+            else:
+                self.stats.incr(self.stats_label, misses=1)
+
+        return exists
+
+    @property
+    def lock_path(self):
+        """ ``py.path.local`` path to the lock file for the blob """
+        return self.path.dirpath().join(self.etag + LOCK_SUFFIX)
+
+    @property
+    def last_access(self):
+        """
+        Time that the blob was last written, or extracted. This is tracked
+        explicitly, since atime is unreliable on ``relatime``/``noatime``
+        mounts
+        """
+        return self.path.mtime()
+
+    @property
+    def size(self):
+        """
+        Total bytes of data stored for the blob. For chunked blobs, this
+        includes all chunks referenced, even if they're shared
+        """
+        digests = self.chunk_digests
+        if digests:
+            chunk_store = self.chunk_store
+            return self.path.size() + sum(
+                chunk_store.path(digest).size() for digest in digests
+            )
+
+        return _path_size(self.path)
+
+    @property
+    def chunk_digests(self):
+        """ Set of chunk digests referenced by a chunked blob """
+        if self.stored_format != 'chunked':
+            return set()
+
+        return {
+            digest
+            for entry in _read_chunked_manifest(self.path)
+            for digest in entry['chunks']
+        }
+
+    def touch(self):
+        """ Update ``last_access`` of the blob to now """
+        self.path.setmtime()
+
+    def lock(self, exclusive=False, blocking=True):
+        """
+        Context manager to lock the blob. ``extract`` and ``write`` hold a
+        shared lock, and garbage collection holds an exclusive lock, so that
+        blobs are never removed while in use
+        """
+        return _flock(self.lock_path, exclusive, blocking)
+
+    def remove(self):
+        """
+        Remove the blob data. The exclusive lock must be held by the caller
+        """
+        try:
+            self.path.remove(rec=True)
+        except py.error.ENOENT:  # pylint:disable=no-member
+            pass
+
+    @property
+    def stored_format(self):
+        """
+        Format of the stored blob (see ``BLOB_FORMATS``). This is detected from
+        the stored data, rather than ``blob_format`` so that blobs written in
+        any format can be extracted
+        """
+        blob_path = self.path
+        if not blob_path.check(file=True):
+            return 'tree'
+
+        with open(blob_path.strpath, 'rb') as handle:
+            magic = handle.read(len(PACK_MAGIC))
+
+        if magic == CHUNKED_MAGIC:
+            return 'chunked'
+
+        return 'pack'
+
+    @property
+    def is_packed(self):
+        """ Whether the stored blob is in the packed format """
+        return self.stored_format == 'pack'
+
     def add_data(self, rel_path_str):
         """ Add data to store in the blob """
         full_path = self.root_path.join(rel_path_str)
@@ -256,13 +1146,244 @@ class FilesystemBlob(object):
             "Data not inside container")
         self.data_paths.append(full_path)
 
-    def extract(self):
-        """ Extract data from the blob to the ``root_path`` """
+    def extract(self, rel_paths=None):
+        """
+        Extract data from the blob to the ``root_path``. If ``rel_paths`` is
+        given, only those paths are extracted
+        """
+        with self.lock():
+            start_time = time.time()
+            extracted = self._extract(rel_paths)
+            self.touch()
+
+        if self.stats is not None:
+            self.stats.incr(self.stats_label,
+                            extracts=1,
+                            bytes_extracted=extracted,
+                            extract_seconds=time.time() - start_time)
+
+    def _extract(self, rel_paths):
+        """
+        Extract logic for ``extract``, without locking. Returns the number of
+        bytes extracted
+        """
         blob_path = self.path
-        _copy_data(blob_path, self.root_path, blob_path.listdir())
+        stored_format = self.stored_format
+        if stored_format == 'pack':
+            return _extract_pack(blob_path, self.root_path, rel_paths)
+
+        if stored_format == 'chunked':
+            return _extract_chunked(blob_path,
+                                    self.root_path,
+                                    self.chunk_store,
+                                    rel_paths)
+
+        if rel_paths is None:
+            sources = blob_path.listdir()
+        else:
+            sources = [
+                blob_path.join(rel_path_str) for rel_path_str in rel_paths
+            ]
+            sources = [
+                source for source in sources
+                if path_contained(blob_path, source) and source.check()
+            ]
+
+        return _copy_data(blob_path, self.root_path, sources)
 
     def write(self):
         """ Write data to the blob """
+        with self.lock():
+            start_time = time.time()
+            written, deduped = self._write()
+            self.touch()
+
+        if self.stats is not None:
+            self.stats.incr(self.stats_label,
+                            writes=1,
+                            bytes_written=written,
+                            bytes_deduped=deduped,
+                            write_seconds=time.time() - start_time)
+
+    def _write(self):
+        """
+        Write logic for ``write``, without locking
+
+        Returns:
+          tuple(int, int): Bytes of data written, and bytes of data that were
+          already stored (chunked blobs only)
+        """
         blob_path = self.path
+        if self.blob_format == 'pack':
+            return _write_pack(blob_path,
+                               self.root_path,
+                               self.data_paths,
+                               self.compression), 0
+
+        if self.blob_format == 'chunked':
+            return _write_chunked(blob_path,
+                                  self.root_path,
+                                  self.data_paths,
+                                  self.chunk_store)
+
         blob_path.ensure_dir()
-        _copy_data(self.root_path, blob_path, self.data_paths)
+        return _copy_data(self.root_path, blob_path, self.data_paths), 0
+
+
+def iter_blobs(store_dir, split_levels=3, split_size=2):
+    """
+    Iterate all ``FilesystemBlob`` objects in ``store_dir``. Blobs have no
+    ``root_path``, so are only useful for inspection, and removal
+
+    Examples:
+
+    >>> store_path = getfixture('tmpdir')
+    >>> FilesystemBlob(store_path, None, 'abcdefghi').path.ensure_dir()
+    local(...)
+    >>> FilesystemBlob(store_path, None, 'bcdefghij').path.ensure()
+    local(...)
+    >>> FilesystemBlob(store_path, None, 'bcdefghij').lock_path.ensure()
+    local(...)
+
+    >>> sorted(blob.etag for blob in iter_blobs(store_path))
+    ['abcdefghi', 'bcdefghij']
+    """
+    if not isinstance(store_dir, py.path.local):
+        store_dir = py.path.local(store_dir)
+
+    pattern = os.path.join(
+        store_dir.strpath, *(['?' * split_size] * split_levels + ['*'])
+    )
+    for path_str in glob.iglob(pattern):
+        basename = os.path.basename(path_str)
+        if basename.endswith(LOCK_SUFFIX):
+            continue
+
+        yield FilesystemBlob(store_dir,
+                             None,
+                             basename,
+                             split_levels=split_levels,
+                             split_size=split_size)
+
+
+def _remove_stale_tmp(store_dir, split_levels, split_size):
+    """ Remove temporary files left behind by interrupted writes """
+    pattern = os.path.join(
+        store_dir.strpath, *(['?' * split_size] * split_levels + ['.*.tmp-*'])
+    )
+    for path_str in glob.iglob(pattern):
+        path = py.path.local(path_str)
+        try:
+            if time.time() - path.mtime() > TMP_MAX_AGE:
+                path.remove(rec=True)
+
+        except py.error.ENOENT:  # pylint:disable=no-member
+            pass
+
+
+def _remove_empty_dirs(store_dir, path):
+    """ Remove empty split directories from ``path`` up to ``store_dir`` """
+    while path != store_dir and path.relto(store_dir):
+        try:
+            path.remove(rec=False)
+        except py.error.Error:  # pylint:disable=no-member
+            return
+
+        path = path.dirpath()
+
+
+def gc_blobs(store_dir,
+             max_bytes,
+             dry_run=False,
+             split_levels=3,
+             split_size=2):
+    """
+    Remove least recently used blobs from ``store_dir`` until it uses no more
+    than ``max_bytes``. Blobs that are locked (being extracted, or written)
+    are skipped. If ``dry_run`` is set, nothing is removed, but the blobs that
+    would be are returned as though they were
+
+    Chunks shared between chunked blobs are counted towards each blob by
+    their share of the references, and chunks no longer referenced by any
+    blob are removed after eviction
+
+    Returns:
+      tuple(list, int, int): List of ``(blob, size)`` tuples removed, total
+      bytes before, and total bytes after
+    """
+    if not isinstance(store_dir, py.path.local):
+        store_dir = py.path.local(store_dir)
+
+    if not dry_run:
+        _remove_stale_tmp(store_dir, split_levels, split_size)
+
+    chunk_store = ChunkStore(store_dir)
+    chunk_sizes = {}
+    for chunk_path in chunk_store.iter_chunks():
+        try:
+            chunk_sizes[chunk_path.basename] = chunk_path.size()
+        except py.error.ENOENT:  # pylint:disable=no-member
+            pass
+
+    blobs = []
+    for blob in iter_blobs(store_dir, split_levels, split_size):
+        try:
+            blobs.append((
+                blob.last_access,
+                _path_size(blob.path),
+                blob.chunk_digests,
+                blob,
+            ))
+        except py.error.ENOENT:  # pylint:disable=no-member
+            pass  # Removed since listing
+
+    chunk_refs = Counter(
+        digest for _, _, digests, _ in blobs for digest in digests
+    )
+
+    total_before = (
+        sum(own_size for _, own_size, _, _ in blobs) +
+        sum(chunk_sizes.values())
+    )
+    total = total_before
+    removed = []
+    removed_own_size = 0
+    live_blobs = []
+
+    for _, own_size, digests, blob in sorted(blobs, key=lambda data: data[0]):
+        size = own_size + int(sum(
+            chunk_sizes.get(digest, 0) / chunk_refs[digest]
+            for digest in digests
+        ))
+
+        if total <= max_bytes:
+            live_blobs.append(digests)
+            continue
+
+        if not dry_run:
+            with blob.lock(exclusive=True, blocking=False) as acquired:
+                if not acquired:
+                    live_blobs.append(digests)
+                    continue
+
+                blob.remove()
+                blob.lock_path.remove()
+
+            _remove_empty_dirs(store_dir, blob.path.dirpath())
+
+        removed.append((blob, size))
+        removed_own_size += own_size
+        total -= size
+
+    if not dry_run:
+        live_digests = set()
+        for digests in live_blobs:
+            live_digests.update(digests)
+
+        total = (
+            total_before -
+            removed_own_size -
+            chunk_store.sweep(live_digests)
+        )
+
+    return removed, total_before, total
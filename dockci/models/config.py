@@ -138,6 +138,15 @@ class Config(SingletonModel):  # pylint:disable=too-few-public-methods
         default=60 * 60,  # 1hr
         input_transform=int,
     )
+    live_log_fanout = LoadOnAccess(default=lambda _: False,
+                                   input_transform=bool)
+    webhook_deferred = LoadOnAccess(default=lambda _: False,
+                                    input_transform=bool)
+    job_claims = LoadOnAccess(default=lambda _: False, input_transform=bool)
+    job_placement = LoadOnAccess(default=lambda _: False,
+                                 input_transform=bool)
+    response_compression = LoadOnAccess(default=lambda _: False,
+                                        input_transform=bool)
 
     @property
     def github_enabled(self):
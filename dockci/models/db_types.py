@@ -2,9 +2,47 @@
 
 import re
 
+from functools import lru_cache
+
 from sqlalchemy import types
 
 
+REGEX_CACHE_SIZE = 256
+
+
+@lru_cache(maxsize=REGEX_CACHE_SIZE)
+def compile_regex(pattern):
+    """
+    Compile a regex, sharing the compiled object for each pattern string
+
+    Examples:
+
+    >>> compile_regex(r'dev-.+') is compile_regex(r'dev-.+')
+    True
+    >>> compile_regex(r'dev-.+').pattern
+    'dev-.+'
+    """
+    return re.compile(pattern)
+
+
+def patterns_matching(value, patterns):
+    """
+    Set of the regex pattern strings that match a value. Each distinct
+    pattern is compiled, and matched only once
+
+    Examples:
+
+    >>> sorted(patterns_matching('dev-thing', ['dev-.+', 'master', 'dev-.+']))
+    ['dev-.+']
+    >>> patterns_matching('other', ['dev-.+', 'master'])
+    set()
+    """
+    return {
+        pattern for pattern in set(patterns)
+        if compile_regex(pattern).match(value) is not None
+    }
+
+
 # Be very careful changing these. Changes MAY NOT be reflected in the
 # migrations (eg changing ``impl`` won't correctly migrate)
 
@@ -22,4 +60,4 @@ class RegexType(types.TypeDecorator):  # pylint:disable=abstract-method
     def process_result_value(self, value, _):
         if value is None:
             return value
-        return re.compile(value)
+        return compile_regex(value)
@@ -8,7 +8,7 @@ DockCI - CI, but with that all important Docker twist
 import json
 import logging
 
-from datetime import datetime
+from datetime import datetime, timedelta
 from enum import Enum
 
 import py.path  # pylint:disable=import-error
@@ -18,12 +18,13 @@ import sqlalchemy
 from flask import url_for
 from flask_mail import Message
 
-from .base import RepoFsMixin
+from .base import RepoFsMixin, version_column
 from dockci.exceptions import AlreadyRunError, InvalidServiceTypeError
-from dockci.server import DB, MAIL, OAUTH_APPS, pika_conn
+from dockci.server import CONFIG, DB, MAIL, OAUTH_APPS, pika_conn
 from dockci.util import (add_to_url_path,
                          bytes_human_readable,
                          ext_url_for,
+                         host_routing_key,
                          )
 
 
@@ -34,6 +35,7 @@ STATE_MAP = {
         'success': 'success',
         'fail': 'failure',
         'broken': 'error',
+        'superseded': 'error',
         None: 'error',
     },
     'gitlab': {
@@ -42,6 +44,7 @@ STATE_MAP = {
         'success': 'success',
         'fail': 'failed',
         'broken': 'canceled',
+        'superseded': 'canceled',
         None: 'canceled',
     },
 }
@@ -104,9 +107,12 @@ PUSH_REASON_MESSAGES = {
         "branch name doesn't match branch pattern",
 }
 
+SUPERSEDED_STATE = 'superseded'
+
 COMPLETE_STATES = (JobResult.success.value,
                    JobResult.fail.value,
                    JobResult.broken.value,
+                   SUPERSEDED_STATE,
                    )
 
 
@@ -116,6 +122,7 @@ class JobStageTmp(DB.Model):  # pylint:disable=no-init
     slug = DB.Column(DB.String(31))
     job_id = DB.Column(DB.Integer, DB.ForeignKey('job.id'), index=True)
     success = DB.Column(DB.Boolean(), nullable=True)
+    version_id = version_column()
     job = DB.relationship(
         'Job',
         foreign_keys="JobStageTmp.job_id",
@@ -134,26 +141,34 @@ class Job(DB.Model, RepoFsMixin):
     create_ts = DB.Column(
         DB.DateTime(), nullable=False, default=datetime.now,
     )
+    claim_ts = DB.Column(DB.DateTime())
     start_ts = DB.Column(DB.DateTime())
     complete_ts = DB.Column(DB.DateTime())
+    priority = DB.Column(DB.Integer(),
+                         default=0,
+                         server_default='0',
+                         nullable=False)
 
     result = DB.Column(DB.Enum(
         *JobResult.__members__,
         name='job_results'
     ), index=True)
-    repo_fs = DB.Column(DB.Text(), nullable=False)
     commit = DB.Column(DB.String(41), nullable=False)
     tag = DB.Column(DB.Text())
-    image_id = DB.Column(DB.String(65))
-    container_id = DB.Column(DB.String(65))
     exit_code = DB.Column(DB.Integer())
-    docker_client_host = DB.Column(DB.Text())
     git_branch = DB.Column(DB.Text())
-    git_author_name = DB.Column(DB.Text())
-    git_author_email = DB.Column(DB.Text())
-    git_committer_name = DB.Column(DB.Text())
-    git_committer_email = DB.Column(DB.Text())
-    git_changes = DB.Column(DB.Text())
+
+    # Not needed for state, or lists, so only loaded on access, unless their
+    # group is undeferred by the query
+    repo_fs = DB.deferred(DB.Column(DB.Text(), nullable=False), group='git')
+    git_author_name = DB.deferred(DB.Column(DB.Text()), group='git')
+    git_author_email = DB.deferred(DB.Column(DB.Text()), group='git')
+    git_committer_name = DB.deferred(DB.Column(DB.Text()), group='git')
+    git_committer_email = DB.deferred(DB.Column(DB.Text()), group='git')
+    image_id = DB.deferred(DB.Column(DB.String(65)), group='docker')
+    container_id = DB.deferred(DB.Column(DB.String(65)), group='docker')
+    docker_client_host = DB.deferred(DB.Column(DB.Text()), group='docker')
+    git_changes = DB.deferred(DB.Column(DB.Text()), group='changes')
 
     ancestor_job_id = DB.Column(DB.Integer, DB.ForeignKey('job.id'))
     child_jobs = DB.relationship(
@@ -161,7 +176,19 @@ class Job(DB.Model, RepoFsMixin):
         foreign_keys="Job.ancestor_job_id",
         backref=DB.backref('ancestor_job', remote_side=[id]),
     )
+    superseded_by_id = DB.Column(
+        DB.Integer, DB.ForeignKey('job.id'), index=True,
+    )
+    superseded_jobs = DB.relationship(
+        'Job',
+        foreign_keys="Job.superseded_by_id",
+        backref=DB.backref('superseded_by', remote_side=[id]),
+    )
     project_id = DB.Column(DB.Integer, DB.ForeignKey('project.id'), index=True)
+    version_id = version_column()
+
+    # Keyset order for exports (see ``dockci.api.job_export``)
+    __table_args__ = (DB.Index('ix_job_create_ts_id', 'create_ts', 'id'),)
 
     _job_config = None
     _db_session = None
@@ -246,10 +273,33 @@ class Job(DB.Model, RepoFsMixin):
         """
         Current state that the job is in
         """
-        if self.result is not None:
-            return self.result
-        elif self.job_stages:
+        return self.state_from(
+            self.result, bool(self.job_stages), self.superseded_by_id,
+        )
+
+    @classmethod
+    def state_from(cls, result, has_stages, superseded_by_id):
+        """
+        Job state from the result, whether there are stages, and superseding
+        job ID, so that state can be given without loading a ``Job``
+
+        Examples:
+
+        >>> Job.state_from('fail', True, None)
+        'fail'
+        >>> Job.state_from(None, True, None)
+        'running'
+        >>> Job.state_from(None, False, 2)
+        'superseded'
+        >>> Job.state_from(None, False, None)
+        'queued'
+        """
+        if result is not None:
+            return result
+        elif has_stages:
             return 'running'  # TODO check if running or dead
+        elif superseded_by_id is not None:
+            return SUPERSEDED_STATE
         else:
             return 'queued'  # TODO check if queued or queue fail
 
@@ -291,7 +341,7 @@ class Job(DB.Model, RepoFsMixin):
     @property
     def is_complete(self):
         """
-        Jobs are complete if they are success, fail, or broken
+        Jobs are complete if they are success, fail, broken, or superseded
 
         Examples:
 
@@ -315,6 +365,12 @@ class Job(DB.Model, RepoFsMixin):
         'running'
         >>> job.is_complete
         False
+
+        >>> job = Job(job_stages=[], superseded_by_id=2)
+        >>> job.state
+        'superseded'
+        >>> job.is_complete
+        True
         """
         return self.state in COMPLETE_STATES
 
@@ -390,24 +446,121 @@ class Job(DB.Model, RepoFsMixin):
 
         return query
 
-    def queue(self):
+    def queue(self, channel=None):
         """
-        Add the job to the queue
+        Add the job to the queue. When a pika ``channel`` is given, it's used
+        rather than opening a new connection, so that many jobs can be queued
+        cheaply. When agents claim jobs from the scheduler, they're only
+        notified that a job is available. Jobs placed on a Docker host, by
+        ``dockci.placement.place_new_jobs``, are routed to the host's queue
         """
         if self.start_ts:
             raise AlreadyRunError(self)
 
-        with pika_conn() as conn:
-            channel = conn.channel()
+        if channel is None:
+            with pika_conn() as conn:
+                return self.queue(conn.channel())
+
+        if CONFIG.job_claims:
             channel.basic_publish(
                 exchange='dockci.queue',
-                routing_key='new_job',
+                routing_key='job_available',
                 body=json.dumps(dict(
                     job_slug=self.slug,
                     project_slug=self.project.slug,
-                    command_repo=self.command_repo,
                 )),
             )
+            return
+
+        routing_key = 'new_job'
+        if CONFIG.job_placement and self.docker_client_host is not None:
+            routing_key = 'new_job.%s' % host_routing_key(
+                self.docker_client_host,
+            )
+
+        channel.basic_publish(
+            exchange='dockci.queue',
+            routing_key=routing_key,
+            body=json.dumps(dict(
+                job_slug=self.slug,
+                project_slug=self.project.slug,
+                command_repo=self.command_repo,
+            )),
+        )
+
+    def supersede_queued(self):
+        """
+        Mark jobs for the same project, and branch that are still queued, and
+        were created within the project's coalescing window as superseded by
+        this job, so that agents skip them. The job must have been flushed
+
+        Returns:
+          list(Job): Jobs that were superseded
+        """
+        window = self.project.coalesce_window
+        if not window or self.git_branch is None or self.tag is not None:
+            return []
+
+        cls = self.__class__
+        jobs = cls.query.filter(
+            cls.project_id == self.project.id,
+            cls.git_branch == self.git_branch,
+            cls.tag.is_(None),
+            cls.id < self.id,
+            cls.create_ts >= datetime.now() - timedelta(seconds=window),
+            cls.claim_ts.is_(None),
+            cls.start_ts.is_(None),
+            cls.result.is_(None),
+            cls.superseded_by_id.is_(None),
+            ~cls.job_stages.any(),
+        ).all()
+
+        for job in jobs:
+            job.superseded_by = self
+
+        return jobs
+
+    def state_detail(self):
+        """
+        Job state details for live viewers
+
+        Examples:
+
+        >>> detail = Job(result=JobResult.fail.value).state_detail()
+        >>> detail['state'], detail['result'], detail['complete_ts']
+        ('fail', 'fail', None)
+        """
+        return {
+            'state': self.state,
+            'result': self.result,
+            'exit_code': self.exit_code,
+            'start_ts': None if self.start_ts is None else (
+                self.start_ts.isoformat()
+            ),
+            'complete_ts': None if self.complete_ts is None else (
+                self.complete_ts.isoformat()
+            ),
+        }
+
+    def publish_state(self):
+        """
+        Publish the job state to live viewers. Errors are logged, rather than
+        raised, since viewers will still see the state on reload
+        """
+        try:
+            with pika_conn() as conn:
+                channel = conn.channel()
+                channel.basic_publish(
+                    exchange='dockci.job',
+                    routing_key='dockci.{project}.{job}.state'.format(
+                        project=self.project.slug,
+                        job=self.slug,
+                    ),
+                    body=json.dumps(self.state_detail()),
+                )
+
+        except Exception:  # pylint:disable=broad-except
+            logging.exception("Couldn't publish state for job %s", self.slug)
 
     def state_data_for(self, service, state=None, state_msg=None):
         """
@@ -446,6 +599,8 @@ class Job(DB.Model, RepoFsMixin):
                 state_msg = "completed with failing tests"
             elif state == 'broken':
                 state_msg = "failed to complete due to an error"
+            elif state == SUPERSEDED_STATE:
+                state_msg = "was superseded by a newer push"
 
         if state_msg is not None:
             state_msg = "The DockCI job %s" % state_msg
@@ -0,0 +1,196 @@
+"""
+Placement of queued jobs on Docker hosts
+
+Each host's load is worked out from jobs placed on it: jobs that haven't
+finished, how long recent jobs took, and whether the project has built an
+image there recently, so that its layers are likely cached. Jobs are
+published with a routing key for the chosen host, and agents for that host
+consume them from the host's queue
+"""
+
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+import sqlalchemy
+
+from dockci.models.job import Job
+from dockci.server import CONFIG, DB
+from dockci.util import host_base_url, host_routing_key
+
+
+# Seconds a job is expected to take on a host without recent jobs
+DEFAULT_DURATION = 300
+
+# Extra seconds expected for a job on a host without the project's layers
+COLD_CACHE_SECONDS = 120
+
+# How far back to look for job durations, and project images
+DURATION_WINDOW = timedelta(hours=6)
+LOCALITY_WINDOW = timedelta(days=7)
+
+
+def host_queue_name(base_url):
+    """
+    Name of the agent queue for a Docker host
+
+    Examples:
+
+    >>> host_queue_name('tcp://10.0.0.1:2375')
+    'dockci.agent.tcp___10_0_0_1_2375'
+    """
+    return 'dockci.agent.%s' % host_routing_key(base_url)
+
+
+class HostLoad(namedtuple('HostLoad', ['host', 'running', 'duration',
+                                       'cached'])):
+    """ Load on a Docker host, as seen by the job being placed """
+    __slots__ = ()
+
+    @property
+    def expected_start(self):
+        """
+        Seconds until a new job could start, plus the time to pull, or build
+        layers that aren't cached
+
+        Examples:
+
+        >>> HostLoad('a', 2, 60, True).expected_start
+        120
+        >>> HostLoad('a', 0, None, False).expected_start
+        120
+        """
+        duration = DEFAULT_DURATION if self.duration is None else (
+            self.duration
+        )
+        penalty = 0 if self.cached else COLD_CACHE_SECONDS
+        return self.running * duration + penalty
+
+
+def choose_host(loads):
+    """
+    Host where a job is expected to start, and finish soonest. Ties go to the
+    host with fewest running jobs, then the first host configured
+
+    Examples:
+
+    >>> choose_host([
+    ...     HostLoad('busy', 3, 60, True),
+    ...     HostLoad('idle', 0, None, False),
+    ...     HostLoad('warm', 1, 30, True),
+    ... ])
+    'warm'
+    >>> choose_host([
+    ...     HostLoad('a', 1, 60, False),
+    ...     HostLoad('b', 0, None, False),
+    ... ])
+    'b'
+    >>> choose_host([]) is None
+    True
+    """
+    if not loads:
+        return None
+
+    return min(
+        enumerate(loads),
+        key=lambda pair: (
+            pair[1].expected_start, pair[1].running, pair[0],
+        ),
+    )[1].host
+
+
+def host_loads(job, hosts, now=None):
+    """ ``HostLoad`` for each of the Docker host base URLs, for ``job`` """
+    if now is None:
+        now = datetime.now()
+
+    on_hosts = Job.docker_client_host.in_(hosts)
+
+    running = dict(DB.session.query(
+        Job.docker_client_host, sqlalchemy.func.count(Job.id),
+    ).filter(
+        on_hosts,
+        Job.id != job.id,
+        Job.result.is_(None),
+        Job.superseded_by_id.is_(None),
+    ).group_by(Job.docker_client_host))
+
+    durations = dict(DB.session.query(
+        Job.docker_client_host,
+        sqlalchemy.func.avg(sqlalchemy.func.extract(
+            'epoch', Job.complete_ts - Job.start_ts,
+        )),
+    ).filter(
+        on_hosts,
+        Job.start_ts.isnot(None),
+        Job.complete_ts >= now - DURATION_WINDOW,
+    ).group_by(Job.docker_client_host))
+
+    cached = {
+        host for host, in DB.session.query(
+            Job.docker_client_host,
+        ).filter(
+            on_hosts,
+            Job.project_id == job.project.id,
+            Job.image_id.isnot(None),
+            Job.create_ts >= now - LOCALITY_WINDOW,
+        ).distinct()
+    }
+
+    return [
+        HostLoad(
+            host,
+            running.get(host, 0),
+            None if durations.get(host) is None else (
+                float(durations[host])
+            ),
+            host in cached,
+        )
+        for host in hosts
+    ]
+
+
+def place_job(job, host_strs):
+    """
+    Choose a Docker host for the job from the configured host strings, and
+    record it as the job's ``docker_client_host``, so that it counts towards
+    the host's load. The job must have been flushed
+
+    Returns:
+      str: Base URL of the chosen host, or None with fewer than 2 hosts
+    """
+    hosts = [host_base_url(host_str) for host_str in host_strs]
+    if len(hosts) < 2:
+        return None
+
+    host = choose_host(host_loads(job, hosts))
+    job.docker_client_host = host
+    return host
+
+
+def place_new_jobs(jobs):
+    """
+    Place new jobs on the configured Docker hosts, when job placement is
+    enabled, and agents don't claim jobs from the scheduler. Jobs must have
+    been flushed, and are placed in order, so that each counts towards the
+    load seen by the next. The caller commits before the jobs are queued
+    """
+    if not CONFIG.job_placement or CONFIG.job_claims:
+        return
+
+    for job in jobs:
+        place_job(job, CONFIG.docker_hosts)
+
+
+def declare_host_queues(channel, host_strs):
+    """
+    Declare a queue for each Docker host, bound to its routing key, so that
+    placed jobs wait for an agent for the host
+    """
+    for host_str in host_strs:
+        base_url = host_base_url(host_str)
+        channel.queue_declare(queue=host_queue_name(base_url))
+        channel.queue_bind(exchange='dockci.queue',
+                           queue=host_queue_name(base_url),
+                           routing_key='new_job.%s' % host_routing_key(
+                               base_url,
+                           ))
@@ -0,0 +1,211 @@
+"""
+Priority, and fair share scheduling of queued jobs for agents to claim
+
+Rather than consuming jobs in the order they were queued, agents claim the
+next job from ``claim_job``. Projects with the fewest active jobs go first,
+so that one busy project can't starve the others. Within a project, tags go
+before the default branch, which goes before other branches. Projects with
+``max_concurrent_jobs`` set are skipped while they're at their limit
+"""
+
+from datetime import datetime, timedelta
+
+import sqlalchemy
+
+from dockci.models.job import Job
+from dockci.models.project import Project
+from dockci.server import DB
+
+
+PRIORITY_TAG = 20
+PRIORITY_DEFAULT_BRANCH = 10
+PRIORITY_BRANCH = 0
+
+DEFAULT_BRANCH = 'master'
+
+# Seconds before a claimed job that hasn't started may be claimed again
+CLAIM_TIMEOUT = 300
+
+
+def job_priority(tag, git_branch, default_branch=None):
+    """
+    Priority for a new job; higher priority jobs are claimed first
+
+    Examples:
+
+    >>> job_priority('v1.0.0', None)
+    20
+    >>> job_priority(None, 'master')
+    10
+    >>> job_priority(None, 'master', 'develop')
+    0
+    >>> job_priority(None, 'develop', 'develop')
+    10
+    >>> job_priority(None, None)
+    0
+    """
+    if tag is not None:
+        return PRIORITY_TAG
+
+    if git_branch is not None and git_branch == (
+        default_branch or DEFAULT_BRANCH
+    ):
+        return PRIORITY_DEFAULT_BRANCH
+
+    return PRIORITY_BRANCH
+
+
+def fair_order(candidates, active):
+    """
+    Sort candidate jobs so that projects with the fewest active jobs go
+    first, then by priority, then oldest first
+
+    Args:
+      candidates (list): Tuples of job ID, project ID, priority, and create
+        time, for the best job of each project
+      active (dict): Count of active jobs for each project ID
+
+    Examples:
+
+    >>> [job_id for job_id, _, _, _ in fair_order([
+    ...     (1, 'busy', 20, 1),
+    ...     (2, 'idle', 0, 3),
+    ...     (3, 'quiet', 0, 2),
+    ...     (4, 'other', 10, 4),
+    ... ], {'busy': 3, 'quiet': 1, 'other': 1})]
+    [2, 4, 3, 1]
+    """
+    return sorted(
+        candidates,
+        key=lambda candidate: (
+            active.get(candidate[1], 0), -candidate[2], candidate[3],
+        ),
+    )
+
+
+def claimable_filter(claim_cutoff):
+    """
+    Filter for jobs that are queued, and not claimed since ``claim_cutoff``
+    """
+    return sqlalchemy.and_(
+        Job.start_ts.is_(None),
+        Job.result.is_(None),
+        Job.superseded_by_id.is_(None),
+        sqlalchemy.or_(
+            Job.claim_ts.is_(None),
+            Job.claim_ts < claim_cutoff,
+        ),
+    )
+
+
+def active_filter(claim_cutoff):
+    """
+    Filter for jobs that are running, or claimed since ``claim_cutoff``
+    """
+    return sqlalchemy.and_(
+        Job.result.is_(None),
+        Job.superseded_by_id.is_(None),
+        sqlalchemy.or_(
+            Job.start_ts.isnot(None),
+            Job.claim_ts >= claim_cutoff,
+        ),
+    )
+
+
+def active_counts(claim_cutoff, project_id=None):
+    """ Count of active jobs for each project ID """
+    query = DB.session.query(
+        Job.project_id, sqlalchemy.func.count(Job.id),
+    ).filter(active_filter(claim_cutoff))
+
+    if project_id is not None:
+        query = query.filter(Job.project_id == project_id)
+
+    return dict(query.group_by(Job.project_id))
+
+
+def project_candidates(claim_cutoff, exclude_project_ids=()):
+    """
+    The highest priority, oldest claimable job for each project
+
+    Returns:
+      list: Tuples of job ID, project ID, priority, and create time
+    """
+    rank = sqlalchemy.func.row_number().over(
+        partition_by=Job.project_id,
+        order_by=(Job.priority.desc(), Job.create_ts, Job.id),
+    ).label('rank')
+
+    query = DB.session.query(
+        Job.id, Job.project_id, Job.priority, Job.create_ts, rank,
+    ).filter(claimable_filter(claim_cutoff))
+
+    if exclude_project_ids:
+        query = query.filter(~Job.project_id.in_(exclude_project_ids))
+
+    ranked = query.subquery()
+    return [
+        tuple(row) for row in DB.session.query(
+            ranked.c.id,
+            ranked.c.project_id,
+            ranked.c.priority,
+            ranked.c.create_ts,
+        ).filter(ranked.c.rank == 1)
+    ]
+
+
+def _under_limit(project_id, limit, claim_cutoff):
+    """
+    Lock the project row until commit, so that concurrent claims don't go
+    over its limit, and check that it has room for another job
+    """
+    DB.session.query(Project.id).filter(
+        Project.id == project_id,
+    ).with_for_update().one()
+
+    return active_counts(claim_cutoff, project_id).get(project_id, 0) < limit
+
+
+def claim_job(now=None):
+    """
+    Claim the next job for an agent to run
+
+    Returns:
+      Job: The claimed job, or None if there are no jobs to run
+    """
+    if now is None:
+        now = datetime.now()
+
+    claim_cutoff = now - timedelta(seconds=CLAIM_TIMEOUT)
+
+    active = active_counts(claim_cutoff)
+    limits = dict(DB.session.query(
+        Project.id, Project.max_concurrent_jobs,
+    ).filter(Project.max_concurrent_jobs.isnot(None)))
+
+    candidates = project_candidates(claim_cutoff, [
+        project_id for project_id, limit in limits.items()
+        if active.get(project_id, 0) >= limit
+    ])
+
+    for job_id, project_id, _, _ in fair_order(candidates, active):
+        if project_id in limits and not _under_limit(
+            project_id, limits[project_id], claim_cutoff,
+        ):
+            DB.session.rollback()
+            continue
+
+        # Another agent may have claimed the job since it was selected
+        claimed = Job.query.filter(
+            Job.id == job_id,
+            claimable_filter(claim_cutoff),
+        ).update({'claim_ts': now}, synchronize_session=False)
+
+        DB.session.commit()
+        if claimed:
+            # Repo for the agent to clone is in the git group
+            return Job.query.options(
+                sqlalchemy.orm.undefer_group('git'),
+            ).get(job_id)
+
+    return None
@@ -1,6 +1,16 @@
 """ IO for handling stage output/logging """
 
 
+# Atomically bump the sequence, and set the stage/bytes for a job's log state.
+# KEYS[1] is the state hash; ARGV is stage slug, bytes, and expiry seconds
+LOG_STATE_SET_LUA = """
+local seq = redis.call('HINCRBY', KEYS[1], 'seq', 1)
+redis.call('HMSET', KEYS[1], 'stage', ARGV[1], 'bytes', ARGV[2])
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+return seq
+"""
+
+
 def redis_len_key(stage):
     """ Key for Redis value storing bytes saved """
     return 'dockci/{project_slug}/{job_slug}/{stage_slug}/bytes'.format(
@@ -16,3 +26,69 @@ def redis_lock_name(job):
         project_slug=job.project.slug,
         job_slug=job.slug,
     )
+
+
+def redis_log_state_key(job):
+    """
+    Key for Redis hash storing the current stage slug, bytes saved for that
+    stage, and a sequence number incremented on every write
+    """
+    return 'dockci/{project_slug}/{job_slug}/log_state'.format(
+        project_slug=job.project.slug,
+        job_slug=job.slug,
+    )
+
+
+def _decode(value):
+    """
+    Redis sometimes gives us bytes
+
+    Examples:
+
+    >>> _decode(b'abc')
+    'abc'
+    >>> _decode('abc')
+    'abc'
+    >>> _decode(None)
+    """
+    try:
+        return value.decode()
+    except AttributeError:
+        return value
+
+
+def set_log_state(redis_conn, job, stage_slug, bytes_saved, expire):
+    """
+    Record the new log state atomically. Log producers save a chunk, then
+    call this, then publish the chunk with the sequence number that's
+    returned. A viewer whose initial log has sequence number ``init_seq``
+    already has every chunk published with a sequence number
+    ``<= init_seq``, so it skips them
+    """
+    script = redis_conn.register_script(LOG_STATE_SET_LUA)
+    return int(script(
+        keys=[redis_log_state_key(job)],
+        args=[stage_slug, bytes_saved, expire],
+    ))
+
+
+def get_log_state(redis_conn, job):
+    """
+    Get the current log state for a job in a single atomic read, without
+    locking
+
+    Returns:
+      tuple(str, int, int): Stage slug, bytes saved for the stage, and
+      sequence number
+      None: No log state has been recorded for the job
+    """
+    stage_slug, bytes_saved, seq = (
+        _decode(value)
+        for value in redis_conn.hmget(
+            redis_log_state_key(job), 'stage', 'bytes', 'seq',
+        )
+    )
+    if stage_slug is None:
+        return None
+
+    return stage_slug, int(bytes_saved or 0), int(seq or 0)
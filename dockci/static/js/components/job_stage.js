@@ -144,6 +144,11 @@ define([
 
         this.consumeLiveContent = function() {
             this.job().bus().subscribe(this.slug(), function(message) {
+                // Chunks up to init_seq are already in the initial log
+                seq = parseInt(message.headers['seq'])
+                if (!isNaN(seq) && !util.isEmpty(this.initSeq) && seq <= this.initSeq) {
+                    return
+                }
                 if (message.headers.destination.endsWith('.content')) {
                     this.updateData(message.body)
                 } else if (message.headers.destination.endsWith('.status')) {
@@ -158,6 +163,7 @@ define([
         this.getInitLoadUrl = function(callback) {
             this.job().getLiveLoadDetail(function(live_load_detail) {
                 slug = this.slug()
+                this.initSeq = live_load_detail['init_seq']
 
                 if (slug === live_load_detail['init_stage']) {
                     return callback(live_load_detail['init_log'])
@@ -176,6 +182,7 @@ define([
         }.bind(this)
 
         this.initLogBytes = 0
+        this.initSeq = null
         this.getInitLoadUrl(function(init_load_url) {
             if (!util.isEmpty(init_load_url)) {
                 $.ajax({
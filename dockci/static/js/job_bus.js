@@ -1,4 +1,7 @@
 define(['./util'], function (util) {
+    // Messages kept for each queue until it's subscribed to
+    var MAX_BUFFERED = 1000
+
     function JobBus(job, getStompClient) {
         this.queues = {}
         this.job = util.param(job)
@@ -7,7 +10,7 @@ define(['./util'], function (util) {
             if (typeof(this.queues[queueName]) !== 'undefined') {
                 throw new Error("Queue '" + queueName + "' already defined")
             }
-            this.queues[queueName] = [null, filter, []]
+            this.queues[queueName] = [null, filter, [], 0]
         }.bind(this)
 
         this.subscribe = function(queueName, callback) {
@@ -21,6 +24,14 @@ define(['./util'], function (util) {
             }
             queue[0] = callback
 
+            if (queue[3] > 0 && queue[2].length > 0) {
+                // Let the subscriber know that the oldest messages were dropped
+                callback({
+                      'headers': {'destination': queue[2][0].headers.destination.replace(/\.[^.]*$/, '.content')}
+                    , 'body': '\n[' + queue[3] + ' live log messages skipped; reload to see the full log]\n'
+                })
+                queue[3] = 0
+            }
             if (queue[2].length > 0) {
                 message = queue[2].shift()
                 while(typeof(message) !== 'undefined') {
@@ -30,28 +41,78 @@ define(['./util'], function (util) {
             }
         }.bind(this)
 
-        this.job().getLiveQueueName(function(queueName) {
-            getStompClient(function(stompClient) {
-                stompClient.subscribe("/amq/queue/" + queueName, function(message) {
-                    $.each(this.queues, function(key, queueData) {
-                        callback = queueData[0]
-                        filter = queueData[1]
-                        buffer = queueData[2]
-
-                        if (!util.isEmpty(filter)) {
-                            if (!filter(message)) {
-                                return true
-                            }
-                        }
-                        if (util.isEmpty(callback)) {
-                            buffer.push(message)
-                            return true
-                        }
+        this.dispatch = function(message) {
+            $.each(this.queues, function(key, queueData) {
+                callback = queueData[0]
+                filter = queueData[1]
+                buffer = queueData[2]
 
-                        callback(message)
+                if (!util.isEmpty(filter)) {
+                    if (!filter(message)) {
                         return true
-                    }.bind(this))
-                }.bind(this))
+                    }
+                }
+                if (util.isEmpty(callback)) {
+                    buffer.push(message)
+                    if (buffer.length > MAX_BUFFERED) {
+                        buffer.shift()
+                        queueData[3]++
+                    }
+                    return true
+                }
+
+                callback(message)
+                return true
+            }.bind(this))
+        }.bind(this)
+
+        // Server-sent job events, from the web tier's shared queue for the
+        // job, given to subscribers in the same shape as STOMP messages.
+        // Reconnects resume after the last event ID
+        this.openLiveStream = function(url) {
+            var source = new EventSource(url)
+            var dispatchStage = function(event, kind, body) {
+                var data = JSON.parse(event.data)
+                this.dispatch({
+                      'headers': {'destination': [
+                          'dockci'
+                        , this.job().project_slug()
+                        , this.job().slug()
+                        , data['stage']
+                        , kind
+                    ].join('.')}
+                    , 'body': body(data)
+                })
+            }.bind(this)
+            source.addEventListener('log', function(event) {
+                dispatchStage(event, 'content', function(data) {
+                    return data['data']
+                })
+            })
+            source.addEventListener('skipped', function(event) {
+                dispatchStage(event, 'content', function(data) {
+                    return (
+                        '\n[' + (data['end'] - data['start']) +
+                        ' bytes of live log skipped; reload to see the full log]\n'
+                    )
+                })
+            })
+            source.addEventListener('stage', function(event) {
+                dispatchStage(event, 'status', function(data) {
+                    return JSON.stringify({'success': data['success']})
+                })
+            })
+            source.addEventListener('end', function() {
+                source.close()
+            })
+        }.bind(this)
+
+        this.job().getLiveQueueName(function(queueName) {
+            // Live stream is used instead of a queue
+            if (util.isEmpty(queueName)) { return }
+
+            getStompClient(function(stompClient) {
+                stompClient.subscribe("/amq/queue/" + queueName, this.dispatch)
             }.bind(this))
         }.bind(this))
     }
@@ -32,12 +32,14 @@ define([
 
         this.exit_code           = ko.observable()
         this.result              = ko.observable()
+        this.superseded_by_detail = ko.observable()
 
         this.state = ko.computed(function() {
             result = this.result()
             start_ts = this.start_ts()
             if (!util.isEmpty(result)) { return result }
             if (!util.isEmpty(start_ts)) { return 'running' }
+            if (!util.isEmpty(this.superseded_by_detail())) { return 'superseded' }
             return 'queued'
         }.bind(this))
 
@@ -99,6 +101,12 @@ define([
 
         this._liveLoadDetail = null
         this._liveLoadDetailCallbacks = []
+        this._setLiveLoadDetail = function(data) {
+            this._liveLoadDetail = data
+            $(this._liveLoadDetailCallbacks).each(function(idx, callback_inner) {
+                callback_inner(data)
+            })
+        }.bind(this)
         this.getLiveLoadDetail = function(callback) {
             if (this._liveLoadDetail === null) {
                 this._liveLoadDetailCallbacks.push(callback)
@@ -114,10 +122,17 @@ define([
                             , 'dataType': 'json'
                         }
                     ).done(function(data) {
-                        this._liveLoadDetail = data
-                        $(this._liveLoadDetailCallbacks).each(function(idx, callback_inner) {
-                            callback_inner(data)
-                        })
+                        if (util.isEmpty(data['live_stream'])) {
+                            this._setLiveLoadDetail(data)
+                        } else {
+                            // Stage logs are caught up by the live stream
+                            this.bus().openLiveStream(data['live_stream'])
+                            this._setLiveLoadDetail({
+                                  'init_stage': null
+                                , 'init_log': null
+                                , 'init_seq': null
+                            })
+                        }
                     }.bind(this))
                 }
             } else {
@@ -159,6 +174,7 @@ define([
 
                 , 'exit_code': null
                 , 'result': null
+                , 'superseded_by_detail': null
             }, data)
             this.slug(data['slug'])
             this.project_slug(data['project_slug'])
@@ -184,6 +200,7 @@ define([
 
             this.exit_code(data['exit_code'])
             this.result(data['result'])
+            this.superseded_by_detail(data['superseded_by_detail'])
 
             if (util.isEmpty(this.bus())) {
                 this.bus(job_bus.get(this))
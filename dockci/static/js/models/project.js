@@ -7,6 +7,8 @@ define(['jquery', 'knockout', '../util'], function ($, ko, util) {
         this.branch_pattern = ko.observable()
         this.utility        = ko.observable()
         this.public         = ko.observable()
+        this.coalesce_window = ko.observable()
+        this.max_concurrent_jobs = ko.observable()
 
         this.forcedType = ko.observable()
 
@@ -87,6 +89,8 @@ define(['jquery', 'knockout', '../util'], function ($, ko, util) {
                 'gitlab_private_token': this.gitlab_private_token() || undefined,
                 'target_registry': this.target_registry_base_name() || null,
                 'public': this.public(),
+                'coalesce_window': util.isEmpty(this.coalesce_window()) ? undefined : this.coalesce_window(),
+                'max_concurrent_jobs': this.max_concurrent_jobs() || undefined,
             }
             if(isNew) {
                 return $.extend(baseParams, {
@@ -122,6 +126,8 @@ define(['jquery', 'knockout', '../util'], function ($, ko, util) {
                 , 'display_repo': ''
                 , 'branch_pattern': ''
                 , 'public': false
+                , 'coalesce_window': null
+                , 'max_concurrent_jobs': null
                 , 'utility': false
                 , 'gitlab_base_uri': ''
                 , 'gitlab_repo_id': ''
@@ -134,6 +140,8 @@ define(['jquery', 'knockout', '../util'], function ($, ko, util) {
             this.display_repo(data['display_repo'])
             this.branch_pattern(data['branch_pattern'])
             this.public(data['public'])
+            this.coalesce_window(data['coalesce_window'])
+            this.max_concurrent_jobs(data['max_concurrent_jobs'])
             this.utility(data['utility'])
             this.gitlab_base_uri(data['gitlab_base_uri'])
             this.gitlab_repo_id(data['gitlab_repo_id'])
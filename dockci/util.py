@@ -14,7 +14,7 @@ import sys
 import datetime
 
 from base64 import b64encode
-from functools import wraps
+from functools import lru_cache, wraps
 from ipaddress import ip_address
 from urllib.parse import urlencode, urlparse, urlunparse
 
@@ -29,11 +29,27 @@ from flask_principal import Permission, RoleNeed
 from flask_restful import abort as rest_abort
 from flask_security import current_user, login_required
 from py.path import local  # pylint:disable=import-error
+from werkzeug.routing import parse_rule
+from werkzeug.routing import ValidationError as RouteValidationError
+from werkzeug.urls import url_quote
 from yaml_model import ValidationError
 
+from dockci.metrics import metrics_provider
+
 
 AUTH_TOKEN_EXPIRY = 36000  # 10 hours
 
+# GitHub hook signature headers, and their hash, strongest first
+GITHUB_SIGNATURE_HEADERS = (
+    ('X-Hub-Signature-256', 'sha256'),
+    ('X-Hub-Signature', 'sha1'),
+)
+SIGNED_CHUNK_SIZE = 64 * 1024
+
+# The same authors, and users repeat in every list, so their Gravatar URLs are
+# cached
+GRAVATAR_CACHE_SIZE = 1024
+
 
 def request_fill(model_obj, fill_atts, accept_blank=(), data=None, save=True):
     """
@@ -112,23 +128,124 @@ def bytes_human_readable(num, suffix='B'):
     return "%.1f%s%s" % (num, 'Y', suffix)
 
 
-def is_valid_github(secret):
+BYTES_UNITS = ('', 'K', 'M', 'G', 'T', 'P', 'E', 'Z', 'Y')
+BYTES_RE = re.compile(r'^\s*([0-9.]+)\s*([KMGTPEZY]?)B?\s*$', re.IGNORECASE)
+
+
+def parse_bytes(value):
     """
-    Validates a GitHub hook payload
+    Parse a human readable byte size, as given by ``bytes_human_readable``
+
+    Examples:
+
+    >>> parse_bytes('100')
+    100
+
+    >>> parse_bytes('1.5K')
+    1500
+
+    >>> parse_bytes('20GB')
+    20000000000
+
+    >>> parse_bytes('lots')
+    Traceback (most recent call last):
+        ...
+    ValueError: Invalid byte size: 'lots'
     """
-    if 'X-Hub-Signature' not in request.headers:
-        return False
+    match = BYTES_RE.match(value)
+    if match is None:
+        raise ValueError("Invalid byte size: '%s'" % value)
 
-    hash_type, signature = request.headers['X-Hub-Signature'].split('=')
-    if hash_type.lower() != 'sha1':
-        logging.warn("Unknown GitHub hash type: '%s'", hash_type)
-        return False
+    num, unit = match.groups()
+    return int(float(num) * 1000 ** BYTES_UNITS.index(unit.upper()))
 
-    computed_signature = hmac.new(secret.encode(),
-                                  request.data,
-                                  hashlib.sha1).hexdigest()
 
-    return signature == computed_signature
+def github_signature(headers):
+    """
+    Hash name, and hex digest signature of a GitHub hook payload, preferring
+    SHA-256 when GitHub sends both
+
+    Examples:
+
+    >>> github_signature({'X-Hub-Signature': 'sha1=abc',
+    ...                   'X-Hub-Signature-256': 'sha256=def'})
+    ('sha256', 'def')
+    >>> github_signature({'X-Hub-Signature': 'sha1=abc'})
+    ('sha1', 'abc')
+    >>> github_signature({'X-Hub-Signature': 'md5=abc'})
+    (None, None)
+    >>> github_signature({})
+    (None, None)
+    """
+    for header, hash_name in GITHUB_SIGNATURE_HEADERS:
+        value = headers.get(header)
+        if not value:
+            continue
+
+        hash_type, _, signature = value.partition('=')
+        if hash_type.lower() != hash_name:
+            logging.warning("Unknown GitHub hash type: '%s'", hash_type)
+            return None, None
+
+        return hash_name, signature
+
+    return None, None
+
+
+def read_signed(secret, hash_name, stream, chunk_size=SIGNED_CHUNK_SIZE):
+    """
+    Read a whole stream, hashing each chunk as it arrives, rather than
+    buffering the body, and hashing it again afterwards
+
+    Returns:
+      tuple(bytes, str): The body, and hex HMAC digest of it
+
+    Examples:
+
+    >>> from io import BytesIO
+    >>> body, digest = read_signed('secret', 'sha1', BytesIO(b'{}'), 1)
+    >>> body
+    b'{}'
+    >>> digest == hmac.new(b'secret', b'{}', hashlib.sha1).hexdigest()
+    True
+    """
+    mac = hmac.new(secret.encode(), digestmod=getattr(hashlib, hash_name))
+    chunks = []
+    for chunk in iter(lambda: stream.read(chunk_size), b''):
+        mac.update(chunk)
+        chunks.append(chunk)
+
+    return b''.join(chunks), mac.hexdigest()
+
+
+def verify_github_payload(secret, headers, stream):
+    """
+    Validates a GitHub hook payload from its request headers, and body stream
+    in a single pass, comparing signatures in constant time
+
+    Returns:
+      bytes: The body if the signature is valid, otherwise None
+    """
+    hash_name, signature = github_signature(headers)
+    if hash_name is None:
+        return None
+
+    body, digest = read_signed(secret, hash_name, stream)
+    if not hmac.compare_digest(digest.encode(), signature.encode()):
+        return None
+
+    return body
+
+
+def verify_github_request(secret):
+    """
+    Validates the GitHub hook payload in the current request. The request
+    body is consumed, so use the returned body rather than ``request.data``
+
+    Returns:
+      bytes: The body if the signature is valid, otherwise None
+    """
+    return verify_github_payload(secret, request.headers, request.stream)
 
 
 def login_or_github_required(func):
@@ -318,6 +435,35 @@ def path_contained(outer_path, inner_path):
         return common == outer_path
 
 
+ROUTING_KEY_UNSAFE_RE = re.compile(r'[^a-zA-Z0-9_-]')
+
+
+def host_base_url(host_str):
+    """
+    Docker base URL from a configured Docker host string, without options
+
+    Examples:
+
+    >>> host_base_url('tcp://10.0.0.1:2375 cert_path=/etc/docker')
+    'tcp://10.0.0.1:2375'
+    >>> host_base_url('unix:///var/run/docker.sock')
+    'unix:///var/run/docker.sock'
+    """
+    return shlex.split(host_str)[0]
+
+
+def host_routing_key(base_url):
+    """
+    Routing key word for a Docker host
+
+    Examples:
+
+    >>> host_routing_key('tcp://10.0.0.1:2375')
+    'tcp___10_0_0_1_2375'
+    """
+    return ROUTING_KEY_UNSAFE_RE.sub('_', base_url)
+
+
 def client_kwargs_from_config(host_str):
     """ Generate Docker Client kwargs from the host string """
     docker_host, *arg_strings = shlex.split(host_str)
@@ -418,6 +564,17 @@ def bin_root():
     return local(sys.prefix).join('bin')
 
 
+@lru_cache(maxsize=16)
+def _external_url_adapter(url_map, external_url, url_scheme):
+    """ ``MapAdapter`` bound for the external URL, shared between calls """
+    ext_url = urlparse(external_url)
+    return url_map.bind(
+        ext_url.netloc,
+        script_name=ext_url.path,
+        url_scheme=ext_url.scheme if url_scheme is None else url_scheme,
+    )
+
+
 def ext_url_for(endpoint, **values):
     """ Use ``external_url`` from config to build a full URL """
     from dockci.server import CONFIG
@@ -425,12 +582,11 @@ def ext_url_for(endpoint, **values):
     if not CONFIG.external_url:
         return None
 
-    ext_url = urlparse(CONFIG.external_url)
     method = values.pop('_method', None)
-    return current_app.url_map.bind(
-        ext_url.netloc,
-        script_name=ext_url.path,
-        url_scheme=values.pop('_scheme', ext_url.scheme),
+    return _external_url_adapter(
+        current_app.url_map,
+        CONFIG.external_url,
+        values.pop('_scheme', None),
     ).build(
         endpoint,
         values,
@@ -439,6 +595,75 @@ def ext_url_for(endpoint, **values):
     )
 
 
+class UrlTemplate(object):  # pylint:disable=too-few-public-methods
+    """
+    Path of a URL rule as a format string, like
+    ``/api/v1/projects/{project_slug}/jobs/{job_slug}``. Values are quoted by
+    the rule's converters, as in a werkzeug build, but without matching the
+    values against every rule for the endpoint
+    """
+    def __init__(self, rule):
+        template = []
+        self.converters = {}
+        for converter, _, variable in parse_rule(rule.rule):
+            if converter is None:
+                static = url_quote(variable, safe='/:|+')
+                template.append(static.replace('{', '{{').replace('}', '}}'))
+            else:
+                template.append('{%s}' % variable)
+                # pylint:disable=protected-access
+                self.converters[variable] = rule._converters[variable]
+
+        self.template = ''.join(template)
+
+    def build(self, values):
+        """
+        Path for the given values, or None if a value is missing, or invalid.
+        Values that aren't in the rule are ignored
+        """
+        quoted = {}
+        for variable, converter in self.converters.items():
+            value = values.get(variable)
+            if value is None:
+                return None
+
+            try:
+                quoted[variable] = converter.to_url(value)
+            except RouteValidationError:
+                return None
+
+        return self.template.format(**quoted)
+
+
+@lru_cache(maxsize=None)
+def _url_template(url_map, endpoint):
+    """ ``UrlTemplate`` for an endpoint of the URL map """
+    try:
+        rules = list(url_map.iter_rules(endpoint))
+    except KeyError:
+        return None
+
+    if len(rules) != 1 or url_map.host_matching:
+        return None
+
+    rule = rules[0]
+    if rule.defaults or rule.subdomain:
+        return None
+
+    return UrlTemplate(rule)
+
+
+def url_template(endpoint):
+    """
+    Cached ``UrlTemplate`` for an endpoint of the current app. None when the
+    endpoint has many rules, or anything else that only a full build handles
+    """
+    if current_app.url_default_functions:
+        return None
+
+    return _url_template(current_app.url_map, endpoint)
+
+
 def add_to_url_path(url, more_path):
     """ Appends ``more_path`` to ``url`` path, and normalizes the output """
     url = list(urlparse(url))
@@ -466,9 +691,11 @@ def unique_model_conflicts(klass, ignored_id=None, **fields):
     }
 
 
+@lru_cache(maxsize=GRAVATAR_CACHE_SIZE)
 def gravatar_url(email, size=None):
     """
-    Get a Gravatar URL from an email address
+    Get a Gravatar URL from an email address. URLs are cached, with stats in
+    the ``gravatar`` metrics
 
     >>> gravatar_url('ricky@spruce.sh')
     'https://s.gravatar.com/avatar/35866d5d838f7aeb9b51a29eda9878e7'
@@ -490,6 +717,25 @@ def gravatar_url(email, size=None):
     return url
 
 
+@metrics_provider('gravatar')
+def gravatar_cache_stats():
+    """
+    Hits, misses, and size of this process' Gravatar URL cache
+
+    Examples:
+
+    >>> sorted(gravatar_cache_stats())
+    ['hits', 'max_size', 'misses', 'size']
+    """
+    info = gravatar_url.cache_info()
+    return {
+        'hits': info.hits,
+        'misses': info.misses,
+        'size': info.currsize,
+        'max_size': info.maxsize,
+    }
+
+
 API_RE = re.compile(r'/api/.*')
 
 
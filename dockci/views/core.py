@@ -43,7 +43,10 @@ def config_edit_view():
         'auth_fail_max', 'auth_fail_ttl_sec',
         'oauth_authorized_redirects',
     )
-    all_fields = restart_fields + ()
+    all_fields = restart_fields + (
+        'live_log_fanout', 'webhook_deferred', 'job_claims', 'job_placement',
+        'response_compression',
+    )
     blanks = (
         'external_url', 'external_rabbit_uri',
         'github_key', 'gitlab_key', 'gitlab_base_url',
@@ -4,6 +4,7 @@ Views related to job management
 
 import json
 import logging
+import redis
 import rollbar
 
 from flask import (abort,
@@ -14,17 +15,25 @@ from flask import (abort,
                    url_for,
                    )
 from flask_security import current_user
+from redis.exceptions import RedisError
 from yaml_model import ValidationError
 
 from dockci.models.job import Job
 from dockci.models.project import Project
-from dockci.server import APP, DB
-from dockci.util import (is_valid_github,
-                         parse_branch_from_ref,
-                         parse_ref,
-                         parse_tag_from_ref,
-                         path_contained,
-                         )
+from dockci.placement import place_new_jobs
+from dockci.server import APP, CONFIG, DB, pika_conn, redis_pool
+from dockci.util import path_contained, verify_github_request
+from dockci.webhooks import (claim_delivery,
+                             delivery_id,
+                             job_fields,
+                             publish_webhook,
+                             release_delivery,
+                             send_superseded_status,
+                             SUPPORTED_EVENTS,
+                             UnknownWebhookError,
+                             webhook_event,
+                             WebhookIgnoredError,
+                             )
 
 
 @APP.route('/projects/<project_slug>/jobs/<job_slug>', methods=('GET',))
@@ -44,34 +53,80 @@ def job_view(project_slug, job_slug):
 @APP.route('/projects/<project_slug>/jobs/new', methods=('POST',))
 def job_new_view(project_slug):
     """
-    View to create a new job
+    View to create a new job. When webhooks are deferred, only the signature
+    is checked, and the event queued for ``webhook-consumer`` to create the
+    job. Redelivered webhooks are ignored
     """
-
-    has_event_header = any((
-        header in request.headers
-        for header in (
-            'X-Github-Event',
-            'X-Gitlab-Event',
-        )
-    ))
-    if not has_event_header:
+    service, event = webhook_event(request.headers)
+    if service is None:
         abort(400)
 
     project = Project.query.filter_by(slug=project_slug).first_or_404()
-    job = Job(project=project, repo_fs=project.repo_fs)
 
-    if 'X-Github-Event' in request.headers:
-        job_new_github(project, job)
-    elif 'X-Gitlab-Event' in request.headers:
-        job_new_gitlab(project, job)
+    if service == 'github':
+        body = job_new_github_verify(project)
+    elif service == 'gitlab':
+        body = job_new_gitlab_verify(project)
+
+    delivery = delivery_id(request.headers)
+    if delivery is None:
+        return job_new_handle(project, service, event, body)
+
+    with redis_pool() as redis_pool_:
+        redis_conn = redis.Redis(connection_pool=redis_pool_)
+        try:
+            claimed = claim_delivery(redis_conn, project_slug, delivery)
+        except RedisError:
+            logging.exception("Couldn't check webhook delivery %s", delivery)
+            claimed = True
+
+        if not claimed:
+            logging.info("Ignoring redelivered webhook %s", delivery)
+            return 'Already delivered', 200
+
+        try:
+            return job_new_handle(project, service, event, body)
+
+        except Exception:
+            release_delivery(redis_conn, project_slug, delivery)
+            raise
+
+
+def job_new_handle(project, service, event, body):
+    """
+    Create, or defer creating a job for a verified webhook ``body``. Queued
+    jobs for the same branch are superseded per the project's coalescing
+    window
+    """
+    if CONFIG.webhook_deferred:
+        if event not in SUPPORTED_EVENTS[service]:
+            abort(501)
+
+        with pika_conn() as conn:
+            publish_webhook(
+                conn.channel(),
+                project.slug,
+                service,
+                event,
+                body.decode(),
+            )
+
+        return '', 202
+
+    job = Job(project=project, repo_fs=project.repo_fs)
+    job_new_fill(job, service, event, body)
 
     try:
         DB.session.add(job)
+        DB.session.flush()
+        superseded = job.supersede_queued()
+        place_new_jobs([job])
         DB.session.commit()
         job.queue()
+        send_superseded_status(superseded)
 
         job_url = url_for('job_view',
-                          project_slug=project_slug,
+                          project_slug=project.slug,
                           job_slug=job.slug)
         return job_url, 201
 
@@ -87,68 +142,53 @@ def job_new_abort(job, status, message=None):
     """ Log, expunge job, and HTTP error """
     if message is not None:
         logging.warn(message)
-    DB.session.expunge(job)
+    if job is not None:
+        DB.session.expunge(job)
     abort(status)
 
 
-def job_new_gitlab(_, job):
-    """
-    Fill in the new ``job`` model from the request, which is a GitLab push
-    event
-    """
-    if not current_user.is_authenticated():
-        job_new_abort(job, 403, "No login information for GitLab hook")
+def job_new_fill(job, service, event, body):
+    """ Fill in the new ``job`` model from a webhook event ``body`` """
+    try:
+        fields = job_fields(service, event, json.loads(body.decode()))
 
-    if request.headers['X-Gitlab-Event'] in ('Push Hook', 'Tag Push Hook'):
-        push_data = request.json
+    except ValueError:
+        job_new_abort(job, 400, "Invalid webhook payload")
 
-        job.commit = push_data['after']
+    except WebhookIgnoredError:
+        job_new_abort(job, 204)
 
-        if request.headers['X-Gitlab-Event'] == 'Push Hook':
-            job.git_branch = parse_branch_from_ref(push_data['ref'])
-        elif request.headers['X-Gitlab-Event'] == 'Tag Push Hook':
-            job.tag = parse_tag_from_ref(push_data['ref'])
+    except UnknownWebhookError as ex:
+        job_new_abort(job, 501, str(ex))
 
-    else:
-        job_new_abort(
-            job,
-            501,
-            "Unknown GitLab hook '%s'" % request.headers['X-Gitlab-Event'],
-        )
+    for name, value in fields.items():
+        setattr(job, name, value)
 
 
-def job_new_github(project, job):
+def job_new_gitlab_verify(_):
     """
-    Fill in the new ``job`` model from the request, which is a GitHub push
-    event
+    Ensure that the request, which is a GitLab hook is authenticated, and
+    return the body
     """
-    if not project.github_secret:
-        job_new_abort(job, 403, "GitHub webhook secret not setup")
-
-    if not is_valid_github(project.github_secret):
-        job_new_abort(job, 403, "Invalid GitHub payload")
+    if not current_user.is_authenticated():
+        job_new_abort(None, 403, "No login information for GitLab hook")
 
-    if request.headers['X-Github-Event'] == 'push':
-        push_data = request.json
+    return request.get_data()
 
-        # GitHub pushes an empty head_commit when refs are deleted
-        if push_data['head_commit'] is None:
-            job_new_abort(job, 204)
 
-        job.commit = push_data['head_commit']['id']
+def job_new_github_verify(project):
+    """
+    Ensure that the request, which is a GitHub hook is signed with the
+    project's secret, and return the body that was read while verifying
+    """
+    if not project.github_secret:
+        job_new_abort(None, 403, "GitHub webhook secret not setup")
 
-        ref_type, ref_name = parse_ref(push_data['ref'])
-        if ref_type == 'branch':
-            job.git_branch = ref_name
-        elif ref_type == 'tag':
-            job.tag = ref_name
+    body = verify_github_request(project.github_secret)
+    if body is None:
+        job_new_abort(None, 403, "Invalid GitHub payload")
 
-    else:
-        job_new_abort(
-            job,
-            501,
-            "Unknown GitHub hook '%s'" % request.headers['X-Github-Event'],
-        )
+    return body
 
 
 def check_output(project_slug, job_slug, filename):
@@ -2,6 +2,8 @@
 Views related to project management
 """
 
+import sqlalchemy
+
 from flask import abort, redirect, render_template, request
 from flask_security import current_user
 
@@ -54,7 +56,9 @@ def project_view(slug):
     page_size = int(request.args.get('page_size', 20))
     page = int(request.args.get('page', 1))
 
-    jobs = filter_jobs_by_request(project).paginate(page, page_size)
+    jobs = filter_jobs_by_request(project).options(
+        sqlalchemy.orm.undefer_group('git'),
+    ).paginate(page, page_size)
 
     # Copied from filter_jobs_by_request :(
     try:
@@ -0,0 +1,385 @@
+"""
+Parsing of GitHub, and GitLab push webhooks into jobs, deferred ingestion
+of webhooks through a durable queue, and deduplication of redelivered
+webhooks
+"""
+
+import json
+import logging
+
+import pika
+
+from dockci.models.job import Job
+from dockci.models.project import Project
+from dockci.placement import place_new_jobs
+from dockci.scheduler import job_priority
+from dockci.server import DB
+from dockci.util import parse_branch_from_ref, parse_ref, parse_tag_from_ref
+
+
+WEBHOOK_QUEUE = 'dockci.webhook'
+
+# Header giving the event name for each service
+EVENT_HEADERS = (
+    ('X-Github-Event', 'github'),
+    ('X-Gitlab-Event', 'gitlab'),
+)
+
+# Headers giving a unique ID for each delivery, that's kept on redelivery
+DELIVERY_HEADERS = ('X-GitHub-Delivery', 'X-Gitlab-Event-UUID')
+
+# Seconds that delivery IDs are remembered for
+DELIVERY_EXPIRE = 60 * 60 * 24
+
+# Keys, all strings, of deferred webhook messages
+WEBHOOK_MESSAGE_KEYS = ('project_slug', 'service', 'event', 'payload')
+
+# Events that jobs are created for
+SUPPORTED_EVENTS = {
+    'github': ('push',),
+    'gitlab': ('Push Hook', 'Tag Push Hook'),
+}
+
+
+class WebhookIgnoredError(Exception):
+    """ The webhook event is valid, but no job should be created for it """
+    pass
+
+
+class UnknownWebhookError(Exception):
+    """ The webhook event is not supported """
+    pass
+
+
+def webhook_event(headers):
+    """
+    Service, and event name from webhook request headers
+
+    Examples:
+
+    >>> webhook_event({'X-Github-Event': 'push'})
+    ('github', 'push')
+    >>> webhook_event({'X-Gitlab-Event': 'Push Hook'})
+    ('gitlab', 'Push Hook')
+    >>> webhook_event({})
+    (None, None)
+    """
+    for header, service in EVENT_HEADERS:
+        if header in headers:
+            return service, headers[header]
+
+    return None, None
+
+
+def delivery_id(headers):
+    """
+    Unique ID of a webhook delivery from request headers
+
+    Examples:
+
+    >>> delivery_id({'X-GitHub-Delivery': 'abc'})
+    'abc'
+    >>> delivery_id({'X-Gitlab-Event-UUID': 'def'})
+    'def'
+    >>> delivery_id({'X-GitHub-Delivery': ''}) is None
+    True
+    """
+    for header in DELIVERY_HEADERS:
+        if headers.get(header):
+            return headers[header]
+
+    return None
+
+
+def redis_delivery_key(project_slug, delivery_id_):
+    """ Key for Redis value marking a webhook delivery as seen """
+    return 'dockci/{project_slug}/webhook_delivery/{delivery_id}'.format(
+        project_slug=project_slug,
+        delivery_id=delivery_id_,
+    )
+
+
+def claim_delivery(redis_conn, project_slug, delivery_id_,
+                   expire=DELIVERY_EXPIRE):
+    """
+    Record that a webhook delivery is being handled. Returns False if the
+    delivery was already seen, so that redelivered webhooks are ignored
+    """
+    return bool(redis_conn.set(
+        redis_delivery_key(project_slug, delivery_id_), 1,
+        nx=True, ex=expire,
+    ))
+
+
+def release_delivery(redis_conn, project_slug, delivery_id_):
+    """
+    Forget a webhook delivery that couldn't be handled, so that a redelivery
+    is accepted
+    """
+    redis_conn.delete(redis_delivery_key(project_slug, delivery_id_))
+
+
+def github_job_fields(event, payload):
+    """
+    Job attributes from a GitHub push event
+
+    Examples:
+
+    >>> sorted(github_job_fields('push', {
+    ...     'head_commit': {'id': 'abc'}, 'ref': 'refs/heads/master',
+    ... }).items())
+    [('commit', 'abc'), ('git_branch', 'master')]
+
+    >>> sorted(github_job_fields('push', {
+    ...     'head_commit': {'id': 'abc'}, 'ref': 'refs/tags/v1',
+    ... }).items())
+    [('commit', 'abc'), ('tag', 'v1')]
+
+    >>> github_job_fields('push', {'head_commit': None, 'ref': 'master'})
+    Traceback (most recent call last):
+      ...
+    dockci.webhooks.WebhookIgnoredError: Ref deleted
+
+    >>> github_job_fields('issues', {})
+    Traceback (most recent call last):
+      ...
+    dockci.webhooks.UnknownWebhookError: Unknown GitHub hook 'issues'
+    """
+    if event not in SUPPORTED_EVENTS['github']:
+        raise UnknownWebhookError("Unknown GitHub hook '%s'" % event)
+
+    # GitHub pushes an empty head_commit when refs are deleted
+    if payload['head_commit'] is None:
+        raise WebhookIgnoredError("Ref deleted")
+
+    fields = {'commit': payload['head_commit']['id']}
+
+    ref_type, ref_name = parse_ref(payload['ref'])
+    if ref_type == 'branch':
+        fields['git_branch'] = ref_name
+    elif ref_type == 'tag':
+        fields['tag'] = ref_name
+
+    return fields
+
+
+def gitlab_job_fields(event, payload):
+    """
+    Job attributes from a GitLab push event
+
+    Examples:
+
+    >>> sorted(gitlab_job_fields('Push Hook', {
+    ...     'after': 'abc', 'ref': 'refs/heads/master',
+    ... }).items())
+    [('commit', 'abc'), ('git_branch', 'master')]
+
+    >>> sorted(gitlab_job_fields('Tag Push Hook', {
+    ...     'after': 'abc', 'ref': 'refs/tags/v1',
+    ... }).items())
+    [('commit', 'abc'), ('tag', 'v1')]
+    """
+    if event == 'Push Hook':
+        return {
+            'commit': payload['after'],
+            'git_branch': parse_branch_from_ref(payload['ref']),
+        }
+
+    elif event == 'Tag Push Hook':
+        return {
+            'commit': payload['after'],
+            'tag': parse_tag_from_ref(payload['ref']),
+        }
+
+    raise UnknownWebhookError("Unknown GitLab hook '%s'" % event)
+
+
+JOB_FIELDS_PARSERS = {
+    'github': github_job_fields,
+    'gitlab': gitlab_job_fields,
+}
+
+
+def default_branch(payload):
+    """
+    Default branch of the repository from a GitHub, or GitLab push event, if
+    given
+
+    Examples:
+
+    >>> default_branch({'repository': {'default_branch': 'develop'}})
+    'develop'
+    >>> default_branch({'project': {'default_branch': 'develop'}})
+    'develop'
+    >>> default_branch({'repository': {}}) is None
+    True
+    """
+    for key in ('repository', 'project'):
+        try:
+            return payload[key]['default_branch']
+        except (KeyError, TypeError):
+            pass
+
+    return None
+
+
+def job_fields(service, event, payload):
+    """
+    Job attributes, including scheduling priority from a webhook event for
+    the given service
+    """
+    fields = JOB_FIELDS_PARSERS[service](event, payload)
+    fields['priority'] = job_priority(
+        fields.get('tag'), fields.get('git_branch'), default_branch(payload),
+    )
+    return fields
+
+
+def declare_webhook_queue(channel):
+    """ Declare the durable queue for deferred webhooks """
+    channel.queue_declare(queue=WEBHOOK_QUEUE, durable=True)
+
+
+def publish_webhook(channel, project_slug, service, event, payload):
+    """
+    Add the raw payload of a verified webhook to the durable queue, for jobs
+    to be created later by ``create_jobs``. The queue is declared at startup
+    (see ``declare_webhook_queue``)
+    """
+    channel.basic_publish(
+        exchange='',
+        routing_key=WEBHOOK_QUEUE,
+        body=json.dumps(dict(
+            project_slug=project_slug,
+            service=service,
+            event=event,
+            payload=payload,
+        )),
+        properties=pika.BasicProperties(delivery_mode=2),  # persistent
+    )
+
+
+def parse_webhook_message(body):
+    """
+    Deferred webhook from the body of a message added by ``publish_webhook``.
+    Raises ``ValueError`` for messages that jobs can never be created from
+
+    Examples:
+
+    >>> sorted(parse_webhook_message(
+    ...     b'{"project_slug": "a", "service": "github", "event": "push", '
+    ...     b'"payload": "{}"}'
+    ... ))
+    ['event', 'payload', 'project_slug', 'service']
+
+    >>> parse_webhook_message(b'[]')
+    Traceback (most recent call last):
+      ...
+    ValueError: Webhook message isn't an object
+
+    >>> parse_webhook_message(b'{"project_slug": "a"}')
+    Traceback (most recent call last):
+      ...
+    ValueError: Webhook message has no service
+
+    >>> parse_webhook_message(
+    ...     b'{"project_slug": "a", "service": "svn", "event": "push", '
+    ...     b'"payload": "{}"}'
+    ... )
+    Traceback (most recent call last):
+      ...
+    ValueError: Unknown webhook service 'svn'
+    """
+    webhook = json.loads(body.decode())
+    if not isinstance(webhook, dict):
+        raise ValueError("Webhook message isn't an object")
+
+    for key in WEBHOOK_MESSAGE_KEYS:
+        if not isinstance(webhook.get(key), str):
+            raise ValueError("Webhook message has no %s" % key)
+
+    if webhook['service'] not in JOB_FIELDS_PARSERS:
+        raise ValueError("Unknown webhook service '%s'" % webhook['service'])
+
+    return webhook
+
+
+def supersede_queued(jobs):
+    """
+    Supersede queued jobs for the branches of the new ``jobs``, in order of
+    creation, and send the new state of superseded jobs to external services.
+    Jobs must have been flushed
+
+    Returns:
+      set(Job): Jobs superseded, which may include some of the given ``jobs``
+    """
+    superseded = set()
+    for job in sorted(jobs, key=lambda job: job.id):
+        superseded.update(job.supersede_queued())
+
+    return superseded
+
+
+def send_superseded_status(jobs):
+    """ Send the superseded state of ``jobs`` to external services """
+    for job in jobs:
+        if not job.project.is_external:
+            continue
+
+        try:
+            job.send_external_status()
+        except Exception:  # pylint:disable=broad-except
+            logging.exception("Couldn't send state for job %s", job.slug)
+
+
+def create_jobs(webhooks):
+    """
+    Create jobs for a batch of deferred webhooks, as given to
+    ``publish_webhook``, and checked by ``parse_webhook_message``, in a
+    single commit. Webhooks that can't be turned into jobs are logged, and
+    skipped. Queued jobs for the same branch, including earlier jobs in the
+    batch, are superseded per the project's coalescing window, and the rest
+    are placed on Docker hosts
+
+    Returns:
+      tuple(list(Job), set(Job)): Jobs created, and jobs superseded
+    """
+    projects = {
+        project.slug: project
+        for project in Project.query.filter(Project.slug.in_({
+            str(webhook['project_slug']) for webhook in webhooks
+        }))
+    }
+
+    jobs = []
+    for webhook in webhooks:
+        project = projects.get(str(webhook['project_slug']))
+        if project is None:
+            logging.warning("Webhook for unknown project '%s'",
+                            webhook['project_slug'])
+            continue
+
+        try:
+            fields = job_fields(
+                webhook['service'],
+                webhook['event'],
+                json.loads(webhook['payload']),
+            )
+
+        except WebhookIgnoredError:
+            continue
+
+        except (UnknownWebhookError, KeyError, TypeError, ValueError):
+            logging.exception("Invalid webhook for project '%s'",
+                              project.slug)
+            continue
+
+        jobs.append(Job(project=project, repo_fs=project.repo_fs, **fields))
+
+    DB.session.add_all(jobs)
+    DB.session.flush()
+    superseded = supersede_queued(jobs)
+    place_new_jobs([job for job in jobs if job not in superseded])
+    DB.session.commit()
+
+    return jobs, superseded
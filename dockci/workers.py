@@ -0,0 +1,155 @@
+"""
+Gunicorn worker class, and worker pool helpers
+
+Green worker classes must monkey patch the standard library before any other
+modules are imported, so ``patch_for_argv`` is called first thing in
+``manage.py``
+"""
+
+import logging
+import re
+
+
+WORKER_CLASSES = ('sync', 'gevent', 'eventlet', 'gthread')
+GREEN_WORKER_CLASSES = ('gevent', 'eventlet')
+
+POOLS = ('all', 'api', 'stream')
+
+# Long-lived responses, that are routed to the ``stream`` pool
+STREAM_PATH_RE = re.compile(
+    r'^('
+    r'/api/v1/projects/[^/]+/jobs/[^/]+/events'
+    r'|/projects/[^/]+/jobs/[^/]+/log_init/[^/]+'
+    r')$'
+)
+
+
+def worker_class_from_argv(argv):
+    """
+    Get the worker class given to the ``run`` command in command line args
+
+    Examples:
+
+    >>> worker_class_from_argv(['manage.py', 'run', '-k', 'gevent'])
+    'gevent'
+    >>> worker_class_from_argv(['manage.py', 'run', '--worker-class=eventlet'])
+    'eventlet'
+    >>> worker_class_from_argv(['./manage.py', 'run', '--worker-class',
+    ...                         'gthread'])
+    'gthread'
+
+    >>> worker_class_from_argv(['manage.py', 'run'])
+    'sync'
+    >>> worker_class_from_argv(['manage.py', 'shell', '-k', 'gevent'])
+    'sync'
+    """
+    if 'run' not in argv[1:2]:
+        return 'sync'
+
+    for idx, arg in enumerate(argv):
+        if arg in ('-k', '--worker-class'):
+            try:
+                return argv[idx + 1]
+            except IndexError:
+                break
+
+        elif arg.startswith('--worker-class='):
+            return arg.split('=', 1)[1]
+
+    return 'sync'
+
+
+def patch_for_worker_class(worker_class):
+    """
+    Monkey patch the standard library, and psycopg2 so that DB, Redis, and
+    RabbitMQ IO is cooperative under green worker classes. Without the
+    optional ``psycogreen`` package, DB queries will block the whole worker
+    """
+    if worker_class not in GREEN_WORKER_CLASSES:
+        return
+
+    if worker_class == 'gevent':
+        from gevent import monkey
+        monkey.patch_all()
+
+    else:
+        import eventlet
+        eventlet.monkey_patch()
+
+    try:
+        psycogreen_module = __import__(
+            'psycogreen.%s' % worker_class, fromlist=['patch_psycopg'],
+        )
+    except ImportError:
+        logging.warning("psycogreen is not installed; DB queries will block "
+                        "%s workers", worker_class)
+    else:
+        psycogreen_module.patch_psycopg()
+
+
+def patch_for_argv(argv):
+    """ Monkey patch for the worker class given in command line args """
+    patch_for_worker_class(worker_class_from_argv(argv))
+
+
+def is_stream_path(path):
+    """
+    Whether a request path is for a long-lived streaming response
+
+    Examples:
+
+    >>> is_stream_path('/api/v1/projects/dockci/jobs/abc/events')
+    True
+    >>> is_stream_path('/projects/dockci/jobs/abc/log_init/docker_build')
+    True
+
+    >>> is_stream_path('/api/v1/projects/dockci/jobs/abc')
+    False
+    >>> is_stream_path('/api/v1/projects/dockci/jobs/abc/stream')
+    False
+    """
+    return STREAM_PATH_RE.match(path) is not None
+
+
+class PoolFilter(object):
+    """
+    WSGI middleware for a worker pool that serves only ``api``, or only
+    ``stream`` requests. Requests for the other pool get a 404, so that a
+    misconfigured proxy is noticed, rather than streams tying up API workers
+
+    Examples:
+
+    >>> def app(environ, start_response):
+    ...     start_response('200 OK', [])
+    ...     return [b'ok']
+
+    >>> def start_response(status, headers):
+    ...     print(status)
+
+    >>> stream_app = PoolFilter(app, 'stream')
+    >>> stream_app({'PATH_INFO': '/api/v1/projects/p/jobs/j/events'},
+    ...            start_response)
+    200 OK
+    [b'ok']
+    >>> stream_app({'PATH_INFO': '/api/v1/projects/p'}, start_response)
+    404 NOT FOUND
+    [b'Not served by the stream worker pool']
+    """
+    def __init__(self, app, pool):
+        if pool not in POOLS:
+            raise ValueError("Unknown worker pool '%s'" % pool)
+
+        self.app = app
+        self.pool = pool
+
+    def __call__(self, environ, start_response):
+        if self.pool != 'all':
+            is_stream = is_stream_path(environ.get('PATH_INFO', ''))
+            if is_stream != (self.pool == 'stream'):
+                start_response('404 NOT FOUND',
+                               [('Content-Type', 'text/plain')])
+                return [
+                    ('Not served by the %s worker pool' % self.pool).encode()
+                ]
+
+        return self.app(environ, start_response)
@@ -1,5 +1,12 @@
 #!/usr/bin/env python
-import dockci.commands
+import sys
+
+from dockci.workers import patch_for_argv
+
+# Must be before anything else is imported
+patch_for_argv(sys.argv)
+
+import dockci.commands  # noqa
 
 from dockci.server import APP, app_init, MANAGER
 
@@ -0,0 +1,79 @@
+import re
+
+from datetime import datetime
+
+import pytest
+
+from flask_restful import fields, marshal
+
+from dockci.api.fields import GravatarUrl, RegexField, RewriteUrl
+from dockci.api.marshal_compiler import compile_marshaler
+from dockci.server import APP
+
+
+class Obj(object):  # pylint:disable=too-few-public-methods
+    """ Object with the given attributes """
+    def __init__(self, **attrs):
+        self.__dict__.update(attrs)
+
+
+FIELDS = {
+    'detail': RewriteUrl('job_detail', rewrites=dict(
+        project_slug='project.slug',
+        job_slug='slug',
+    )),
+    'slug': fields.String(),
+    'state': fields.String(default='queued'),
+    'exit_code': fields.Integer(default=None),
+    'create_ts': fields.DateTime('iso8601'),
+    'public': fields.Boolean(),
+    'avatar': GravatarUrl(attr_name='email'),
+    'branch_pattern': RegexField(),
+    'tags': fields.List(fields.String),
+    'stages': fields.List(fields.Nested({'slug': fields.String()})),
+    'parent': fields.Nested({'slug': fields.String()}, allow_null=True),
+    'project_slug': fields.String(attribute='project.slug'),
+    'upper_slug': fields.String(attribute=lambda obj: obj.slug.upper()),
+}
+ROOT_FIELDS = {
+    'items': fields.List(fields.Nested(FIELDS)),
+    'meta': fields.Nested({'total': fields.Integer(default=None)}),
+}
+
+
+def make_obj(idx):
+    """ Object with values for ``FIELDS``, some of them None """
+    return Obj(
+        project=Obj(slug='project'),
+        slug='job%d' % idx,
+        state=None if idx % 2 else 'running',
+        exit_code=idx or None,
+        create_ts=datetime(2016, 1, idx + 1),
+        public=idx % 2,
+        email=None if idx == 2 else 'user%d@example.com' % idx,
+        branch_pattern=re.compile('master|v.*') if idx else None,
+        tags=['latest', 'v%d' % idx],
+        stages=[Obj(slug='git_info'), Obj(slug='docker_build')],
+        parent=Obj(slug='job0') if idx else None,
+    )
+
+
+class TestCompileMarshaler(object):
+    """ Ensure compiled marshalers match ``marshal`` """
+    @pytest.mark.parametrize('data', [
+        make_obj(1),
+        [make_obj(idx) for idx in range(4)],
+        {'items': [make_obj(idx) for idx in range(4)], 'meta': {'total': 4}},
+        {'items': None, 'meta': None},
+    ])
+    def test_matches_marshal(self, data):
+        """ Objects, lists, and dicts serialize the same """
+        fields_ = FIELDS if isinstance(data, (Obj, list)) else ROOT_FIELDS
+        with APP.test_request_context():
+            assert compile_marshaler(fields_)(data) == marshal(data, fields_)
+
+    def test_source(self):
+        """ Generated source is kept for debugging """
+        serialize = compile_marshaler({'slug': fields.String()}, 'jobs')
+        assert serialize.__name__.startswith('jobs')
+        assert 'def %s(obj):' % serialize.__name__ in serialize.source
@@ -0,0 +1,29 @@
+import json
+
+from datetime import datetime
+
+import pytest
+
+from dockci.api.representations import dumps, ndjson_lines
+
+
+class TestNdjsonLines(object):
+    """ Test the ``ndjson_lines`` function """
+    @pytest.mark.parametrize('data,expected', [
+        ({'items': [{'slug': 'a'}, {'slug': 'b'}], 'meta': {'total': 2}},
+         [{'slug': 'a'}, {'slug': 'b'}]),
+        ([{'slug': 'a'}], [{'slug': 'a'}]),
+        ({'items': []}, []),
+        ({'slug': 'a'}, [{'slug': 'a'}]),
+    ])
+    def test_items(self, data, expected):
+        """ Each item is a line of JSON """
+        lines = list(ndjson_lines(data))
+        assert all(line.endswith(b'\n') for line in lines)
+        assert [json.loads(line.decode()) for line in lines] == expected
+
+    def test_datetime(self):
+        """ Date/times are formatted like the API fields """
+        assert json.loads(dumps({
+            'create_ts': datetime(2016, 2, 3, 4, 5, 6, 7),
+        }).decode()) == {'create_ts': '2016-02-03T04:05:06.000007'}
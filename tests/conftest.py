@@ -1,4 +1,5 @@
 import random
+import re
 import subprocess
 
 from contextlib import contextmanager
@@ -6,6 +7,7 @@ from urllib.parse import urlparse, urlunparse
 
 import alembic
 import pytest
+import sqlalchemy
 
 from flask_migrate import migrate
 
@@ -67,6 +69,36 @@ def db(base_db_conn):
         DB.session.rollback()
 
 
+@pytest.fixture
+def columns_read(db):
+    """
+    Context manager collecting names of the columns of a table that are
+    selected by queries in its block. Columns only used in conditions aren't
+    included
+    """
+    @contextmanager
+    def collect(table_name):
+        """ Yield a set that's updated with selected column names """
+        column_re = re.compile(r'\b%s\.(\w+) AS ' % re.escape(table_name))
+        columns = set()
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            """ Add columns from the SQL statement """
+            columns.update(column_re.findall(statement))
+
+        sqlalchemy.event.listen(
+            DB.engine, 'before_cursor_execute', before_cursor_execute,
+        )
+        try:
+            yield columns
+        finally:
+            sqlalchemy.event.remove(
+                DB.engine, 'before_cursor_execute', before_cursor_execute,
+            )
+
+    return collect
+
+
 @contextmanager
 def db_fixture_helper(model, delete=False):
     """ Common DB fixture logic """
@@ -141,3 +141,227 @@ class TestStageDetail(object):
         response = client.get(stage_url)
         response_data = json.loads(response.data.decode())
         assert response_data.pop('success') == False
+
+
+@pytest.mark.usefixtures('db')
+class TestColumnsRead(object):
+    """ Ensure job endpoints only read the columns they need """
+    def test_list(self, client, job, columns_read):
+        """ Lists don't read deferred column groups """
+        list_url = '/api/v1/projects/%s/jobs' % job.project.slug
+        with columns_read('job') as columns:
+            response = client.get(list_url)
+
+        assert response.status_code == 200
+        assert 'git_author_email' in columns
+        assert columns.isdisjoint((
+            'repo_fs', 'git_author_name',
+            'git_committer_name', 'git_committer_email',
+            'image_id', 'container_id', 'docker_client_host',
+            'git_changes',
+        ))
+
+    def test_detail(self, client, job, columns_read):
+        """ Detail reads the git, and docker groups, but not changes """
+        job_url = job_url_for(job)
+        with columns_read('job') as columns:
+            response = client.get(job_url)
+
+        assert response.status_code == 200
+        assert columns.issuperset((
+            'repo_fs', 'git_author_name', 'git_committer_email',
+            'image_id', 'container_id', 'docker_client_host',
+        ))
+        assert 'git_changes' not in columns
+
+
+@pytest.mark.usefixtures('db')
+class TestJobExport(object):
+    """ Test the ``JobExport`` resource """
+    def export(self, client, project, **params):
+        """ Parsed lines of an export """
+        response = client.get(
+            '/api/v1/projects/%s/jobs/export' % project.slug,
+            query_string=params,
+        )
+        assert response.status_code == 200
+        assert response.mimetype == 'application/x-ndjson'
+        return [
+            json.loads(line)
+            for line in response.data.decode().splitlines()
+        ]
+
+    def test_resume(self, client, project):
+        """ Jobs are oldest first, and resume after the cursor given """
+        from dockci.models.job import Job
+        from dockci.server import DB
+
+        jobs = [
+            Job(project=project, repo_fs=project.repo_fs, commit='test')
+            for _ in range(3)
+        ]
+        DB.session.add_all(jobs)
+        DB.session.commit()
+
+        lines = self.export(client, project)
+        assert [line['slug'] for line in lines] == [job.slug for job in jobs]
+        assert lines[0]['project_slug'] == project.slug
+
+        lines = self.export(client, project, after=lines[0]['cursor'])
+        assert [line['slug'] for line in lines] == [
+            job.slug for job in jobs[1:]
+        ]
+
+    def test_bad_cursor(self, client, project):
+        """ Invalid cursors are a bad request """
+        response = client.get(
+            '/api/v1/projects/%s/jobs/export' % project.slug,
+            query_string={'after': 'nope'},
+        )
+        assert response.status_code == 400
+
+
+@pytest.mark.usefixtures('db')
+class TestJobLookup(object):
+    """ Test the ``JobLookup`` resource """
+    def lookup(self, client, **params):
+        """ Response to a lookup request """
+        return client.get('/api/v1/jobs/lookup', query_string=params)
+
+    def test_job_ref(self, client, job):
+        """ Jobs looked up by reference match their details """
+        response = self.lookup(
+            client, job='%s/%s' % (job.project.slug, job.slug),
+        )
+        assert response.status_code == 200
+
+        detail = json.loads(client.get(job_url_for(job)).data.decode())
+        assert json.loads(response.data.decode()) == {'items': [detail]}
+
+    def test_commit(self, client, job):
+        """ Jobs are looked up by commit """
+        response = self.lookup(
+            client, commit=job.commit, project=job.project.slug,
+        )
+        assert response.status_code == 200
+
+        response_data = json.loads(response.data.decode())
+        assert [item['slug'] for item in response_data['items']] == [
+            job.slug,
+        ]
+
+    def test_not_public(self, client, job):
+        """ Jobs in projects that aren't public are left out """
+        from dockci.server import DB
+        job.project.public = False
+        DB.session.commit()
+
+        response = self.lookup(
+            client, job='%s/%s' % (job.project.slug, job.slug),
+        )
+        assert json.loads(response.data.decode()) == {'items': []}
+
+    @pytest.mark.parametrize('params', [
+        {'job': 'nope'},
+        {'job': 'project/zz'},
+        {'commit': ['abc%d' % idx for idx in range(101)]},
+    ])
+    def test_bad_request(self, client, params):
+        """ Invalid references, and too many references are refused """
+        assert self.lookup(client, **params).status_code == 400
+
+
+@pytest.mark.usefixtures('db')
+class TestJobETags(object):
+    """ Test ETags, and conditional requests on ``JobDetail`` """
+    def test_not_modified(self, client, job):
+        """ Matching If-None-Match gets a 304, even if weak """
+        job_url = job_url_for(job)
+        etag = client.get(job_url).headers['ETag']
+
+        for if_none_match in (etag, 'W/' + etag):
+            response = client.get(
+                job_url, headers={'If-None-Match': if_none_match},
+            )
+            assert response.status_code == 304
+            assert response.headers['ETag'] == etag
+
+    def test_stage_added(self, client, job, stage):
+        """ ETags change with the job's stages """
+        job_url = job_url_for(job)
+        etag = client.get(job_url).headers['ETag']
+
+        from dockci.models.job import JobStageTmp
+        from dockci.server import DB
+        DB.session.add(JobStageTmp(job=job, slug='other'))
+        DB.session.commit()
+
+        response = client.get(job_url, headers={'If-None-Match': etag})
+        assert response.status_code == 200
+        assert response.headers['ETag'] != etag
+
+    def test_if_match(self, client, job, agent_token):
+        """ Updates with an old ETag are refused """
+        job_url = job_url_for(job)
+        etag = client.get(job_url).headers['ETag']
+
+        response = client.patch(
+            job_url,
+            headers={'x_dockci_api_key': agent_token, 'If-Match': etag},
+            data={'tag': 'first'},
+        )
+        assert response.status_code == 200
+        assert response.headers['ETag'] != etag
+
+        response = client.patch(
+            job_url,
+            headers={'x_dockci_api_key': agent_token, 'If-Match': etag},
+            data={'tag': 'second'},
+        )
+        assert response.status_code == 412
+
+        response_data = json.loads(client.get(job_url).data.decode())
+        assert response_data['tag'] == 'first'
+
+    def test_if_match_weak(self, client, job, agent_token):
+        """ Weak ETags never match for updates """
+        job_url = job_url_for(job)
+        etag = client.get(job_url).headers['ETag']
+
+        response = client.patch(
+            job_url,
+            headers={
+                'x_dockci_api_key': agent_token,
+                'If-Match': 'W/%s' % etag,
+            },
+            data={'tag': 'first'},
+        )
+        assert response.status_code == 412
+
+    def test_if_match_compressed(self, client, job, agent_token):
+        """ ETags of compressed responses match for updates """
+        from werkzeug.test import Client
+        from werkzeug.wrappers import Response
+        from dockci.compression import CompressMiddleware
+        from dockci.server import APP
+
+        compressed_client = Client(CompressMiddleware(APP, threshold=0),
+                                   Response)
+        job_url = job_url_for(job)
+        response = compressed_client.get(
+            job_url, headers={'Accept-Encoding': 'gzip'},
+        )
+        assert response.headers['Content-Encoding'] == 'gzip'
+        etag = response.headers['ETag']
+        assert not etag.startswith('W/')
+
+        response = client.get(job_url, headers={'If-None-Match': etag})
+        assert response.status_code == 304
+        assert response.headers['ETag'] == etag
+
+        response = client.patch(
+            job_url,
+            headers={'x_dockci_api_key': agent_token, 'If-Match': etag},
+            data={'tag': 'first'},
+        )
+        assert response.status_code == 200
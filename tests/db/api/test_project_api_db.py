@@ -0,0 +1,23 @@
+""" Test ``dockci.api.project`` against the DB """
+import pytest
+
+
+@pytest.mark.usefixtures('db')
+class TestProjectETags(object):
+    """ Test ETags, and conditional requests on ``ProjectDetail`` """
+    def test_not_modified(self, client, project):
+        """ Matching If-None-Match gets a 304 until the project changes """
+        from dockci.server import DB
+
+        project_url = '/api/v1/projects/%s' % project.slug
+        etag = client.get(project_url).headers['ETag']
+
+        response = client.get(project_url, headers={'If-None-Match': etag})
+        assert response.status_code == 304
+
+        project.name = 'renamed'
+        DB.session.commit()
+
+        response = client.get(project_url, headers={'If-None-Match': etag})
+        assert response.status_code == 200
+        assert response.headers['ETag'] != etag
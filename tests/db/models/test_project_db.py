@@ -1,5 +1,6 @@
 import pytest
 
+from dockci.models.db_types import compile_regex
 from dockci.models.job import Job, JobStageTmp
 from dockci.models.project import Project
 from dockci.server import DB
@@ -129,3 +130,31 @@ class TestProjectsSummary(object):
             broken=exp_b,
             incomplete=exp_i,
         )
+
+
+class TestMatchingBranch(object):
+    """ Ensure ``Project.matching_branch`` behaves as expected """
+    @pytest.mark.parametrize('branch,p_filters,exp_slugs', [
+        ('dev-thing', None, ['p1', 'p2', 'u']),
+        ('master', None, ['p3']),
+        ('feature', None, []),
+        ('dev-thing', {'utility': False}, ['p1', 'p2']),
+    ])
+    def test_it(self, db, branch, p_filters, exp_slugs):
+        """ Commit projects, assert matching projects are returned """
+        for project in (
+            create_project('p1', branch_pattern=compile_regex('dev-.+')),
+            create_project('p2', branch_pattern=compile_regex('dev-.+')),
+            create_project('p3', branch_pattern=compile_regex('master')),
+            create_project('p4'),
+            create_project('u', utility=True,
+                           branch_pattern=compile_regex('dev')),
+        ):
+            DB.session.add(project)
+
+        DB.session.commit()
+
+        assert sorted(
+            project.slug
+            for project in Project.matching_branch(branch, p_filters)
+        ) == exp_slugs
@@ -0,0 +1,85 @@
+""" Test placing jobs on Docker hosts """
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+import pytest
+
+from dockci.models.job import Job
+from dockci.placement import (host_loads,
+                              HostLoad,
+                              place_job,
+                              place_new_jobs,
+                              )
+from dockci.server import DB
+
+
+HOST_A = 'tcp://a:2375'
+HOST_B = 'tcp://b:2375'
+
+
+@pytest.yield_fixture
+def host_jobs(project):
+    """ A running job on host A, and a recent complete image on host B """
+    now = datetime.now()
+    jobs = [
+        Job(project=project, repo_fs=project.repo_fs, commit='abc001',
+            docker_client_host=HOST_A, start_ts=now),
+        Job(project=project, repo_fs=project.repo_fs, commit='abc002',
+            docker_client_host=HOST_B, image_id='def002', result='success',
+            start_ts=now - timedelta(seconds=90), complete_ts=now),
+    ]
+    DB.session.add_all(jobs)
+    DB.session.commit()
+    try:
+        yield jobs
+    finally:
+        for job in jobs:
+            DB.session.delete(job)
+        DB.session.commit()
+
+
+class TestPlaceJob(object):
+    """ Ensure ``place_job`` behaves as expected """
+    @pytest.mark.usefixtures('db', 'host_jobs')
+    def test_host_loads(self, job):
+        """ Running jobs, durations, and cached images are counted """
+        assert host_loads(job, [HOST_A, HOST_B]) == [
+            HostLoad(HOST_A, 1, None, False),
+            HostLoad(HOST_B, 0, 90.0, True),
+        ]
+
+    @pytest.mark.usefixtures('db', 'host_jobs')
+    def test_place(self, job):
+        """ Job is placed on the least loaded host, and recorded """
+        assert place_job(job, [HOST_A, '%s verify=no' % HOST_B]) == HOST_B
+        assert job.docker_client_host == HOST_B
+
+    @pytest.mark.usefixtures('db')
+    def test_single_host(self, job):
+        """ Jobs aren't placed with only one host """
+        assert place_job(job, [HOST_A]) is None
+        assert job.docker_client_host is None
+
+    @pytest.mark.parametrize('job_placement,job_claims,exp_host', [
+        (True, False, HOST_B),
+        (False, False, None),
+        (True, True, None),
+    ])
+    @pytest.mark.usefixtures('db', 'host_jobs')
+    def test_place_new_jobs(self,
+                            mocker,
+                            job,
+                            job_placement,
+                            job_claims,
+                            exp_host,
+                            ):
+        """ New jobs are only placed when placement is enabled """
+        mocker.patch(
+            'dockci.placement.CONFIG',
+            namedtuple('Config', ['job_placement', 'job_claims',
+                                  'docker_hosts'])(
+                job_placement, job_claims, [HOST_A, HOST_B],
+            ),
+        )
+        place_new_jobs([job])
+        assert job.docker_client_host == exp_host
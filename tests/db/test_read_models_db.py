@@ -0,0 +1,37 @@
+""" Test list read models against the DB """
+import pytest
+
+from flask_restful import marshal
+
+from dockci.api import job as job_api
+from dockci.api import project as project_api
+from dockci.models.job import Job
+from dockci.models.project import Project
+from dockci.server import APP
+
+
+@pytest.mark.usefixtures('db')
+class TestReadModels(object):
+    """ Ensure read model records marshal the same as ORM objects """
+    def test_jobs(self, job):
+        """ Job list records match, including computed state, and slug """
+        query = job.project.jobs.order_by(Job.id)
+        with APP.test_request_context():
+            assert marshal(
+                job_api.LIST_READ_MODEL.records(query, project=job.project),
+                job_api.LIST_FIELDS,
+            ) == marshal(query.all(), job_api.LIST_FIELDS)
+
+    def test_projects(self, job):
+        """ Project list records match, including computed status """
+        query = Project.query.filter_by(id=job.project.id)
+        with APP.test_request_context():
+            assert marshal(
+                project_api.LIST_READ_MODEL.records(query),
+                project_api.LIST_FIELDS,
+            ) == marshal(query.all(), project_api.LIST_FIELDS)
+
+    def test_missing_constant(self, job):
+        """ Constants must be given """
+        with pytest.raises(ValueError):
+            job_api.LIST_READ_MODEL.records(job.project.jobs)
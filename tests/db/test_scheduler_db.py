@@ -0,0 +1,83 @@
+""" Test scheduling jobs for agents to claim """
+import pytest
+
+from dockci.models.job import Job
+from dockci.models.project import Project
+from dockci.scheduler import claim_job, job_priority
+from dockci.server import DB
+
+
+@pytest.yield_fixture
+def other_project(db, randid):
+    """ Second project in the DB """
+    project = Project(
+        slug='other%s' % randid,
+        name='other%s' % randid,
+        repo='test',
+        utility=False,
+    )
+    DB.session.add(project)
+    DB.session.commit()
+    try:
+        yield project
+    finally:
+        DB.session.delete(project)
+        DB.session.commit()
+
+
+def add_jobs(project, *refs):
+    """ Queued jobs for a project, given as (tag, branch) tuples """
+    jobs = [
+        Job(project=project,
+            repo_fs=project.repo_fs,
+            commit='abc%03d' % idx,
+            tag=tag,
+            git_branch=branch,
+            priority=job_priority(tag, branch))
+        for idx, (tag, branch) in enumerate(refs)
+    ]
+    DB.session.add_all(jobs)
+    DB.session.commit()
+    return jobs
+
+
+class TestClaimJob(object):
+    """ Ensure ``claim_job`` behaves as expected """
+    @pytest.mark.usefixtures('db')
+    def test_fair_share(self, project, other_project):
+        """ Projects take turns, and tags, then default branch go first """
+        jobs = add_jobs(
+            project,
+            (None, 'feature'),
+            (None, 'master'),
+            ('v1', None),
+        ) + add_jobs(other_project, (None, 'feature'))
+
+        try:
+            assert [claim_job() for _ in range(5)] == [
+                jobs[2], jobs[3], jobs[1], jobs[0], None,
+            ]
+
+        finally:
+            for job in jobs:
+                DB.session.delete(job)
+            DB.session.commit()
+
+    @pytest.mark.usefixtures('db')
+    def test_max_concurrent(self, project, other_project):
+        """ Projects at their limit are skipped """
+        project.max_concurrent_jobs = 1
+        jobs = add_jobs(
+            project, (None, 'master'), (None, 'master'),
+        ) + add_jobs(other_project, (None, 'feature'))
+
+        try:
+            assert [claim_job() for _ in range(3)] == [
+                jobs[0], jobs[2], None,
+            ]
+
+        finally:
+            for job in jobs:
+                DB.session.delete(job)
+            project.max_concurrent_jobs = None
+            DB.session.commit()
@@ -0,0 +1,76 @@
+""" Test deferred webhook job creation """
+import json
+
+import pytest
+
+from dockci.models.job import Job
+from dockci.server import DB
+from dockci.webhooks import create_jobs
+
+
+def github_push(project, ref, commit='abc123'):
+    """ Deferred GitHub push webhook for a project """
+    return dict(
+        project_slug=str(project.slug),
+        service='github',
+        event='push',
+        payload=json.dumps({'ref': ref, 'head_commit': {'id': commit}}),
+    )
+
+
+class TestCreateJobs(object):
+    """ Ensure ``create_jobs`` behaves as expected """
+    @pytest.mark.usefixtures('db')
+    def test_batch(self, project):
+        """ Jobs are created for valid webhooks, others are skipped """
+        jobs, superseded = create_jobs([
+            github_push(project, 'refs/heads/master'),
+            github_push(project, 'refs/tags/v1'),
+            dict(github_push(project, 'refs/heads/master'),
+                 project_slug='not-a-project'),
+            dict(github_push(project, 'refs/heads/master'), payload='{'),
+            dict(github_push(project, 'refs/heads/master'), event='issues'),
+        ])
+
+        try:
+            assert [(job.git_branch, job.tag) for job in jobs] == [
+                ('master', None),
+                (None, 'v1'),
+            ]
+            assert Job.query.filter_by(project=project).count() == 2
+            assert superseded == set()
+
+        finally:
+            for job in jobs:
+                DB.session.delete(job)
+            DB.session.commit()
+
+    @pytest.mark.usefixtures('db')
+    def test_coalesce(self, project):
+        """ Queued jobs for a branch are superseded within the window """
+        project.coalesce_window = 60
+        started = Job(project=project, repo_fs=project.repo_fs,
+                      commit='abc000', git_branch='master')
+        DB.session.add(started)
+        DB.session.commit()
+        started.start_ts = started.create_ts
+
+        jobs, superseded = create_jobs([
+            github_push(project, 'refs/heads/master', 'abc001'),
+            github_push(project, 'refs/heads/other', 'abc002'),
+            github_push(project, 'refs/tags/v1', 'abc003'),
+            github_push(project, 'refs/heads/master', 'abc004'),
+        ])
+        jobs.append(started)
+
+        try:
+            assert superseded == {jobs[0]}
+            assert jobs[0].state == 'superseded'
+            assert jobs[0].superseded_by == jobs[3]
+            assert [job.state for job in jobs[1:]] == ['queued'] * 4
+
+        finally:
+            for job in jobs:
+                DB.session.delete(job)
+            project.coalesce_window = None
+            DB.session.commit()
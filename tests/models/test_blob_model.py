@@ -1,7 +1,12 @@
+import random
+
 import py.path
 import pytest
 
-from dockci.models.blob import FilesystemBlob
+from redis.exceptions import RedisError
+
+from dockci.models import blob as blob_module
+from dockci.models.blob import BlobStats, FilesystemBlob, gc_blobs
 
 
 class TestFiresystemBlob(object):
@@ -43,3 +48,268 @@ class TestFiresystemBlob(object):
 
         with pytest.raises(AssertionError):
             blob.add_data('..')
+
+    def test_write_extract_pack(self, tmpdir):
+        """ Test that packed blobs are a single file, and extract all files """
+        store_path = tmpdir.join('store').ensure_dir()
+        root_path = tmpdir.join('root').ensure_dir()
+        blob = FilesystemBlob(store_path, root_path, 'abcdefghi',
+                              blob_format='pack')
+
+        root_path.join('file_a').write('content a')
+        root_path.join('dir_a').ensure_dir().join('file_b').write('content b')
+        root_path.join('file_a').chmod(0o755)
+
+        blob.add_data('file_a')
+        blob.add_data('dir_a')
+
+        blob.write()
+
+        assert blob.path.check(file=True)
+        assert blob.is_packed
+
+        out_path = tmpdir.join('out').ensure_dir()
+        FilesystemBlob(store_path, out_path, 'abcdefghi').extract()
+
+        assert out_path.join('file_a').read() == 'content a'
+        assert out_path.join('dir_a', 'file_b').read() == 'content b'
+        assert oct(out_path.join('file_a').stat().mode)[-3:] == '755'
+
+    @pytest.mark.parametrize('blob_format', ['tree', 'pack'])
+    def test_extract_partial(self, tmpdir, blob_format):
+        """ Test that ``FilesystemBlob.extract`` extracts only some paths """
+        store_path = tmpdir.join('store').ensure_dir()
+        root_path = tmpdir.join('root').ensure_dir()
+        blob = FilesystemBlob(store_path, root_path, 'abcdefghi',
+                              blob_format=blob_format)
+
+        root_path.join('file_a').write('content a')
+        root_path.join('dir_a').ensure_dir().join('file_b').write('content b')
+        root_path.join('dir_a').join('file_c').write('content c')
+
+        blob.add_data('file_a')
+        blob.add_data('dir_a/file_b')
+        blob.add_data('dir_a/file_c')
+
+        blob.write()
+
+        out_path = tmpdir.join('out').ensure_dir()
+        FilesystemBlob(store_path, out_path, 'abcdefghi').extract(
+            ['dir_a/file_c'],
+        )
+
+        assert not out_path.join('file_a').check()
+        assert not out_path.join('dir_a', 'file_b').check()
+        assert out_path.join('dir_a', 'file_c').read() == 'content c'
+
+    def test_unknown_format(self):
+        with pytest.raises(ValueError):
+            FilesystemBlob(py.path.local(), py.path.local(), 'abcdefghi',
+                           blob_format='nope')
+
+
+def write_blob(store_path, etag, content, mtime):
+    """ Write a tree blob with a single file, and set its access time """
+    blob = FilesystemBlob(store_path, None, etag)
+    blob.path.ensure_dir().join('file_a').write(content)
+    blob.path.setmtime(mtime)
+    return blob
+
+
+class TestGcBlobs(object):
+    """ Test the ``gc_blobs`` function """
+    def test_lru(self, tmpdir):
+        """ Test that least recently used blobs are removed first """
+        blob_old = write_blob(tmpdir, 'aaaaaaaaa', 'a' * 10, 1000)
+        blob_mid = write_blob(tmpdir, 'bbbbbbbbb', 'b' * 10, 2000)
+        blob_new = write_blob(tmpdir, 'ccccccccc', 'c' * 10, 3000)
+
+        removed, before, after = gc_blobs(tmpdir, 15)
+
+        assert [blob.etag for blob, _ in removed] == ['aaaaaaaaa', 'bbbbbbbbb']
+        assert (before, after) == (30, 10)
+        assert not blob_old.exists
+        assert not blob_mid.exists
+        assert blob_new.exists
+        assert not tmpdir.join('aa').check()
+
+    def test_dry_run(self, tmpdir):
+        """ Test that dry run doesn't remove anything """
+        blob_old = write_blob(tmpdir, 'aaaaaaaaa', 'a' * 10, 1000)
+        blob_new = write_blob(tmpdir, 'bbbbbbbbb', 'b' * 10, 2000)
+
+        removed, before, after = gc_blobs(tmpdir, 15, dry_run=True)
+
+        assert [blob.etag for blob, _ in removed] == ['aaaaaaaaa']
+        assert (before, after) == (20, 10)
+        assert blob_old.exists
+        assert blob_new.exists
+
+    def test_locked(self, tmpdir):
+        """ Test that blobs in use are skipped """
+        blob_old = write_blob(tmpdir, 'aaaaaaaaa', 'a' * 10, 1000)
+        blob_new = write_blob(tmpdir, 'bbbbbbbbb', 'b' * 10, 2000)
+
+        with blob_old.lock():
+            removed, _, _ = gc_blobs(tmpdir, 5)
+
+        assert [blob.etag for blob, _ in removed] == ['bbbbbbbbb']
+        assert blob_old.exists
+        assert not blob_new.exists
+
+    def test_extract_touches(self, tmpdir):
+        """ Test that extracting a blob updates its access time """
+        blob = write_blob(tmpdir.join('store'), 'aaaaaaaaa', 'a', 1000)
+        blob.root_path = tmpdir.join('root').ensure_dir()
+        blob.extract()
+
+        assert blob.last_access > 1000
+
+
+def random_bytes(seed, length):
+    """ Stable random bytes for chunking tests """
+    rand = random.Random(seed)
+    return bytes(rand.getrandbits(8) for _ in range(length))
+
+
+class TestChunkedBlob(object):
+    """ Test ``FilesystemBlob`` with the chunked format """
+    def test_write_extract(self, tmpdir):
+        """ Test that chunked blobs extract to the original files """
+        store_path = tmpdir.join('store').ensure_dir()
+        root_path = tmpdir.join('root').ensure_dir()
+        data = random_bytes(1, 300000)
+
+        root_path.join('file_a').write_binary(data)
+        root_path.join('dir_a').ensure_dir().join('file_b').write('content b')
+
+        blob = FilesystemBlob(store_path, root_path, 'abcdefghi',
+                              blob_format='chunked')
+        blob.add_data('file_a')
+        blob.add_data('dir_a')
+        blob.write()
+
+        assert blob.stored_format == 'chunked'
+
+        out_path = tmpdir.join('out').ensure_dir()
+        FilesystemBlob(store_path, out_path, 'abcdefghi').extract()
+
+        assert out_path.join('file_a').read_binary() == data
+        assert out_path.join('dir_a', 'file_b').read() == 'content b'
+
+    @pytest.mark.parametrize('native', [True, False])
+    def test_chunkers(self, tmpdir, monkeypatch, native):
+        """ Test that both chunkers write files, including empty ones """
+        if not native:
+            monkeypatch.setattr(blob_module, 'fastcdc', None)
+        elif blob_module.fastcdc is None:
+            pytest.skip("fastcdc isn't installed")
+
+        store_path = tmpdir.join('store').ensure_dir()
+        root_path = tmpdir.join('root').ensure_dir()
+        data = random_bytes(4, 300000)
+        root_path.join('file_a').write_binary(data)
+        root_path.join('file_b').write_binary(b'')
+
+        blob = FilesystemBlob(store_path, root_path, 'abcdefghi',
+                              blob_format='chunked')
+        blob.add_data('file_a')
+        blob.add_data('file_b')
+        blob.write()
+
+        assert len(blob.chunk_digests) > 1
+
+        out_path = tmpdir.join('out').ensure_dir()
+        FilesystemBlob(store_path, out_path, 'abcdefghi').extract()
+
+        assert out_path.join('file_a').read_binary() == data
+        assert out_path.join('file_b').read_binary() == b''
+
+    def test_dedupe(self, tmpdir):
+        """ Test that near duplicate blobs share most chunks """
+        store_path = tmpdir.join('store').ensure_dir()
+        data = random_bytes(2, 300000)
+
+        blobs = []
+        for etag, content in (
+            ('aaaaaaaaa', data),
+            ('bbbbbbbbb', data[:150000] + b'new wheel' + data[150000:]),
+        ):
+            root_path = tmpdir.join(etag).ensure_dir()
+            root_path.join('file_a').write_binary(content)
+            blob = FilesystemBlob(store_path, root_path, etag,
+                                  blob_format='chunked')
+            blob.add_data('file_a')
+            blob.write()
+            blobs.append(blob)
+
+        digests_a, digests_b = [blob.chunk_digests for blob in blobs]
+        assert len(digests_b - digests_a) <= 2
+        assert len(list(blobs[0].chunk_store.iter_chunks())) == len(
+            digests_a | digests_b
+        )
+
+    def test_gc_sweeps_chunks(self, tmpdir):
+        """ Test that chunks only used by evicted blobs are removed """
+        store_path = tmpdir.join('store').ensure_dir()
+        root_path = tmpdir.join('root').ensure_dir()
+        root_path.join('file_a').write_binary(random_bytes(3, 100000))
+
+        blob = FilesystemBlob(store_path, root_path, 'abcdefghi',
+                              blob_format='chunked')
+        blob.add_data('file_a')
+        blob.write()
+
+        for chunk_path in blob.chunk_store.iter_chunks():
+            chunk_path.setmtime(1000)
+
+        removed, before, after = gc_blobs(store_path, 0)
+
+        assert [blob.etag for blob, _ in removed] == ['abcdefghi']
+        assert before > 100000
+        assert after == 0
+        assert list(blob.chunk_store.iter_chunks()) == []
+
+
+class TestBlobStats(object):
+    """ Test ``FilesystemBlob`` records ``BlobStats`` """
+    def test_stats(self, tmpdir):
+        """ Test hits, misses, and bytes are counted per label """
+        stats = BlobStats()
+        store_path = tmpdir.join('store').ensure_dir()
+        root_path = tmpdir.join('root').ensure_dir()
+        root_path.join('file_a').write('content a')
+
+        blob = FilesystemBlob.from_files(
+            store_path, root_path, [root_path.join('file_a')],
+            stats=stats, stats_label='project/util',
+        )
+        assert not blob.lookup()
+
+        blob.add_data('file_a')
+        blob.write()
+        assert blob.lookup()
+        assert blob.exists
+
+        blob.extract()
+
+        summary = stats.summary()['project/util']
+        assert summary['hits'] == 1
+        assert summary['misses'] == 1
+        assert summary['hit_rate'] == 0.5
+        assert summary['bytes_hashed'] == 9
+        assert summary['bytes_written'] == 9
+        assert summary['bytes_extracted'] == 9
+        assert summary['writes'] == 1
+        assert summary['extracts'] == 1
+
+    def test_redis_error(self):
+        """ Test that Redis errors don't stop counting in memory """
+        class BrokenRedis(object):
+            """ Redis connection that's always down """
+            def pipeline(self):
+                raise RedisError("Connection refused")
+
+        stats = BlobStats(BrokenRedis())
+        stats.incr('test', hits=1)
+        assert stats.summary()['test']['hits'] == 1
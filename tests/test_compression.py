@@ -0,0 +1,96 @@
+import gzip
+import zlib
+
+import pytest
+
+from dockci.compression import CompressMiddleware
+
+
+def make_app(headers, chunks):
+    """ WSGI app responding with the headers, and body chunks """
+    def app(environ, start_response):
+        start_response('200 OK', headers)
+        return iter(chunks)
+
+    return app
+
+
+def call(app, accept_encoding='gzip'):
+    """ Call the WSGI app, returning headers dict, and body chunks """
+    response = {}
+
+    def start_response(status, headers, exc_info=None):
+        response['headers'] = dict(headers)
+
+    body = list(app({'HTTP_ACCEPT_ENCODING': accept_encoding},
+                    start_response))
+    return response['headers'], body
+
+
+class TestCompressMiddleware(object):
+    """ Test the ``CompressMiddleware`` WSGI middleware """
+    def test_stream_flushed(self):
+        """ Chunks of streams can be decompressed as they arrive """
+        app = CompressMiddleware(make_app(
+            [('Content-Type', 'text/event-stream')],
+            [b'data: one\n\n', b'data: two\n\n'],
+        ))
+        headers, body = call(app)
+
+        assert headers['Content-Encoding'] == 'gzip'
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        assert [decompressor.decompress(chunk) for chunk in body[:2]] == [
+            b'data: one\n\n', b'data: two\n\n',
+        ]
+
+    @pytest.mark.parametrize('headers', [
+        [('Content-Type', 'application/x-tar')],
+        [('Content-Type', 'text/plain'), ('Content-Length', '10')],
+        [('Content-Type', 'text/plain'), ('Content-Encoding', 'gzip')],
+    ])
+    def test_bypass(self, headers):
+        """ Binary, small, and already encoded responses are untouched """
+        app = CompressMiddleware(make_app(headers, [b'x' * 10]))
+        response_headers, body = call(app)
+
+        assert response_headers == dict(headers)
+        assert body == [b'x' * 10]
+
+    def test_write(self):
+        """ Responses using ``write`` are passed through uncompressed """
+        headers = [('Content-Type', 'text/plain')]
+        written = []
+
+        def app(environ, start_response):
+            start_response('200 OK', headers)(b'x' * 2000)
+            return [b'y' * 2000]
+
+        def start_response(status, response_headers, exc_info=None):
+            assert response_headers == headers
+            return written.append
+
+        body = CompressMiddleware(app)(
+            {'HTTP_ACCEPT_ENCODING': 'gzip'}, start_response,
+        )
+        assert written == [b'x' * 2000]
+        assert list(body) == [b'y' * 2000]
+
+    def test_disabled(self):
+        """ Nothing is compressed when disabled """
+        headers = [('Content-Type', 'text/plain')]
+        app = CompressMiddleware(make_app(headers, [b'x' * 2000]),
+                                 enabled=lambda: False)
+        assert call(app) == (dict(headers), [b'x' * 2000])
+
+    def test_large(self):
+        """ Responses over the threshold are compressed, without a length """
+        app = CompressMiddleware(make_app(
+            [('Content-Type', 'application/json'), ('Content-Length', '2000'),
+             ('ETag', '"abc"')],
+            [b'1' * 2000],
+        ))
+        headers, body = call(app, 'br;q=0, gzip')
+
+        assert 'Content-Length' not in headers
+        assert headers['ETag'] == '"abc-gzip"'
+        assert gzip.decompress(b''.join(body)) == b'1' * 2000
@@ -0,0 +1,233 @@
+""" Test the live log fan-out """
+import json
+
+import pytest
+
+from dockci.live_log import (JobFanout,
+                             job_events,
+                             LiveMessage,
+                             _FANOUTS,
+                             )
+
+
+def message(seq, stage_slug='s', body=b'line'):
+    """ Content message for a stage of job ``p/j`` """
+    return LiveMessage(
+        'dockci.p.j.%s.content' % stage_slug, {'seq': seq}, body,
+    )
+
+
+def parse_events(events):
+    """ List of event name, data, and ID from server-sent event strings """
+    parsed = []
+    for event in events:
+        fields = dict(
+            line.split(': ', 1) for line in event.strip().split('\n')
+            if not line.startswith(':')
+        )
+        if fields:
+            parsed.append((
+                fields['event'], json.loads(fields['data']), fields.get('id'),
+            ))
+
+    return parsed
+
+
+@pytest.yield_fixture
+def fanout():
+    """ Registered fan-out, without a consumer thread """
+    fanout = JobFanout('p', 'j', idle_timeout=10)
+    _FANOUTS[fanout.key] = fanout
+    yield fanout
+    _FANOUTS.pop(fanout.key, None)
+
+
+class TestJobFanout(object):
+    """ Test ``JobFanout`` """
+    def test_broadcast(self, fanout):
+        """ All subscribers get each message once """
+        subscriptions = [fanout.subscribe() for _ in range(3)]
+        fanout.broadcast(message(1))
+        fanout.broadcast(message(2))
+
+        for subscription in subscriptions:
+            assert subscription.get(0).headers == {'seq': 1}
+            assert subscription.get(0).headers == {'seq': 2}
+            assert subscription.get(0) is None
+
+    def test_unsubscribe(self, fanout):
+        """ Closed subscribers get no more messages """
+        subscription = fanout.subscribe()
+        subscription.close()
+        fanout.broadcast(message(1))
+
+        assert subscription.get(0) is None
+        assert fanout.subscribers == set()
+
+    def test_slow_subscriber(self, fanout):
+        """ Content beyond the buffer size is summarized, not buffered """
+        slow = fanout.subscribe(max_bytes=8)
+        fast = fanout.subscribe()
+        for seq in range(5):
+            fanout.broadcast(message(seq))
+        fanout.broadcast(LiveMessage('dockci.p.j.s.status', {}, b'{}'))
+
+        assert fanout.subscribers == {slow, fast}
+        assert [slow.get(0).headers['seq'] for _ in range(2)] == [0, 1]
+
+        skipped = slow.get(0)
+        assert skipped.routing_key == 'dockci.p.j.s.skipped'
+        assert skipped.headers == {'bytes': 12, 'seq': 4}
+        assert slow.get(0).kind == 'status'
+        assert len(fast.messages) == 6
+
+    def test_coalesce(self, fanout):
+        """ Consecutive content for a stage is merged, up to a size """
+        subscription = fanout.subscribe()
+        for msg in (
+            message(1), message(2), message(3),
+            message(4, 'other'),
+            message(5), message(6),
+        ):
+            fanout.broadcast(msg)
+
+        merged = subscription.coalesce(subscription.get(0), 0, 10)
+        assert merged.body == b'lineline'
+        assert merged.headers == {'seq': 2}
+
+        merged = subscription.coalesce(subscription.get(0), 0)
+        assert merged.body == b'line'
+        assert merged.headers == {'seq': 3}
+
+        assert subscription.get(0).stage_slug == 'other'
+        merged = subscription.coalesce(subscription.get(0), 0)
+        assert merged.headers == {'seq': 6}
+        assert subscription.get(0) is None
+
+    def test_idle_stop(self, fanout):
+        """ Stops, and unregisters after idle timeout with no subscribers """
+        subscription = fanout.subscribe()
+        assert not fanout._idle_expired(now=100)
+
+        subscription.close()
+        assert not fanout._idle_expired(now=105)
+        assert not fanout._idle_expired(now=114)
+        assert fanout._idle_expired(now=115)
+
+        assert not fanout.running
+        assert fanout.key not in _FANOUTS
+        assert fanout.subscribe().closed
+
+    def test_idle_reset(self, fanout):
+        """ New subscribers reset the idle time """
+        assert not fanout._idle_expired(now=100)
+        subscription = fanout.subscribe()
+        assert not fanout._idle_expired(now=200)
+        subscription.close()
+        assert not fanout._idle_expired(now=205)
+        assert fanout.running
+
+
+@pytest.yield_fixture
+def job_output(tmpdir):
+    """ Logs for a complete ``one`` stage, and partial ``two`` stage """
+    tmpdir.join('one.log').write('first\n')
+    tmpdir.join('two.log').write('second\nthird')
+    yield tmpdir
+
+
+class TestJobEvents(object):
+    """ Test ``job_events`` """
+    def test_complete(self, job_output):
+        """ Complete jobs get all logs, then end """
+        events = parse_events(job_events(
+            job_output, {'result': 'success'},
+            [('one', True), ('two', False)], None, 0,
+        ))
+        assert events == [
+            ('job', {'result': 'success'}, None),
+            ('log', {'stage': 'one', 'data': 'first\n'}, 'one:6'),
+            ('stage', {'stage': 'one', 'success': True}, None),
+            ('log', {'stage': 'two', 'data': 'second\nthird'}, 'two:12'),
+            ('stage', {'stage': 'two', 'success': False}, None),
+            ('end', {}, None),
+        ]
+
+    def test_resume(self, job_output):
+        """ Resume from an event ID skips logs already seen """
+        events = parse_events(job_events(
+            job_output, {'result': 'success'},
+            [('one', True), ('two', False)], None, 0,
+            resume=('two', 7),
+        ))
+        assert events[1:3] == [
+            ('log', {'stage': 'two', 'data': 'third'}, 'two:12'),
+            ('stage', {'stage': 'two', 'success': False}, None),
+        ]
+
+    def test_live(self, fanout, job_output):
+        """ Catch up to init bytes, then stream live messages """
+        subscription = fanout.subscribe()
+        for msg in (
+            message(3, 'two', b'third'),  # Already in the init log
+            message(4, 'two', b'\nfou'),
+            message(5, 'two', b'rth'),
+            message(6, 'three', b'fifth'),
+            LiveMessage('dockci.p.j.three.status', {}, b'{"success": true}'),
+            LiveMessage('dockci.p.j.state', {}, b'{"result": "success"}'),
+        ):
+            fanout.broadcast(msg)
+
+        events = parse_events(job_events(
+            job_output, {'result': None},
+            [('one', True), ('two', None)], 'two', 12, 3,
+            subscription=subscription,
+            keepalive=0,
+        ))
+        assert events[3:] == [
+            ('log', {'stage': 'two', 'data': 'second\nthird'}, 'two:12'),
+            ('log', {'stage': 'two', 'data': '\nfourth'}, 'two:19'),
+            ('log', {'stage': 'three', 'data': 'fifth'}, 'three:5'),
+            ('stage', {'stage': 'three', 'success': True}, None),
+            ('job', {'result': 'success'}, None),
+            ('end', {}, None),
+        ]
+        assert subscription.closed
+
+    def test_keepalive_end(self, fanout, job_output):
+        """ Keepalives while idle, and end when the fan-out stops """
+        subscription = fanout.subscribe()
+        events = job_events(
+            job_output, {'result': None}, [], None, 0, 0,
+            subscription=subscription,
+            keepalive=0,
+        )
+
+        assert next(events) == 'event: job\ndata: {"result": null}\n\n'
+        assert next(events) == ': keepalive\n\n'
+
+        fanout._stop()
+        assert next(events) == 'event: end\ndata: {}\n\n'
+        with pytest.raises(StopIteration):
+            next(events)
+
+    def test_skipped(self, fanout, job_output):
+        """ Skipped content is summarized with its log range """
+        subscription = fanout.subscribe(max_bytes=4)
+        for msg in (
+            message(1, 'two', b'abcd'),
+            message(2, 'two', b'efgh'),
+            message(3, 'two', b'ijkl'),
+            LiveMessage('dockci.p.j.state', {}, b'{"result": "fail"}'),
+        ):
+            fanout.broadcast(msg)
+
+        events = parse_events(job_events(
+            job_output, {'result': None}, [], None, 0,
+            subscription=subscription,
+            keepalive=0,
+        ))
+        assert events[1:3] == [
+            ('log', {'stage': 'two', 'data': 'abcd'}, 'two:4'),
+            ('skipped', {'stage': 'two', 'start': 4, 'end': 12}, 'two:12'),
+        ]
@@ -0,0 +1,37 @@
+from unittest.mock import Mock
+
+import pytest
+
+from dockci.stage_io import get_log_state, redis_log_state_key
+
+
+@pytest.fixture
+def job():
+    """ Mock job with project, and slug """
+    job = Mock(slug='0000a1')
+    job.project.slug = 'dockci'
+    return job
+
+
+class TestGetLogState(object):
+    """ Test the ``get_log_state`` function """
+    def test_key(self, job):
+        """ Test the Redis key for the log state hash """
+        assert redis_log_state_key(job) == 'dockci/dockci/0000a1/log_state'
+
+    def test_state(self, job):
+        """ Test state values are decoded from Redis """
+        redis_conn = Mock()
+        redis_conn.hmget.return_value = [b'docker_build', b'1234', b'56']
+
+        assert get_log_state(redis_conn, job) == ('docker_build', 1234, 56)
+        redis_conn.hmget.assert_called_once_with(
+            'dockci/dockci/0000a1/log_state', 'stage', 'bytes', 'seq',
+        )
+
+    def test_no_state(self, job):
+        """ Test that ``None`` is returned when no state is recorded """
+        redis_conn = Mock()
+        redis_conn.hmget.return_value = [None, None, None]
+
+        assert get_log_state(redis_conn, job) is None
@@ -1,3 +1,5 @@
+import hashlib
+import hmac
 import io
 import json
 import subprocess
@@ -5,9 +7,13 @@ import subprocess
 import docker
 import pytest
 
+from werkzeug.routing import Map, Rule
+
 from dockci.util import (add_to_url_path,
                          client_kwargs_from_config,
                          parse_ref,
+                         UrlTemplate,
+                         verify_github_payload,
                          )
 
 
@@ -163,3 +169,83 @@ class TestAddToUrlPath(object):
     def test_basic(self, in_url, in_path, exp_url):
         """ Test that some basic combinations produce expected outputs """
         assert add_to_url_path(in_url, in_path) == exp_url
+
+
+def github_headers(body, secret='secret', sha1=True, sha256=True):
+    """ Signature headers for a GitHub hook body """
+    headers = {}
+    if sha1:
+        headers['X-Hub-Signature'] = 'sha1=%s' % hmac.new(
+            secret.encode(), body, hashlib.sha1,
+        ).hexdigest()
+    if sha256:
+        headers['X-Hub-Signature-256'] = 'sha256=%s' % hmac.new(
+            secret.encode(), body, hashlib.sha256,
+        ).hexdigest()
+
+    return headers
+
+
+class TestVerifyGithubPayload(object):
+    """ Tests the ``verify_github_payload`` utility """
+    @pytest.mark.parametrize('sha1,sha256', [
+        (True, True),
+        (True, False),
+        (False, True),
+    ])
+    def test_valid(self, sha1, sha256):
+        """ Body is returned when the signature matches """
+        body = b'{"ref": "refs/heads/master"}' * 10000
+        assert verify_github_payload(
+            'secret',
+            github_headers(body, sha1=sha1, sha256=sha256),
+            io.BytesIO(body),
+        ) == body
+
+    @pytest.mark.parametrize('headers', [
+        github_headers(b'{}', secret='other'),
+        github_headers(b'{}', secret='other', sha1=False),
+        dict(github_headers(b'{}'), **{'X-Hub-Signature-256': 'sha256=\xe9'}),
+        {'X-Hub-Signature': 'md5=abc'},
+        {},
+    ])
+    def test_invalid(self, headers):
+        """ None is returned for bad, missing, or unknown signatures """
+        assert verify_github_payload(
+            'secret', headers, io.BytesIO(b'{}'),
+        ) is None
+
+
+class TestUrlTemplate(object):
+    """ Tests for ``dockci.util.UrlTemplate`` """
+    @pytest.mark.parametrize('values', (
+        {'project_slug': 'dockci', 'job_slug': '1a2b'},
+        {'project_slug': 'dock ci/1', 'job_slug': 'été'},
+        {'project_slug': 'dockci', 'job_slug': 12, 'other': 'ignored'},
+    ))
+    def test_matches_build(self, values):
+        """ Paths match a full werkzeug build """
+        url_map = Map([Rule(
+            '/projects/<string:project_slug>/jobs/<string:job_slug>',
+            endpoint='job_detail',
+        )])
+        template = UrlTemplate(next(url_map.iter_rules('job_detail')))
+        path = url_map.bind('localhost').build('job_detail', values)
+
+        assert template.template == '/projects/{project_slug}/jobs/{job_slug}'
+        assert template.build(values) == path.split('?')[0]
+
+    @pytest.mark.parametrize('values', (
+        {'project_slug': 'dockci'},
+        {'project_slug': 'dockci', 'job_slug': None},
+        {'project_slug': 'dockci', 'job_slug': 12},
+    ))
+    def test_no_build(self, values):
+        """ Missing values give None """
+        url_map = Map([Rule(
+            '/projects/<string:project_slug>/jobs/<int:job_id>',
+            endpoint='job_detail',
+        )])
+        template = UrlTemplate(next(url_map.iter_rules('job_detail')))
+
+        assert template.build(values) is None